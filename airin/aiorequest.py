@@ -0,0 +1,257 @@
+import ssl
+import zlib
+import random
+import time
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from airin import request
+from airin.config import settings
+from airin.config.log import logger
+from airin.ratelimit import scheduler
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+"""
+aiorequest是基于asyncio的HTTP标题请求引擎，可同时保持数千个连接
+安装了aiohttp时使用aiohttp，否则使用标准库实现的简易HTTP/1.1客户端
+"""
+
+
+class HTTPError(Exception):
+    pass
+
+
+def _ssl_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    if not settings.request.ssl_verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def _is_congested(error: Exception) -> bool:
+    """
+    与request.is_congested相同，判断异步请求的错误是否可能由拥塞造成
+    """
+    if isinstance(error, ssl.SSLError) or (aiohttp is not None and isinstance(error, aiohttp.ClientSSLError)):
+        return False
+    errors = (asyncio.TimeoutError, ConnectionError)
+    if aiohttp is not None:
+        errors += (aiohttp.ClientConnectionError,)
+    return isinstance(error, errors)
+
+
+def _decoder(encoding: str):
+    """
+    根据Content-Encoding返回增量解压函数，截断的压缩数据也能解出已读取的部分
+    """
+    encoding = encoding.lower()
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+    if encoding == "deflate":
+        return zlib.decompressobj().decompress
+    return bytes
+
+
+async def _iter_body(reader: asyncio.StreamReader, headers: dict):
+    """
+    按Transfer-Encoding/Content-Length逐块读取原始响应内容
+    """
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            line = await reader.readline()
+            remaining = int(line.split(b";")[0].strip() or b"0", 16)
+            if remaining == 0:
+                return
+            while remaining > 0:
+                chunk = await reader.read(min(remaining, 8192))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            await reader.readline()
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 8192))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await reader.read(8192)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def _stdlib_get(url: str, context: ssl.SSLContext) -> (int, dict, bytes, bool):
+    """
+    发送一次GET请求，不处理跳转，响应内容按request.BodyReader的预算读取
+
+    :return : (status, headers, body, truncated)
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if https else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+    connect_timeout, read_timeout = settings.request.timeout_second
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=context if https else None),
+        connect_timeout)
+    try:
+        headers = dict(settings.request.default_headers)
+        headers["Host"] = parts.netloc
+        headers["Connection"] = "close"
+        lines = [f"GET {path} HTTP/1.1"] + [f"{key}: {value}" for key, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        async def read_response():
+            status_line = await reader.readline()
+            fields = status_line.decode("latin-1").split(" ", 2)
+            if len(fields) < 2 or not fields[0].startswith("HTTP/"):
+                raise HTTPError(f"Bad status line: {status_line!r}")
+            resp_headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                resp_headers[key.strip().lower()] = value.strip()
+            body = request.BodyReader()
+            decode = _decoder(resp_headers.get("content-encoding", ""))
+            async for chunk in _iter_body(reader, resp_headers):
+                if body.feed(decode(chunk)):
+                    break
+            return int(fields[1]), resp_headers, bytes(body.content), body.truncated
+
+        return await asyncio.wait_for(read_response(), read_timeout)
+    finally:
+        writer.close()
+
+
+async def _stdlib_fetch(url: str, context: ssl.SSLContext) -> (int, bytes, bool):
+    """
+    标准库实现的GET请求，按照settings.request处理跳转
+    """
+    for i in range(settings.request.redirect_limit + 1):
+        status, headers, body, truncated = await _stdlib_get(url, context)
+        location = headers.get("location")
+        if not (settings.request.allow_redirect and location and status in (301, 302, 303, 307, 308)):
+            return status, body, truncated
+        url = urljoin(url, location)
+    raise HTTPError(f"Exceeded {settings.request.redirect_limit} redirects")
+
+
+async def _aiohttp_fetch(url: str, session) -> (int, bytes, bool):
+    proxy = None
+    if settings.request.enable_proxy:
+        proxy = random.choice(settings.request.proxy_pool).get(urlsplit(url).scheme)
+    async with session.get(url, allow_redirects=settings.request.allow_redirect,
+                           max_redirects=settings.request.redirect_limit, proxy=proxy) as resp:
+        body = request.BodyReader()
+        async for chunk in resp.content.iter_chunked(8192):
+            if body.feed(chunk):
+                break
+        return resp.status, bytes(body.content), body.truncated
+
+
+async def _bulk_request(targets: list, bar) -> list:
+    results = list()
+    limit = asyncio.Semaphore(max(1, settings.request.async_concurrency))
+    host_limits = defaultdict(lambda: asyncio.Semaphore(max(1, settings.request.per_host_limit)))
+    context = _ssl_context()
+    session = None
+    if aiohttp is not None:
+        connect_timeout, read_timeout = settings.request.timeout_second
+        session = aiohttp.ClientSession(
+            headers=settings.request.default_headers,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+            connector=aiohttp.TCPConnector(limit=settings.request.async_concurrency,
+                                           limit_per_host=settings.request.per_host_limit,
+                                           ssl=context),
+            trust_env=False)
+
+    # 与多线程引擎相同，标题在进程池中解析，未开启时在默认线程池中解析，不阻塞事件循环
+    loop = asyncio.get_running_loop()
+    parser = None
+    if settings.request.parse_process_count:
+        parser = ProcessPoolExecutor(max_workers=settings.request.parse_process_count)
+
+    async def worker(itm: dict) -> None:
+        body = None
+        # 先获取单主机限额，等待发送时间后再获取全局限额，避免等待同一主机或速率调度时占用全局名额
+        async with host_limits[itm.get("ip")]:
+            await asyncio.sleep(scheduler.reserve(itm.get("ip")))
+            async with limit:
+                sent = time.monotonic()
+                try:
+                    if session is not None:
+                        status, body, truncated = await _aiohttp_fetch(itm.get("url"), session)
+                    else:
+                        status, body, truncated = await _stdlib_fetch(itm.get("url"), context)
+                    scheduler.feedback(itm.get("ip"), True, sent)
+                except Exception as e:
+                    logger.log("DEBUG", repr(e))
+                    scheduler.feedback(itm.get("ip"), not _is_congested(e), sent)
+                    title = str(e.args)
+                    status = None
+                    truncated = False
+        if body is not None:
+            try:
+                title = await loop.run_in_executor(parser, request.parse_content, body)
+            except Exception as e:
+                # 解析失败不影响状态码
+                logger.log("DEBUG", repr(e))
+                title = str(e.args)
+        results.append({
+            "cidr": itm.get("cidr"),
+            "ip": itm.get("ip"),
+            "port": itm.get("port"),
+            "title": title,
+            "status": status,
+            "truncated": truncated
+        })
+        if bar is not None:
+            bar.update()
+
+    try:
+        await asyncio.gather(*[worker(itm) for itm in targets])
+    finally:
+        if session is not None:
+            await session.close()
+        if parser is not None:
+            parser.shutdown()
+    return results
+
+
+def bulk_request(targets: list, progress: bool = True) -> list:
+    """
+    异步批量请求，返回与request.get_html_info相同结构的结果
+
+    :param list targets: 由{"url", "cidr", "ip", "port"}组成的list
+    :param bool progress: 是否显示进度条，流水线中分批请求时不显示
+    :return list: 由{"cidr", "ip", "port", "title", "status", "truncated"}组成的list
+    """
+    bar = None
+    if progress:
+        logger.log("INFOR", f"Requesting urls in bulk with asyncio ({'aiohttp' if aiohttp else 'stdlib'})")
+        bar = request.get_progress_bar(len(targets))
+    try:
+        return asyncio.run(_bulk_request(targets, bar))
+    finally:
+        if bar is not None:
+            bar.close()
@@ -0,0 +1,511 @@
+import math
+import time
+import errno
+import socket
+import select
+import asyncio
+import threading
+from queue import Queue
+from collections import deque
+from functools import lru_cache
+
+from airin.config import settings
+from airin.config.log import logger
+from airin.iptools import int_to_ip, parse_target
+from airin.ratelimit import scheduler
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+"""
+aioscan是基于asyncio的TCP connect扫描引擎，不依赖nmap和特权模式，
+直接用非阻塞socket发起连接并在事件循环中注册回调，不为每次连接创建协程，
+Linux下所有socket注册到一个epoll中，事件循环只监听该epoll，
+单核每秒可进行数万次连接尝试，速率由ratelimit.scheduler调度，扫描结果与nmap.PortScanner.scan的结构相同
+"""
+
+# 仿照nmap的extraports，某种非open状态的端口超过该数量时不逐个列出
+EXTRAPORTS_THRESHOLD = 25
+# 同时轮流扫描的目标数量，目标大多为一个/24，轮流扫描时不会因单个/24的速率限制而停顿
+ACTIVE_TARGETS = 64
+# 连接失败的错误码对应的端口状态和原因
+_ERRNO_STATES = {
+    errno.ECONNREFUSED: ("closed", "conn-refused"),
+    errno.ETIMEDOUT: ("filtered", "no-response"),
+    errno.EHOSTUNREACH: ("filtered", "host-unreach"),
+    errno.ENETUNREACH: ("filtered", "net-unreach")
+}
+_LINGER_RST = b"\x01\x00\x00\x00\x00\x00\x00\x00"  # SO_LINGER(1, 0)，关闭时直接发送RST，不进入TIME_WAIT
+# 内核首次重传SYN的等待秒数，连接耗时超过该值说明第一个SYN或其应答被丢弃
+SYN_RTO = 1.0
+
+
+def _concurrency() -> int:
+    """
+    同时进行的连接数，不超过进程可打开的文件描述符数量
+    """
+    concurrency = max(1, int(settings.netscan.async_concurrency))
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and concurrency > soft - 64:
+            logger.log("ALERT", f"Open files limit is {soft}, asyncio concurrency reduced to {max(1, soft - 64)}")
+            concurrency = max(1, soft - 64)
+    return concurrency
+
+
+def _parse_ports(ports: str) -> list:
+    """
+    解析nmap格式的端口列表，如"22,80,8000-8010"
+    """
+    result = list()
+    for part in str(ports).split(","):
+        low, _, high = part.strip().partition("-")
+        if low:
+            result += range(int(low), int(high or low) + 1)
+    return result
+
+
+def _target_hosts(target: str):
+    """
+    逐个生成扫描目标包含的IPv4地址（整数）
+
+    :param str target :  IP/CIDR/IP范围/FilePath
+    :return : 生成器
+    """
+    try:
+        version, start, end = parse_target(target)
+    except ValueError:
+        with open(target, 'r') as target_file:
+            for line in target_file:
+                if line.strip():
+                    yield from _target_hosts(line.strip())
+        return None
+    if version != 4:
+        logger.log("ALERT", f"IPv6 target is not supported yet: {target}")
+        return None
+    yield from _spread(start, end)
+
+
+def _spread(start: int, end: int):
+    """
+    逐个生成[start, end]中的整数，超过256个地址时按与数量互质的步长跳跃，
+    相邻的地址落在不同的/24网段，避免集中探测同一网段
+    """
+    count = end - start + 1
+    if count <= 256:
+        yield from range(start, end + 1)
+        return None
+    stride = 257
+    while math.gcd(stride, count) != 1:
+        stride += 1
+    for i in range(count):
+        yield start + i * stride % count
+
+
+def _banner_text(banner: bytes) -> str:
+    """
+    banner的第一行，不可打印字符转义，用作extrainfo
+    """
+    line = banner.split(b"\n", 1)[0].strip()
+    return "".join(chr(c) if 32 <= c < 127 else f"\\x{c:02x}" for c in line)
+
+
+@lru_cache(maxsize=65536)
+def _service_name(port: int) -> str:
+    try:
+        return socket.getservbyport(port, "tcp")
+    except OSError:
+        return ""
+
+
+def _host_data(host: str, probes: dict, with_ports: bool) -> dict:
+    """
+    将一个主机的探测结果转换为与nmap.PortScanner.scan相同结构的数据，没有任何响应时返回None
+
+    :param dict probes :  {port: (state, reason, banner)}
+    """
+    responses = [itm for itm in probes.values() if itm[0] != "filtered"]
+    if not responses:
+        return None
+    data = {
+        "hostnames": list(),
+        "addresses": {"ipv4": host},
+        "status": {"state": "up", "reason": responses[0][1]}
+    }
+    if not with_ports:
+        return data
+    counts = dict()
+    for state, reason, banner in probes.values():
+        counts[state] = counts.get(state, 0) + 1
+    tcp = dict()
+    for port, (state, reason, banner) in sorted(probes.items()):
+        if state != "open" and counts[state] > EXTRAPORTS_THRESHOLD:
+            continue
+        tcp[port] = {
+            "state": state,
+            "reason": reason,
+            "name": _service_name(port),
+            "product": "",
+            "version": "",
+            "extrainfo": _banner_text(banner) if banner else "",
+            "conf": "3",  # 与nmap相同，根据端口号推测服务名时可信度为3
+            "cpe": "",
+            "banner": banner
+        }
+    data["tcp"] = tcp
+    return data
+
+
+class _Probe(object):
+    """
+    一次正在进行的连接，stage为"connect"/"banner"/"done"
+    """
+    __slots__ = ("target", "state", "host_state", "port", "sock", "stage", "retries", "sent", "started", "dropped")
+
+    def __init__(self, target: str, state: dict, host_state: dict, port: int):
+        self.target = target
+        self.state = state
+        self.host_state = host_state
+        self.port = port
+        self.sock = None
+        self.stage = "connect"
+        self.retries = 0
+        self.sent = 0.0  # 第一次发起连接的时间
+        self.started = 0.0  # 本次发起连接的时间
+        self.dropped = False  # 是否发生过丢包：超时后重试或内核重传SYN后才有响应
+
+
+class _Sweep(object):
+    """
+    按目标顺序逐个主机、逐个端口发起连接，同时进行的连接数受限，每次连接前向ratelimit.scheduler预约发送时间
+
+    连接在事件循环中以回调完成（有epoll时批量处理epoll事件，否则使用add_writer/add_reader），所有连接使用相同的超时时间，
+    按开始顺序放入一个队列，定期处理到期的连接，比每个连接一个协程和定时器的开销小得多。
+    一个主机的所有端口探测完成后即放入结果队列，一个目标的所有主机完成后放入结束标记。
+    连接超时后重试，重试后或耗时超过SYN_RTO才有响应说明发生了丢包，作为拥塞信号报告给调度器
+    """
+
+    def __init__(self, targets: list, stype: str, ports: dict, results: Queue):
+        self.targets = targets
+        self.stype = stype
+        self.ports = ports
+        self.results = results
+        self.with_ports = stype != "alive"
+        self.banner = stype == "banner" or (stype == "port" and settings.netscan.enable_banner)
+        self.concurrency = 1
+        self.stopped = threading.Event()
+        self.attempts = 0
+        self._probes = self._iter_probes()
+        self._exhausted = False
+        self._active = 0  # 已打开的socket数量
+        self._delayed = 0  # 已预约、等待发送时间的连接数量
+        # 连接和banner的超时时间不同，分别按开始顺序放入队列，队首总是最早到期
+        self._deadlines = {"connect": deque(), "banner": deque()}
+        self._loop = None
+        self._finished = None
+        self._epoll = None
+        self._by_fd = dict()  # 注册到epoll的 {fd: _Probe}
+
+    def _target_ports(self, target: str) -> list:
+        if target in self.ports:
+            return _parse_ports(self.ports[target])
+        if self.stype == "alive":
+            return list(settings.netscan.alive_ports)
+        return list(settings.netscan.ports)
+
+    def _target_probes(self, target: str):
+        """
+        逐个主机生成该主机所有端口的_Probe组成的list，目标的主机全部生成后标记exhausted
+        """
+        state = {"pending": 0, "exhausted": False, "up": 0, "total": 0, "start": time.time()}
+        try:
+            ports = sorted(set(self._target_ports(target)))
+            if not ports:
+                raise ValueError(f"No ports to scan: {target}")
+            for host in _target_hosts(target):
+                host_state = {"ip": int_to_ip(host), "int": host, "pending": len(ports), "probes": dict()}
+                state["pending"] += 1
+                state["total"] += 1
+                yield [_Probe(target, state, host_state, port) for port in ports]
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+            state["failed"] = True
+        state["exhausted"] = True
+        self._check_target(target, state)
+
+    def _iter_probes(self):
+        """
+        逐个生成_Probe，同时轮流从最多ACTIVE_TARGETS个目标中各取一个主机
+        """
+        targets = iter(self.targets)
+        active = deque()
+        while True:
+            while len(active) < ACTIVE_TARGETS:
+                target = next(targets, None)
+                if target is None:
+                    break
+                active.append(self._target_probes(target))
+            if not active:
+                return None
+            hosts = active.popleft()
+            probes = next(hosts, None)
+            if probes is not None:
+                active.append(hosts)
+                yield from probes
+
+    def _check_target(self, target: str, state: dict) -> None:
+        if state["exhausted"] and state["pending"] == 0:
+            if state.get("failed"):
+                self.results.put((target, False))
+                return None
+            elapsed = time.time() - state["start"]
+            self.results.put((target, {
+                "nmap": {"command_line": f"aioscan {self.stype} {target}",
+                         "scanstats": {"elapsed": f"{elapsed:.2f}", "uphosts": str(state["up"]),
+                                       "downhosts": str(state["total"] - state["up"]),
+                                       "totalhosts": str(state["total"])}},
+                "scan": dict()}))
+            self.results.put((target, None))
+
+    def _record(self, probe: _Probe, status: str, reason: str, banner: bytes = b"") -> None:
+        """
+        记录一次连接的结果，主机的所有端口完成时输出该主机
+        """
+        self._close(probe)
+        probe.stage = "done"
+        if status != "filtered":
+            scheduler.feedback(probe.host_state["int"], not probe.dropped, probe.sent)
+        elif reason == "local-error":
+            scheduler.feedback(probe.host_state["int"], False, probe.sent)
+        host_state = probe.host_state
+        host_state["probes"][probe.port] = (status, reason, banner)
+        host_state["pending"] -= 1
+        if host_state["pending"] > 0:
+            return None
+        state = probe.state
+        data = _host_data(host_state["ip"], host_state["probes"], self.with_ports)
+        if data is not None:
+            state["up"] += 1
+            self.results.put((probe.target, {"scan": {host_state["ip"]: data}}))
+        state["pending"] -= 1
+        self._check_target(probe.target, state)
+
+    def _watch(self, probe: _Probe) -> None:
+        """
+        等待连接完成（stage为"connect"）或banner到达（stage为"banner"）
+        """
+        fd = probe.sock.fileno()
+        if self._epoll is not None:
+            # EPOLLONESHOT触发一次后自动停止监听，关闭socket时自动从epoll中移除，无需额外的系统调用
+            if probe.stage == "connect":
+                self._epoll.register(fd, select.EPOLLOUT | select.EPOLLONESHOT)
+            else:
+                self._epoll.modify(fd, select.EPOLLIN | select.EPOLLONESHOT)
+            self._by_fd[fd] = probe
+        elif probe.stage == "connect":
+            self._loop.add_writer(fd, self._on_writable, probe)
+        else:
+            self._loop.add_reader(fd, self._on_readable, probe)
+
+    def _unwatch(self, probe: _Probe) -> None:
+        fd = probe.sock.fileno()
+        if self._epoll is not None:
+            self._by_fd.pop(fd, None)
+        elif probe.stage == "connect":
+            self._loop.remove_writer(fd)
+        else:
+            self._loop.remove_reader(fd)
+
+    def _close(self, probe: _Probe) -> None:
+        if probe.sock is not None:
+            probe.sock.close()
+            probe.sock = None
+            self._active -= 1
+
+    def _connected(self, probe: _Probe, err: int) -> None:
+        if probe.retries > 0 or time.monotonic() - probe.started >= SYN_RTO:
+            probe.dropped = True
+        if err != 0:
+            status, reason = _ERRNO_STATES.get(err, ("filtered", errno.errorcode.get(err, str(err)).lower()))
+            self._record(probe, status, reason)
+        elif self.banner:
+            probe.stage = "banner"
+            self._watch(probe)
+            self._deadlines["banner"].append((time.monotonic() + settings.netscan.banner_timeout, probe))
+        else:
+            self._record(probe, "open", "syn-ack")
+
+    def _schedule(self, probe: _Probe) -> None:
+        wait = scheduler.reserve(probe.host_state["int"])
+        if wait > 0:
+            self._delayed += 1
+            self._loop.call_later(wait, self._delayed_start, probe)
+        else:
+            self._start(probe)
+
+    def _delayed_start(self, probe: _Probe) -> None:
+        self._delayed -= 1
+        self._start(probe)
+        self._fill()
+
+    def _start(self, probe: _Probe) -> None:
+        self.attempts += 1
+        probe.started = time.monotonic()
+        if probe.retries == 0:
+            probe.sent = probe.started
+        try:
+            probe.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._active += 1
+            probe.sock.setblocking(False)
+            probe.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RST)
+            err = probe.sock.connect_ex((probe.host_state["ip"], probe.port))
+        except OSError as identifier:
+            # 如文件描述符或本地端口耗尽等错误，记为filtered
+            logger.log("DEBUG", repr(identifier))
+            self._record(probe, "filtered", "local-error")
+            return None
+        if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._watch(probe)
+            self._deadlines["connect"].append((time.monotonic() + settings.netscan.connect_timeout, probe))
+        else:
+            self._connected(probe, err)
+
+    def _ready(self, probe: _Probe) -> None:
+        if probe.stage == "connect":
+            self._connected(probe, probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+            return None
+        try:
+            banner = probe.sock.recv(settings.netscan.banner_size)
+        except OSError:
+            banner = b""
+        self._record(probe, "open", "syn-ack", banner)
+
+    def _on_writable(self, probe: _Probe) -> None:
+        self._unwatch(probe)
+        self._ready(probe)
+        self._fill()
+
+    _on_readable = _on_writable
+
+    def _on_epoll(self) -> None:
+        """
+        epoll可读时批量处理已就绪的socket
+        """
+        for fd, event in self._epoll.poll(0):
+            probe = self._by_fd.pop(fd, None)
+            if probe is not None:
+                self._ready(probe)
+        self._fill()
+
+    def _expire(self) -> None:
+        """
+        处理到期的连接：连接阶段超时为filtered，等待banner超时为没有banner的open
+        """
+        now = time.monotonic()
+        for stage, deadlines in self._deadlines.items():
+            while deadlines and deadlines[0][0] <= now:
+                deadline, probe = deadlines.popleft()
+                if probe.stage != stage:
+                    continue  # 已完成或已进入下一阶段
+                self._unwatch(probe)
+                if stage == "banner":
+                    self._record(probe, "open", "syn-ack")
+                elif probe.retries < settings.netscan.connect_retries:
+                    self._close(probe)
+                    probe.retries += 1
+                    self._schedule(probe)
+                else:
+                    self._record(probe, "filtered", "no-response")
+        self._fill()
+
+    def _fill(self) -> None:
+        """
+        在并发数允许的范围内预约新的连接，全部完成时结束扫描
+        """
+        while not self._exhausted and self._active + self._delayed < self.concurrency:
+            if self.stopped.is_set():
+                self._exhausted = True
+                break
+            probe = next(self._probes, None)
+            if probe is None:
+                self._exhausted = True
+                break
+            self._schedule(probe)
+        if self._exhausted and self._active == 0 and self._delayed == 0 and not self._finished.done():
+            self._finished.set_result(None)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._finished = self._loop.create_future()
+        self.concurrency = _concurrency()
+        interval = min(0.05, settings.netscan.connect_timeout, settings.netscan.banner_timeout)
+        start = time.time()
+        if hasattr(select, "epoll"):
+            self._epoll = select.epoll()
+            self._loop.add_reader(self._epoll.fileno(), self._on_epoll)
+        try:
+            self._fill()
+            while not self._finished.done():
+                await asyncio.wait([self._finished], timeout=interval)
+                self._expire()
+        finally:
+            if self._epoll is not None:
+                self._loop.remove_reader(self._epoll.fileno())
+                self._epoll.close()
+        elapsed = time.time() - start
+        logger.log("DEBUG", f"asyncio {self.stype} scan: {self.attempts} connection attempts in {elapsed:.2f}s")
+
+
+def _run_sweep(sweep: _Sweep) -> None:
+    try:
+        asyncio.run(sweep.run())
+    except Exception as identifier:
+        logger.log("ERROR", repr(identifier))
+    finally:
+        sweep.results.put((None, None))  # 标记引擎结束
+
+
+def ScanPool(targets: list, stype: str = "alive", on_done=None, ports: dict = None):
+    """
+    asyncio扫描后端，参数和返回值与netscan._ScanPool相同
+
+    存活探测向settings.netscan.alive_ports发起连接，收到SYN/ACK或RST即为存活；
+    端口扫描使用settings.netscan.ports，"port"类型在开启settings.netscan.enable_banner时读取开放端口的banner，
+    "banner"类型总是读取banner，用于对已知的开放端口读取banner
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :param str stype    :  扫描类型，"alive"/"discovery"/"port"/"banner"可选，默认"alive"
+    :param on_done      :  目标扫描成功且其结果全部返回后以target为参数调用，用于记录断点
+    :param dict ports   :  {target: 端口列表字符串}，只扫描目标的这些端口，默认None
+    :return : 生成(target, scan result)的生成器
+    """
+    targets = list(dict.fromkeys(str(target) for target in targets))
+    if len(targets) == 0:
+        return None
+    results = Queue()
+    sweep = _Sweep(targets, stype, ports or dict(), results)
+    thread = threading.Thread(target=_run_sweep, args=(sweep,), name="AsyncScanThread", daemon=True)
+    thread.start()
+    len_targets = len(targets)
+    try:
+        while True:
+            target, data = results.get()
+            if target is None:
+                break
+            if data is None or data is False:
+                len_targets -= 1
+                logger.log("INFOR", f"The last {len_targets} targets")
+                if data is None and on_done is not None:
+                    on_done(target)
+                continue
+            if data.get("nmap"):
+                scanstats = data["nmap"]["scanstats"]
+                logger.log("ALERT", f"elapsed: {scanstats['elapsed']}  \tuphosts: {scanstats['uphosts']}  "
+                                    f"\ttotalhosts: {scanstats['totalhosts']}")
+            yield target, data
+    finally:
+        sweep.stopped.set()
+        thread.join()
@@ -1,15 +1,24 @@
 import csv
 import json
+import gzip
+import codecs
 import time
 import copy
 import pathlib
-import random
+import sys
+import tempfile
 
-from re import match
-from IPy import IP
+from array import array
+from collections import Counter
+from itertools import islice
 
 from airin.config import settings
 from airin.config.log import logger
+from airin.iptools import CidrIndex, cidr_to_range, in_ranges, ip_to_int, int_to_ip, merge_intervals, parse_cidr, parse_target, range_to_cidrs, range_to_prefixes
+
+
+TARGETS_FILE_SIZE = 256  # create_targets_file每个文件包含的主机数量
+JSON_BLOCK_SIZE = 1 << 20  # 流式解析json数组时每次读取的字符数
 
 
 def _data_sort(data: dict, reverse: bool = True) -> dict:
@@ -31,67 +40,68 @@ def _data_sort(data: dict, reverse: bool = True) -> dict:
 
 
 def _distribution(ip_dict: dict, cidr_dict: dict) -> dict:
+    """
+    将IP分配到包含它的最长前缀CIDR，不属于任何CIDR的IP归入其所在的/24子网
+
+    :param dict ip_dict   :  {IP: {domain: None}}
+    :param dict cidr_dict :  {CIDR: {}}
+    :return : 经排序的{CIDR: {IP: {"domain": str}}}
+    :rtype  : dict
+    """
     results = cidr_dict
+    cidr_index = CidrIndex(cidr_dict)
     for ip in ip_dict:
-        no_cidr = True
-        for cidr in cidr_dict:
-            if ip in IP(cidr):
-                results[cidr][ip] = {"domain": ",".join(ip_dict.get(ip))}
-                no_cidr = False
-                break
-        if no_cidr:
-            tmp = ip.split(".")
-            tmp[-1] = "0"
-            tmp = f'{".".join(tmp)}/24'
-            results[tmp] = dict()
-            results[tmp][ip] = {"domain": ",".join(ip_dict.get(ip))}
+        cidr = cidr_index.lookup(ip)
+        if cidr is None:
+            try:
+                cidr = f"{int_to_ip(ip_to_int(ip) & 0xFFFFFF00)}/24"
+            except ValueError:
+                logger.log("TRACE", f"Bad IP: {ip}")
+                continue
+            results[cidr] = dict()
+            cidr_index.add(cidr)
+        results[cidr][ip] = {"domain": ",".join(ip_dict.get(ip))}
 
     return _data_sort(results)
 
 
-def _analysis_str_list(data: list) -> (dict, dict):
+def _analysis_str_list(data: list, ip_dict: dict, cidr_dict: dict) -> (dict, dict):
     """
-    数据分析，将原始数据分配到各个相应的list或dict
+    数据分析，将原始数据分配到各个相应的dict
 
-    :param list data :  由str组成的list
+    :param list data      :  由IP/CIDR/IP范围字符串组成的list
+    :param dict ip_dict   :  已提取的IP，结果追加到其中
+    :param dict cidr_dict :  已提取的CIDR，结果追加到其中
     :return : 经提取的数据
-    :rtype  : (list, dict)
+    :rtype  : (dict, dict)
     """
-    data = list(set(data))
-    ip_dict = dict()
-    cidr_dict = dict()
     for itm in data:
-        if match("^\d+\.\d+\.\d+\.\d+/\d+$", itm):  # 匹配CIDR
-            cidr_dict[itm] = dict()
-        elif match("^\d+\.\d+\.\d+\.\d+$", itm):  # 匹配IPv4
-            ip_dict[itm] = dict()
-        else:
+        try:
+            version, start, end = parse_target(itm)
+        except ValueError:
             logger.log("TRACE", f"Bad list item: {itm}")
+            continue
+        if version != 4:
+            logger.log("ALERT", f"IPv6 target is not supported yet: {itm}")
+        elif start == end and "/" not in itm:  # 单个IPv4
+            ip_dict.setdefault(int_to_ip(start), dict())
+        else:  # CIDR或IP范围，IP范围转换为最少的CIDR
+            for cidr in range_to_cidrs(start, end):
+                cidr_dict[cidr] = dict()
 
-    try:
-        ip_dict.pop("")
-    except:
-        pass
-    try:
-        cidr_dict.pop("")
-    except:
-        pass
-
-    logger.log("TRACE", f"IP dict: {ip_dict}")
-    logger.log("TRACE", f"CIDR dict: {cidr_dict}")
     return ip_dict, cidr_dict
 
 
-def _analysis_dict_list(data: list) -> (dict, dict):
+def _analysis_dict_list(data: list, ip_dict: dict, cidr_dict: dict) -> (dict, dict):
     """
-    数据分析，将原始数据分配到各个相应的list或dict
+    数据分析，将原始数据分配到各个相应的dict
 
-    :param list data:  由dict组成的list
+    :param list data      :  由dict组成的list
+    :param dict ip_dict   :  已提取的IP，结果追加到其中
+    :param dict cidr_dict :  已提取的CIDR，结果追加到其中
     :return : 经提取的数据
     :rtype  : (dict, dict)
     """
-    ip_dict = dict()
-    cidr_dict = dict()
     if settings.analysis.ip_field is None:
         logger.log("ERROR", "IP field is not set in settings!")
         return ip_dict, cidr_dict
@@ -108,17 +118,6 @@ def _analysis_dict_list(data: list) -> (dict, dict):
             else:
                 ip_dict[ip] = dict()
 
-    try:
-        ip_dict.pop("")
-    except:
-        pass
-    try:
-        cidr_dict.pop("")
-    except:
-        pass
-
-    logger.log("TRACE", f"IP dict: {ip_dict}")
-    logger.log("TRACE", f"CIDR dict: {cidr_dict}")
     return ip_dict, cidr_dict
 
 
@@ -133,6 +132,57 @@ def _data_statistics(data: dict) -> None:
     logger.log("TRACE", f"Data: {data}")
 
 
+class DataReducer(object):
+    """
+    增量数据整理
+
+    可以多次调用feed传入由dict或str组成的数据块，只保留提取出的IP和CIDR，不保留原始数据，
+    全部传入后调用result转换成{CIDR: {IP: {}}}这种格式
+    """
+
+    def __init__(self):
+        self.ip_dict = dict()
+        self.cidr_dict = dict()
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def feed(self, data: list) -> None:
+        """
+        传入一个数据块
+
+        :param list data : 由dict或str组成的list
+        """
+        if len(data) == 0:
+            return None
+        if type(data[0]) is str:  # 假定整个list都由str组成
+            _analysis_str_list(data, self.ip_dict, self.cidr_dict)
+        elif type(data[0]) is dict:  # 假定整个list都由dict组成
+            _analysis_dict_list(data, self.ip_dict, self.cidr_dict)
+        else:
+            logger.log("ALERT", "Bad list")
+        self.count += len(data)
+
+    def result(self) -> dict:
+        """
+        将已传入的数据转换成{CIDR: {IP: {}}}这种格式
+
+        :return : 经转换的数据
+        :rtype  : dict
+        """
+        logger.log("INFOR", "Data reduction start")
+        self.ip_dict.pop("", None)
+        self.cidr_dict.pop("", None)
+        logger.log("TRACE", f"IP dict: {self.ip_dict}")
+        logger.log("TRACE", f"CIDR dict: {self.cidr_dict}")
+        results = _distribution(self.ip_dict, self.cidr_dict)
+        _data_statistics(results)
+        logger.log("INFOR", "Data reduction finish")
+
+        return results
+
+
 def data_reduction(data: list) -> dict:
     """
     数据整理，将原始数据转换成{CIDR: {IP: {}}}这种格式
@@ -141,22 +191,219 @@ def data_reduction(data: list) -> dict:
     :return : 经转换的数据
     :rtype  : dict
     """
-    results = dict()
-    ip_dict = dict()
-    cidr_dict = dict()
-    logger.log("INFOR", "Data reduction start")
-    if type(data[0]) is str:  # 假定整个list都由str组成
-        ip_dict, cidr_dict = _analysis_str_list(data)
-        results = _distribution(ip_dict, cidr_dict)
-    elif type(data[0]) is dict:  # 假定整个list都由dict组成
-        ip_dict, cidr_dict = _analysis_dict_list(data)
-        results = _distribution(ip_dict, cidr_dict)
-    else:
-        logger.log("ALERT", "Bad list")
-    _data_statistics(results)
-    logger.log("INFOR", "Data reduction finish")
+    reducer = DataReducer()
+    reducer.feed(data)
+    return reducer.result()
+
+
+PORT_FIELDS = ("state", "reason", "name", "product", "version",
+               "extrainfo", "conf", "cpe", "title", "status", "truncated")
 
-    return results
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class PortRecord(object):
+    """
+    端口记录，使用__slots__代替dict以减少内存占用，字符串字段会被驻留(intern)
+    """
+    __slots__ = ("port",) + PORT_FIELDS
+
+    def __init__(self, port: int, info: dict):
+        self.port = port
+        self.update(info)
+
+    def update(self, info: dict) -> None:
+        for field in PORT_FIELDS:
+            setattr(self, field, _intern(info.get(field)))
+
+    def get(self, field: str, default=None):
+        return getattr(self, field, default)
+
+
+class HostStore(object):
+    """
+    紧凑的主机数据存储，替代{CIDR: {IP: {...}}}结构
+
+    IP以uint32形式保存在array中，域名字符串统一编号存放，端口信息保存为PortRecord。
+    对外提供只读的映射接口：迭代得到CIDR，store[cidr]得到该CIDR下的IP列表，
+    因此filtr_cidr_targets、cut_mask、_data_statistics等函数可以直接使用
+    """
+
+    def __init__(self, data: dict = None):
+        self._cidrs = list()            # CIDR字符串，按添加顺序保存
+        self._cidr_ids = dict()         # CIDR字符串 -> CIDR编号
+        self._cidr_index = CidrIndex()
+        self._members = list()          # CIDR编号 -> 主机编号array
+        self._ips = array("I")          # 主机编号 -> IP整数
+        self._host_cidr = array("I")    # 主机编号 -> CIDR编号
+        self._host_domain = array("i")  # 主机编号 -> 域名编号，-1表示无
+        self._host_ids = dict()         # IP整数 -> 主机编号
+        self._domains = list()          # 域名编号 -> 域名字符串
+        self._domain_ids = dict()       # 域名字符串 -> 域名编号
+        self._ports = dict()            # 主机编号 -> PortRecord组成的list
+        if data:
+            for cidr in data:
+                self.add_cidr(cidr)
+                for ip in data[cidr]:
+                    info = data[cidr][ip]
+                    host_id = self.add_host(cidr, ip, info.get("domain"))
+                    if info.get("ports"):
+                        self._set_ports(host_id, info.get("ports"))
+
+    def __iter__(self):
+        return iter(self._cidrs)
+
+    def __len__(self) -> int:
+        return len(self._cidrs)
+
+    def __contains__(self, cidr: str) -> bool:
+        return cidr in self._cidr_ids
+
+    def __getitem__(self, cidr: str) -> list:
+        return [int_to_ip(self._ips[host_id]) for host_id in self._members[self._cidr_ids[cidr]]]
+
+    def ip_ints(self, cidr: str) -> list:
+        """
+        返回CIDR下IP的整数形式，避免转换为字符串后再解析
+        """
+        return [self._ips[host_id] for host_id in self._members[self._cidr_ids[cidr]]]
+
+    def get(self, cidr: str, default=None) -> list:
+        if cidr not in self._cidr_ids:
+            return default
+        return self[cidr]
+
+    def host_count(self) -> int:
+        return len(self._ips)
+
+    def add_cidr(self, cidr: str) -> int:
+        cidr_id = self._cidr_ids.get(cidr)
+        if cidr_id is None:
+            cidr_id = len(self._cidrs)
+            self._cidrs.append(cidr)
+            self._cidr_ids[cidr] = cidr_id
+            self._cidr_index.add(cidr)
+            self._members.append(array("I"))
+        return cidr_id
+
+    def _domain_id(self, domain: str) -> int:
+        if domain is None:
+            return -1
+        domain_id = self._domain_ids.get(domain)
+        if domain_id is None:
+            domain_id = len(self._domains)
+            self._domains.append(domain)
+            self._domain_ids[domain] = domain_id
+        return domain_id
+
+    def add_host(self, cidr: str, ip: str, domain: str = None) -> int:
+        """
+        添加主机，主机已存在时返回原有编号
+
+        :param str cidr   :  主机所属CIDR
+        :param str ip     :  IPv4地址
+        :param str domain :  域名，多个域名以逗号分隔
+        :return : 主机编号
+        :rtype  : int
+        """
+        ip_int = ip_to_int(ip)
+        host_id = self._host_ids.get(ip_int)
+        if host_id is not None:
+            return host_id
+        cidr_id = self.add_cidr(cidr)
+        host_id = len(self._ips)
+        self._ips.append(ip_int)
+        self._host_cidr.append(cidr_id)
+        self._host_domain.append(self._domain_id(domain))
+        self._host_ids[ip_int] = host_id
+        self._members[cidr_id].append(host_id)
+        return host_id
+
+    def _set_ports(self, host_id: int, ports: dict) -> list:
+        records = self._ports.setdefault(host_id, list())
+        known = {record.port: record for record in records}
+        touched = list()
+        for port in ports:
+            record = known.get(port)
+            if record is None:
+                record = PortRecord(port, ports.get(port))
+                records.append(record)
+            else:
+                record.update(ports.get(port))
+            touched.append(record)
+        return touched
+
+    def _domain(self, host_id: int) -> str:
+        domain_id = self._host_domain[host_id]
+        return self._domains[domain_id] if domain_id >= 0 else None
+
+    def integrate_alive(self, ips: list) -> None:
+        """
+        将存活主机添加到其所属的CIDR，不属于任何CIDR的主机会被忽略
+
+        :param list ips :  IPv4地址组成的list
+        """
+        for ip in ips:
+            cidr = self._cidr_index.lookup(ip)
+            if cidr is not None:
+                self.add_host(cidr, ip)
+
+    def integrate_ports(self, newdata: dict) -> list:
+        """
+        将netscan.PortScan的结果写入存储
+
+        :param dict newdata :  {IP: {"ports": {port: {...}}}}
+        :return : 用于Database.insert_table的tuple组成的list
+        :rtype  : list
+        """
+        conver = list()
+        for ip in newdata:
+            cidr = self._cidr_index.lookup(ip)
+            if cidr is None:
+                continue
+            host_id = self.add_host(cidr, ip)
+            domain = self._domain(host_id)
+            for record in self._set_ports(host_id, newdata[ip].get("ports") or dict()):
+                conver.append((cidr, ip, domain, record.port) +
+                              tuple(getattr(record, field) for field in PORT_FIELDS))
+        return conver
+
+    def update_http(self, ip: str, port: int, title: str, status: int, truncated: int = None) -> None:
+        host_id = self._host_ids.get(ip_to_int(ip))
+        if host_id is None:
+            return None
+        for record in self._ports.get(host_id, list()):
+            if record.port == port:
+                record.title = title
+                record.status = status
+                record.truncated = truncated
+
+    def rows(self):
+        """
+        按CIDR顺序逐行生成与data_conversion相同结构的dict
+
+        :return : 生成器
+        """
+        for cidr_id, cidr in enumerate(self._cidrs):
+            for host_id in self._members[cidr_id]:
+                ip = int_to_ip(self._ips[host_id])
+                domain = self._domain(host_id)
+                records = self._ports.get(host_id)
+                if records:
+                    for record in records:
+                        row = {"cidr": cidr, "ip": ip, "domain": domain, "port": record.port}
+                        for field in PORT_FIELDS:
+                            row[field] = getattr(record, field)
+                        yield row
+                else:
+                    row = {"cidr": cidr, "ip": ip, "domain": domain, "port": None}
+                    for field in PORT_FIELDS:
+                        row[field] = None
+                    yield row
 
 
 def cut_mask(targets: list, data: dict, minmask: int = settings.analysis.min_mask) -> list:
@@ -169,66 +416,125 @@ def cut_mask(targets: list, data: dict, minmask: int = settings.analysis.min_mas
     :return : 由CIDR组成的list
     :rtype  : list
     """
-    list_len = len(targets) -1
-    while list_len >= 0:
-        if int(targets[list_len].split("/")[-1]) < minmask:
-            cidr = targets[list_len]
-            targets.remove(cidr)
-            cidr_tmp = list()
-            ip_list = IP(cidr)
-            ip_list_len = len(ip_list) - 256
-            while ip_list_len >= 0:
-                cidr_tmp.append(f"{ip_list[ip_list_len]}/24")
-                ip_list_len -= 256
-            for ip in data.get(cidr):
-                for tmp in cidr_tmp:
-                    if ip in IP(tmp):
-                        targets.append(tmp)
-                        break
-        list_len -= 1
-
-    return list(set(targets))
+    results = set()
+    for cidr in targets:
+        try:
+            network, prefix = parse_cidr(cidr)
+        except ValueError:
+            results.add(cidr)
+            continue
+        if prefix < minmask and prefix < 24:
+            if isinstance(data, HostStore):
+                ips = data.ip_ints(cidr)
+            else:
+                ips = [ip_to_int(ip) for ip in data.get(cidr)]
+            for ip in ips:
+                results.add(f"{int_to_ip(ip & 0xFFFFFF00)}/24")
+        else:
+            results.add(cidr)
+
+    return list(results)
+
+
+def plan_targets(targets: list, data: dict, minmask: int = settings.analysis.min_mask, dense: int = settings.analysis.plan_dense_hosts, unit: int = settings.analysis.plan_unit_size) -> list:
+    """
+    根据已知IP的密度规划扫描目标，代替cut_mask固定分割成/24
+
+    掩码小于minmask的CIDR按/24统计其中的已知IP，已知IP不少于dense个的/24整段扫描，其余只扫描已知IP，其他CIDR整段扫描。
+    所有目标合并后分割成地址数不超过unit的前缀，再按地址顺序打包成地址数不超过unit的工作单元，
+    只有一个前缀的单元直接使用CIDR，其余写入nmap目标文件，扫描结束后由remove_targets_files删除
+
+    :param list targets :  CIDR字符串组成的list
+    :param dict data    :  经data_reduction整理的数据或HostStore
+    :param int minmask  :  设置子网掩码最小值
+    :param int dense    :  整段扫描的/24至少包含的已知IP数量
+    :param int unit     :  每个工作单元最多包含的地址数量
+    :return : 由CIDR和目标文件路径组成的list
+    :rtype  : list
+    """
+    intervals = list()
+    ips = list()
+    for cidr in targets:
+        try:
+            network, prefix = parse_cidr(cidr)
+        except ValueError:
+            logger.log("TRACE", f"Bad CIDR: {cidr}")
+            continue
+        if prefix >= minmask or prefix >= 24:
+            intervals.append((network, network | (0xFFFFFFFF >> prefix)))
+        elif cidr in data:
+            if isinstance(data, HostStore):
+                ips += data.ip_ints(cidr)
+            else:
+                ips += [ip_to_int(ip) for ip in data.get(cidr)]
+    counts = Counter(ip >> 8 for ip in ips)
+    dense_blocks = set(block for block, count in counts.items() if count >= dense)
+    intervals += [(block << 8, block << 8 | 0xFF) for block in dense_blocks]
+    intervals += [(ip, ip) for ip in ips if ip >> 8 not in dense_blocks]
+
+    # 超过unit的网段按unit向下取2的幂的大小分割
+    min_prefix = 33 - max(1, unit).bit_length()
+    units = list()
+    current = list()
+    size = 0
+    for start, end in merge_intervals(intervals):
+        for network, prefix in range_to_prefixes(start, end, 4, min_prefix):
+            count = 1 << (32 - prefix)
+            if count >= unit:  # 已经足够大的前缀单独作为一个单元，不打断正在打包的零散目标
+                units.append([f"{int_to_ip(network)}/{prefix}"])
+                continue
+            if current and size + count > unit:
+                units.append(current)
+                current = list()
+                size = 0
+            current.append(int_to_ip(network) if prefix == 32 else f"{int_to_ip(network)}/{prefix}")
+            size += count
+    if current:
+        units.append(current)
+
+    results = [itm[0] if len(itm) == 1 else str(write_targets_file(itm)) for itm in units]
+    logger.log("DEBUG", f"Planned {len(results)} scan units, dense /24: {len(dense_blocks)}, "
+                        f"single hosts: {len(ips) - sum(counts[block] for block in dense_blocks)}")
+    return results
 
 
 def _integration_list(srcdata: dict, newdata: list) -> dict:
-    for itm in srcdata:
-        newdata_len = len(newdata) -1
-        while newdata_len >= 0:
-            if srcdata[itm].get(newdata[newdata_len]):
-                newdata.remove(newdata[newdata_len])
-            elif newdata[newdata_len] in IP(itm):
-                srcdata[itm][newdata[newdata_len]] = dict()
-                newdata.remove(newdata[newdata_len])
-            newdata_len -= 1
-    
+    cidr_index = CidrIndex(srcdata)
+    for ip in newdata:
+        cidr = cidr_index.lookup(ip)
+        if cidr is not None and srcdata[cidr].get(ip) is None:
+            srcdata[cidr][ip] = dict()
+
     return srcdata, None
 
 
 def _integration_dict(srcdata: dict, newdata: dict) -> dict:
     conver = list()
-    for cidr in srcdata:
-        cidr_list = IP(cidr)
-        for ip in newdata:
-            if ip in cidr_list:
-                srcdata[cidr][ip].update(newdata.get(ip))
-                for port in newdata[ip].get("ports"):
-                    port_info = newdata[ip]["ports"].get(port)
-                    conver.append((
-                        cidr, 
-                        ip, 
-                        srcdata[cidr][ip].get("domain"), 
-                        port,
-                        port_info.get("state"),
-                        port_info.get("reason"),
-                        port_info.get("name"),
-                        port_info.get("product"),
-                        port_info.get("version"),
-                        port_info.get("extrainfo"),
-                        port_info.get("conf"),
-                        port_info.get("cpe"),
-                        port_info.get("title"),
-                        port_info.get("status")
-                    ))
+    cidr_index = CidrIndex(srcdata)
+    for ip in newdata:
+        cidr = cidr_index.lookup(ip)
+        if cidr is None:
+            continue
+        srcdata[cidr].setdefault(ip, dict()).update(newdata.get(ip))
+        for port in newdata[ip].get("ports"):
+            port_info = newdata[ip]["ports"].get(port)
+            conver.append((
+                cidr, 
+                ip, 
+                srcdata[cidr][ip].get("domain"), 
+                port,
+                port_info.get("state"),
+                port_info.get("reason"),
+                port_info.get("name"),
+                port_info.get("product"),
+                port_info.get("version"),
+                port_info.get("extrainfo"),
+                port_info.get("conf"),
+                port_info.get("cpe"),
+                port_info.get("title"),
+                port_info.get("status"),
+                port_info.get("truncated")
+            ))
 
     return srcdata, conver
                     
@@ -243,9 +549,20 @@ def data_integration(srcdata: dict, newdata: list or dict) -> (dict, list):
     :rtype  : (dict, list)
     """
     results = dict()
-    data = copy.deepcopy(newdata)
+    conver = None
     logger.log("INFOR", "Data integration start")
     logger.log("TRACE", f"New data: {newdata}")
+    if isinstance(srcdata, HostStore):
+        if type(newdata) is list:
+            srcdata.integrate_alive(newdata)
+            _data_statistics(srcdata)
+        elif type(newdata) is dict:
+            conver = srcdata.integrate_ports(newdata)
+        else:
+            logger.log("ERROR", "Bad data")
+        logger.log("INFOR", "Data integration finish")
+        return srcdata, conver
+    data = copy.deepcopy(newdata)
     if type(data) is list:
         data, conver = _integration_list(srcdata, data)
         results.update(data)
@@ -262,7 +579,17 @@ def data_integration(srcdata: dict, newdata: list or dict) -> (dict, list):
     return results, conver
 
 
-def data_conversion(data: dict) -> list:
+def data_conversion(data: dict):
+    """
+    将数据展开为由dict组成的list，每个端口一行；
+    HostStore直接返回逐行生成的生成器，不在内存中展开全部结果
+
+    :param dict data :  经data_reduction整理的数据或HostStore
+    :return : 由dict组成的list，data为HostStore时为生成器
+    :rtype  : list
+    """
+    if isinstance(data, HostStore):
+        return data.rows()
     results = list()
     for cidr in data:
         for ip in data[cidr]:
@@ -283,7 +610,8 @@ def data_conversion(data: dict) -> list:
                         "conf": port_info.get("conf"),
                         "cpe": port_info.get("cpe"),
                         "title": port_info.get("title"),
-                        "status": port_info.get("status")
+                        "status": port_info.get("status"),
+                        "truncated": port_info.get("truncated")
                     })
             else:
                 results.append({
@@ -300,7 +628,8 @@ def data_conversion(data: dict) -> list:
                     "conf": None,
                     "cpe": None,
                     "title": None,
-                    "status": None
+                    "status": None,
+                    "truncated": None
                     })
     
     return results
@@ -314,11 +643,16 @@ def http_resp_integration(srcdata: dict, resp_results: list) -> (dict, list):
         port = itm.get("port")
         title = itm.get("title")
         status = itm.get("status")
+        truncated = int(bool(itm.get("truncated")))  # 以0/1保存，与数据库一致
 
-        srcdata[cidr][ip]["ports"][port]["title"] = title
-        srcdata[cidr][ip]["ports"][port]["status"] = status
+        if isinstance(srcdata, HostStore):
+            srcdata.update_http(ip, port, title, status, truncated)
+        else:
+            srcdata[cidr][ip]["ports"][port]["title"] = title
+            srcdata[cidr][ip]["ports"][port]["status"] = status
+            srcdata[cidr][ip]["ports"][port]["truncated"] = truncated
 
-        results.append((title, status, ip, port))
+        results.append((title, status, truncated, ip, port))
     
     return srcdata, results
 
@@ -350,83 +684,303 @@ def _data_filtr(data: list) -> list:
     """
     初步筛选数据，主要用于筛选load_csv和load_json产生的数据
 
+    筛选规则有误或筛选出错时不进行筛选，原样返回所有数据，避免丢弃全部结果
+
     :param list data :  由dict组成的list
     :return : 经过滤的数据，结构不变
     :rtype  : list
     """
-    results = list()
+    if settings.analysis.dict_filtr is None:
+        logger.log("ERROR", "Bad data filter in settings, data is not filtered!")
+        return list(data)
     try:
-        for itm in data:
-            if eval(settings.analysis.dict_filtr_arguments):
-                results.append(itm)
+        return settings.analysis.dict_filtr.apply(data)
     except Exception as identifier:
-        logger.log("ERROR", repr(identifier))
+        logger.log("ERROR", f"Data filter failed, data is not filtered: {identifier!r}")
+        return list(data)
 
-    return results
+
+def _is_cdn(target: str) -> bool:
+    """
+    判断IP或CIDR是否完全处于CDN地址范围内
+
+    :param str target :  IP/CIDR
+    :rtype  : bool
+    """
+    starts, ends = settings.analysis.cdn_ip_ranges
+    try:
+        start, end = cidr_to_range(target.strip())
+    except ValueError:
+        return False
+    return in_ranges(start, end, starts, ends)
 
 
 def _filtr_cdn(data: list) -> list:
-    cdn_cidr_list = settings.analysis.cdn_ip_cidr
-    
-    for cdn_cidr in cdn_cidr_list:
-        data_len = len(data) -1
-        cdn_ip_list = IP(cdn_cidr)
-        while data_len >= 0:
-            if type(data[0]) is dict:  # 假定整个list都由str组成
-                for ip in data[data_len].get(settings.analysis.ip_field).split(","):
-                    if ip in cdn_ip_list:
-                        data.remove(data[data_len])
-                        break
-            elif type(data[0]) is dict:  # 假定整个list都由dict组成
-                if data[data_len] in cdn_ip_list:
-                    data.remove(data[data_len])
-            data_len -= 1
-    
+    """
+    过滤CDN地址，每个IP只需在合并后的CDN区间上做一次二分查找
+
+    :param list data :  由dict或str组成的list
+    :return : 经过滤的数据，结构不变
+    :rtype  : list
+    """
+    if type(data[0]) is dict:  # 假定整个list都由dict组成
+        ip_field = settings.analysis.ip_field
+        return [itm for itm in data
+                if not any(_is_cdn(ip) for ip in itm.get(ip_field).split(","))]
+    elif type(data[0]) is str:  # 假定整个list都由str组成
+        return [itm for itm in data if not _is_cdn(itm)]
     return data
 
-def load_txt(filepath: str, encode: str = "utf-8") -> list:
+def _chunks(iterable, size: int):
     """
-    读取txt文件内容并转为list
+    将可迭代对象按size个元素分块
+    """
+    iterable = iter(iterable)
+    chunk = list(islice(iterable, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterable, size))
 
-    :param str filepath :  .txt filepath
-    :return : txt to list data
-    :rtype  : list
+
+def _open_binary(filepath: str):
+    if str(filepath).endswith(".gz"):
+        return gzip.open(filepath, mode="rb")
+    return open(filepath, mode="rb")
+
+
+def _detect_encoding(filepath: str, encode: str = "utf-8") -> str:
+    """
+    根据文件开头的样本判断编码，只读取一次样本，样本无法按encode解码时使用GBK
+
+    :param str filepath :  文件路径，.gz结尾时读取解压后的内容
+    :param str encode   :  首选编码
+    :return : 编码
+    :rtype  : str
+    """
+    with _open_binary(filepath) as file:
+        sample = file.read(settings.analysis.encoding_sample_size)
+    if encode.lower().replace("-", "") == "utf8" and sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for itm in (encode, "GBK"):
+        try:
+            # 样本末尾可能截断了多字节字符，使用增量解码器忽略不完整的结尾
+            codecs.getincrementaldecoder(itm)().decode(sample, final=False)
+            return itm
+        except UnicodeDecodeError:
+            logger.log("TRACE", f"Sample is not {itm} encoded")
+    return encode
+
+
+def _read_json(file):
+    """
+    逐块读取json数组，每次解析出一个元素，不需要把整个文件读入内存
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+            pos += 1
+        if pos < len(buffer) and not started:
+            if buffer[pos] != "[":
+                raise ValueError("Expecting a json array")
+            started = True
+            pos += 1
+            continue
+        if pos < len(buffer):
+            if buffer[pos] == "]":
+                return None
+            try:
+                itm, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # 元素之后必须是逗号或数组结尾，否则元素可能被截断了（如数字1.5只读到了1.），需要再读一块
+                rest = end
+                while rest < len(buffer) and buffer[rest].isspace():
+                    rest += 1
+                if rest < len(buffer) and buffer[rest] in ",]":
+                    yield itm
+                    pos = end
+                    continue
+                if eof:
+                    raise ValueError(f"Expecting ',' delimiter: char {rest}")
+        elif eof:
+            return None
+        block = file.read(JSON_BLOCK_SIZE)
+        eof = len(block) == 0
+        buffer = buffer[pos:] + block
+        pos = 0
+
+
+def _read_ndjson(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _read_txt(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield line
+
+
+_READERS = {
+    "csv": csv.DictReader,
+    "json": _read_json,
+    "ndjson": _read_ndjson,
+    "jsonl": _read_ndjson,
+    "txt": _read_txt
+}
+
+
+def file_kind(filepath: str) -> str:
+    """
+    根据扩展名判断文件格式，忽略.gz后缀
+
+    :param str filepath :  文件路径
+    :return : csv/json/ndjson/jsonl/txt，无法识别时返回None
+    :rtype  : str
+    """
+    name = str(filepath).lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    kind = name.rpartition(".")[2]
+    return kind if kind in _READERS else None
+
+
+def _open_text(filepath: str, encode: str, newline: str = None):
+    if str(filepath).endswith(".gz"):
+        return gzip.open(filepath, mode="rt", encoding=encode, newline=newline)
+    return open(filepath, mode="r", encoding=encode, newline=newline)
+
+
+def _iter_records(filepath: str, kind: str, encode: str, size: int):
+    """
+    分块读取未经筛选的数据，编码按样本判断；样本之后出现无法解码的内容时改用GBK重新打开文件，
+    跳过已经返回的数据继续读取，GBK也无法解码时抛出UnicodeDecodeError
+
+    :param str filepath :  文件路径
+    :param str kind     :  文件格式，见file_kind
+    :param str encode   :  首选编码
+    :param int size     :  每块包含的数据条数
+    :return : 生成由dict或str组成的list的生成器
+    """
+    encodings = [_detect_encoding(filepath, encode)]
+    if encodings[0].lower() != "gbk":
+        encodings.append("GBK")
+    newline = "" if kind == "csv" else None
+    consumed = 0  # 已经返回的数据条数
+    for index, encoding in enumerate(encodings):
+        logger.log("TRACE", f"File encoding: {encoding}")
+        try:
+            with _open_text(filepath, encoding, newline) as file:
+                for chunk in _chunks(islice(_READERS[kind](file), consumed, None), size):
+                    consumed += len(chunk)
+                    yield chunk
+            return None
+        except UnicodeDecodeError as identifier:
+            if index + 1 == len(encodings):
+                raise
+            logger.log("ALERT", f"{filepath} is not {encoding} encoded after {consumed} records, "
+                                f"read it again as {encodings[index + 1]}: {identifier!r}")
+
+
+def iter_file(filepath: str, encode: str = "utf-8", size: int = settings.analysis.load_chunk_size):
+    """
+    分块读取.csv/.json/.ndjson/.jsonl/.txt文件（可以是.gz压缩文件），逐块筛选后返回，内存占用与文件大小无关
+
+    csv、json和ndjson文件的每块数据先经过_data_filtr筛选，所有数据块再经过_filtr_cdn过滤，
+    文件无法解码时抛出UnicodeDecodeError，而不是只返回解码出错之前的数据
+
+    :param str filepath :  文件路径
+    :param str encode   :  首选编码
+    :param int size     :  每块包含的数据条数
+    :return : 生成由dict或str组成的list的生成器
     """
     logger.log("TRACE", f"Read file: {filepath}")
-    data = list()
+    kind = file_kind(filepath)
     try:
-        with open(filepath, 'r', encoding=encode) as txt_file:
-            tmp = txt_file.read()
-            data = tmp.split("\n")
-        data = list(set(data))  # 去除重复数据
-        if len(data):
-            data = _filtr_cdn(data)
-        logger.log("TRACE", f"Data: {data}")
+        for chunk in _iter_records(filepath, kind, encode, size):
+            if kind != "txt" and settings.analysis.enable_dict_filtr:
+                chunk = _data_filtr(chunk)
+            if len(chunk):
+                chunk = _filtr_cdn(chunk)
+            if len(chunk):
+                yield chunk
+    except UnicodeDecodeError as identifier:
+        logger.log("ERROR", f"Unable to decode {filepath}: {identifier!r}")
+        raise
     except Exception as identifier:
         logger.log("ALERT", identifier)
-        if encode != "GBK":
-            logger.log("TRACE", "Try GBK encode")
-            data = load_txt(filepath, "GBK")
 
-    return data
+
+def load_txt(filepath: str, encode: str = "utf-8") -> list:
+    """
+    读取txt文件内容并转为list，大文件请使用iter_file分块读取
+
+    :param str filepath :  .txt filepath
+    :return : txt to list data
+    :rtype  : list
+    """
+    return list(set(itm for chunk in iter_file(filepath, encode) for itm in chunk))
+
+
+def write_targets_file(targets: list) -> pathlib.Path:
+    """
+    将扫描目标逐行写入临时文件，用作nmap的-iL参数
+
+    :param list targets :  IP/CIDR/IP范围组成的list
+    :return : 文件路径
+    :rtype  : Path
+    """
+    prefix = time.strftime("%Y%m%d%H%M%S", time.localtime())
+    with tempfile.NamedTemporaryFile("w", dir=settings.temp_save_dir, prefix=prefix, suffix=".txt", delete=False) as f:
+        f.write("".join(f"{target}\n" for target in targets))
+    return pathlib.Path(f.name)
+
+
+def remove_targets_files(targets: list) -> None:
+    """
+    删除write_targets_file写入的临时目标文件，其他目标（IP/CIDR/用户指定的文件）不受影响
+
+    :param list targets :  IP/CIDR/FilePath组成的list
+    """
+    temp_dir = pathlib.Path(settings.temp_save_dir).resolve()
+    for target in targets:
+        path = pathlib.Path(str(target))
+        if path.suffix == ".txt" and path.parent.resolve() == temp_dir:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as identifier:
+                logger.log("DEBUG", f"Remove {path} failed: {identifier!r}")
 
 
 def create_targets_file(targets: list) -> list:
-    targets.sort()
+    """
+    将主机写入nmap目标文件，重复的主机只写入一次，每个文件最多包含TARGETS_FILE_SIZE个主机，
+    扫描结束后由remove_targets_files删除
+
+    :param list targets :  IPv4地址组成的list
+    :return : 文件路径组成的list
+    :rtype  : list
+    """
+    hosts = list()
+    for ip in targets:
+        try:
+            hosts.append(ip_to_int(ip))
+        except ValueError:
+            logger.log("TRACE", f"Bad IP: {ip}")
+    hosts = sorted(set(hosts))
     files_list = list()
-    list_len = len(targets) -1
     try:
-        while list_len >= 0:
-            filename = f'{time.strftime("%Y%m%d%H%M%S", time.localtime())}{random.randint(0,9999)}.txt'
-            filepath = settings.temp_save_dir.joinpath(filename)
-            f = open(filepath, 'a+')
-            for i in range(256):
-                f.write(f"{targets[list_len]}\n")
-                list_len -= 1
-                if list_len < 0:
-                    break
-            f.close()
-            files_list.append(filepath)
+        for i in range(0, len(hosts), TARGETS_FILE_SIZE):
+            files_list.append(write_targets_file([int_to_ip(host) for host in hosts[i:i + TARGETS_FILE_SIZE]]))
     except Exception as identifier:
         logger.log("ERROR", identifier)
     logger.log("TRACE", f"Files: {files_list}")
@@ -435,69 +989,35 @@ def create_targets_file(targets: list) -> list:
 
 def load_csv(filepath: str, encode: str = "utf-8") -> list:
     """
-    将csv文件转成由dict组成的list
+    将csv文件转成由dict组成的list，大文件请使用iter_file分块读取
 
     :param str filepath :  .csv filepath
     :return : csv to json data
     :rtype  : list
     """
-    logger.log("TRACE", f"Read file: {filepath}")
-    data = list()
-    try:
-        with open(filepath, mode='r', encoding=encode) as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                data.append(row)
-        if settings.analysis.enable_dict_filtr:
-            data = _data_filtr(data)
-        if len(data):
-            data = _filtr_cdn(data)
-        logger.log("TRACE", f"Data: {data}")
-    except Exception as identifier:
-        logger.log("ALERT", identifier)
-        if encode != "GBK":
-            logger.log("TRACE", "Try GBK encode")
-            data = load_csv(filepath, "GBK")
-
-    return data
+    return [itm for chunk in iter_file(filepath, encode) for itm in chunk]
 
 
 def load_json(filepath: str, encode: str = "utf-8") -> list:
     """
-    将json文件转成由dict组成的list
+    将json文件转成由dict组成的list，大文件请使用iter_file分块读取
 
     :param str filepath :  .json filepath
     :return : file to json data
     :rtype  : list
     """
-    logger.log("TRACE", f"Read file: {filepath}")
-    data = list()
-    try:
-        with open(filepath, 'r', encoding=encode) as json_file:
-            data = json.load(json_file)
-        if settings.analysis.enable_dict_filtr:
-            data = _data_filtr(data)
-        if len(data):
-            data = _filtr_cdn(data)
-        logger.log("TRACE", f"Data: {data}")
-    except Exception as identifier:
-        logger.log("ALERT", identifier)
-        if encode != "GBK":
-            logger.log("TRACE", "Try GBK encode")
-            data = load_json(filepath, "GBK")
-
-    return data
+    return [itm for chunk in iter_file(filepath, encode) for itm in chunk]
 
 
 def check_ip_fmt(target: str) -> bool:
     """
-    判断target是否为CIDR或IPv4
+    判断target是否为IP、CIDR或IP范围（如192.168.0.1-100）
 
     :param str target :  string
     :rtype  : bool
     """
-    result = False
-    if match("^\d+\.\d+\.\d+\.\d+/\d+$", target) or match("^\d+\.\d+\.\d+\.\d+$", target):
-        result = True
-    
-    return result
+    try:
+        parse_target(target)
+    except ValueError:
+        return False
+    return True
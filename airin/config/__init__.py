@@ -4,6 +4,8 @@ from pathlib import Path
 
 from . import setting
 from .log import logger
+from airin.filtr import RowFilter
+from airin.iptools import cidr_to_range, merge_ranges
 
 
 class Settings(object):
@@ -26,7 +28,20 @@ class Settings(object):
             logger.log("ERROR", identifier)
             if encode != "GBK":
                 logger.log("TRACE", "Try GBK encode")
-                self.load_cdn_ip_cidr("GBK")
+                self._load_cdn_ip_cidr("GBK")
+
+    def _merge_cdn_ip_cidr(self):
+        """
+        将CDN的CIDR转换为合并后的有序整数区间，供_filtr_cdn二分查找
+        """
+        ranges = list()
+        for cidr in self.analysis.cdn_ip_cidr:
+            try:
+                ranges.append(cidr_to_range(cidr))
+            except ValueError:
+                logger.log("TRACE", f"Bad CDN CIDR: {cidr}")
+        self.analysis.cdn_ip_ranges = merge_ranges(ranges)
+        logger.log("TRACE", f"CDN ranges: {len(self.analysis.cdn_ip_ranges[0])}")
 
     def _check_netscan_proxies(self):
         """
@@ -35,6 +50,7 @@ class Settings(object):
         if self.netscan.enable_proxies:
             self.netscan.arguments_alive = f"--proxies {self.netscan.proxies_list} {self.netscan.arguments_alive} "
             self.netscan.arguments_port = f"--proxies {self.netscan.proxies_list} {self.netscan.arguments_port} "
+            self.netscan.arguments_discovery = f"--proxies {self.netscan.proxies_list} {self.netscan.arguments_discovery} "
             logger.log("DEBUG", f"Proxies arguments: --proxies {self.netscan.proxies_list}")
 
     def _netscan_join_ports(self):
@@ -42,18 +58,26 @@ class Settings(object):
         检查是否使用自定义的端口列表
         """
         if self.netscan.enable_custom_ports:
-            self.netscan.arguments_port = f"-p{','.join([str(port) for port in self.netscan.ports])} {self.netscan.arguments_port} "
-            logger.log("DEBUG", f"Port arguments: {self.netscan.arguments_port}")
+            ports = f"-p{','.join([str(port) for port in self.netscan.ports])}"
+            # 两阶段扫描时端口列表只用于发现阶段，版本识别阶段的-p由发现的开放端口决定
+            if self.netscan.enable_two_phase:
+                self.netscan.arguments_discovery = f"{ports} {self.netscan.arguments_discovery} "
+                logger.log("DEBUG", f"Discovery arguments: {self.netscan.arguments_discovery}")
+            else:
+                self.netscan.arguments_port = f"{ports} {self.netscan.arguments_port} "
+                logger.log("DEBUG", f"Port arguments: {self.netscan.arguments_port}")
 
-    def _analysis_join_arguments(self):
+    def _analysis_compile_filtr(self):
         """
-        拼接_filtr函数的筛选参数
+        将_data_filtr的筛选规则编译成RowFilter，规则有误时为None，_data_filtr不进行筛选
         """
-        if self.analysis.enable_dict_filtr:
-            self.analysis.dict_filtr_arguments = " and ".join([str(f"itm.get(\"{itm.get('field')}\") {itm.get('operator')} \"{itm.get('value')}\"") for itm in self.analysis.dict_filtr_arguments])
-            logger.log("DEBUG", f"Data filter: {self.analysis.dict_filtr_arguments}")
-        else:
-            self.analysis.dict_filtr_arguments = "True"
+        rules = self.analysis.dict_filtr_arguments if self.analysis.enable_dict_filtr else list()
+        try:
+            self.analysis.dict_filtr = RowFilter(rules)
+            logger.log("DEBUG", f"Data filter: {rules}")
+        except Exception as identifier:
+            logger.log("ERROR", f"Bad data filter: {identifier!r}")
+            self.analysis.dict_filtr = None
     
     def _check_path(self):
         Path(self.result_save_dir).mkdir(exist_ok=True)
@@ -66,9 +90,10 @@ class Settings(object):
         
         self._check_netscan_proxies()
         self._netscan_join_ports()
-        self._analysis_join_arguments()
+        self._analysis_compile_filtr()
         self._check_path()
         self._load_cdn_ip_cidr()
+        self._merge_cdn_ip_cidr()
 
 
 settings = Settings()
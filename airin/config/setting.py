@@ -16,18 +16,26 @@ class analysis:
     # 分割掩码小于min_mask的CIDR
     enable_cut_cidr = True  # 分割CIDR开关（默认True）
     min_mask = 21  # 如果子网掩码小于该值则分割成掩码为24位的子网，为0则不替换
+    # 按已知IP的密度规划分割后的扫描目标
+    plan_dense_hosts = 2  # 已知IP数量不少于该值的/24整段扫描，其余/24只扫描已知IP，为1则与固定分割为/24相同（默认2）
+    plan_unit_size = 256  # 每个nmap工作单元最多包含的地址数量，大的网段按此分割，零散的目标打包在一起（默认256）
 
     # 筛选扫描CIDR
     enable_scan_filter = True   # 筛选扫描对象开关（默认True）
     scan_top = 5        # 筛选前scan_top项
     scan_minipcount = 2  # 筛选IP数量大于等于scan_minipcount的项
 
+    # 读取输入文件，支持csv/json/ndjson/txt及其.gz压缩文件
+    load_chunk_size = 10000  # 分块读取时每块包含的数据条数，每块单独筛选后整理（默认10000）
+    encoding_sample_size = 65536  # 判断文件编码时读取的样本字节数（默认65536）
+
     # 设置数据提取字段
     ip_field = "ip"            # 指定csv文件或json文件中的ip字段，该字段必须
     cidr_field = "cidr"        # 指定csv文件或json文件中的cidr字段，若无此字段则设为None
     domain_field = "subdomain"  # 指定csv文件或json文件中的domain字段，若无此字段则设为None
 
-    # 筛选符合条件的数据
+    # 筛选符合条件的数据，operator可以是==、!=、<、<=、>、>=、in、not in、regex，
+    # value为数值（或数值字符串）时按数值比较，in/not in的value为list或逗号分隔的字符串
     enable_dict_filtr = True  # 数据筛选开关（默认True）
     dict_filtr_arguments = [{"field": "cdn", "operator": "==", "value": "0"},
                             {"field": "level", "operator": "<=", "value": "2"},
@@ -88,12 +96,73 @@ class netscan:
     # 上面这条参数扫 1681 个IP花了我 2091.12 秒
     # arguments_port = '-T4 -n -sV --top-ports 500 --min-hostgroup 256 --min-parallelism 512'   # 若使用这条参数则将custom_ports改为False
     # 上面这条[*] elapsed: 1849.59  	uphosts: 1118  	totalhosts: 1214
+    # 两阶段端口扫描：先用不带-sV的快速扫描找出开放端口，再只对开放的host:port进行-sV版本识别（默认False）
+    # 开启时自定义端口列表(ports)拼接到arguments_discovery而不是arguments_port，扫描的端口范围不变，
+    # 版本识别阶段的-p由发现的开放端口决定，因此arguments_port中不要再指定-p/--top-ports
+    enable_two_phase = False
+    """
+    -Pn     跳过主机发现，扫描目标已经过存活探测
+    --open  只输出开放的端口
+    """
+    arguments_discovery = '-T4 -n -Pn --open --min-hostgroup 256 --min-parallelism 512'
+
+    # 并行扫描设置
+    process_count = 4  # 同时运行的nmap进程数量（默认4）
+    max_hosts_in_flight = 1024  # 所有nmap进程正在扫描的主机总数上限，防止占满出口带宽（默认1024）
+    # 流式解析nmap的XML输出，每扫描完一个主机就交给后续流程处理，而不是等整个目标扫描结束（默认True）
+    enable_stream = True
+
+    # 扫描后端
+    # "nmap"使用nmap；"asyncio"使用内置的TCP connect扫描引擎，无需安装nmap和sudo权限，用于存活探测和端口发现，
+    # 两阶段扫描时版本识别仍由nmap完成，关闭enable_two_phase则完全不使用nmap（只读取banner，不进行版本识别）
+    backend = "nmap"
+    async_concurrency = 4096  # asyncio后端同时进行的连接数上限，超过文件描述符上限时自动减小（默认4096）
+    connect_timeout = 1.5  # asyncio后端连接超时秒数，超时的端口为filtered（默认1.5）
+    connect_retries = 1  # asyncio后端连接超时后的重试次数，重试后才有响应的连接视为丢包，用于速率调度的拥塞判断（默认1）
+    alive_ports = [80, 443, 22, 445, 3389]  # asyncio后端存活探测的端口，收到SYN/ACK或RST即为存活
+    # asyncio后端端口扫描始终使用上面的ports列表
+    enable_banner = True  # asyncio后端端口扫描时读取开放端口主动发送的banner，写入extrainfo（默认True）
+    banner_timeout = 2  # 等待banner的秒数（默认2）
+    banner_size = 1024  # 最多读取的banner字节数（默认1024）
+
+
+class ratelimit:
+    # 扫描和HTTP请求共用的速率调度，每秒连接数受全局和每个/24网段的令牌桶限制
+    # 每个统计周期内超时、丢包等错误的比例超过阈值时速率减半且不超过该周期成功的速率，否则逐步恢复（AIMD）
+    # nmap后端不参与错误统计，由nmap自身负责拥塞控制
+    enable = True  # 速率调度开关（默认True）
+    # 开启后每个nmap进程（含存活探测）以--max-rate分得当前全局速率，参数中已有--max-rate时不再添加
+    enable_nmap_rate = False  # nmap速率限制开关（默认False）
+    global_rate = 20000  # 所有扫描和请求每秒发起的连接数上限（默认20000）
+    cidr_rate = 2000  # 对同一个/24网段每秒发起的连接数上限，为0则不限制（默认2000）
+    min_rate = 50  # 自动降速的下限（默认50）
+    aimd_interval = 1  # 统计周期秒数（默认1）
+    aimd_min_samples = 20  # 统计周期内结果数量不少于该值时才会降速（默认20）
+    aimd_error_ratio = 0.1  # 错误比例超过该值时降速（默认0.1）
+    aimd_decrease = 0.5  # 降速时速率乘以该值（默认0.5）
+    aimd_increase = 0.01  # 没有超过错误比例时每个周期增加最大速率的该比例（默认0.01）
+    report_interval = 10  # 输出当前速率和错误比例的间隔秒数（默认10）
 
 
 class database:
     db_path = result_save_dir.joinpath("airin.sqlite3")  # 数据库文件路径
     table_name = "AIRIN"  # 主要表，扫描结束后将所有数据添加到该表
-    temp_table_name = "TEMP"  # 临时表，每次端口扫描后将相关结果保存在该表，防止意外中断导致数据丢失，每次载入Database模块会清空内容
+    temp_table_name = "TEMP"  # 临时表，保存当前任务的扫描结果，防止意外中断导致数据丢失，中断的任务可通过--resume恢复
+    task_http_size = 1024  # 断点记录中每个HTTP请求块包含的请求数量（默认1024）
+    # 主要表和临时表是HOST/PORT/HTTP规范化表的视图，旧版数据库会在连接时自动迁移
+    journal_mode = "WAL"  # SQLite日志模式，WAL模式下写入不阻塞读取（默认WAL）
+    suspended_ttl = 30 * 24 * 3600  # 挂起的任务超过该时间（单位秒）未恢复时，在新建任务时删除（默认30天）
+    # 扫描结果缓存，在有效期内扫描过的主机（相同nmap参数及端口）不再重复扫描，直接使用主要表中的结果
+    enable_cache = True  # 缓存开关（默认True）
+    cache_table_name = "CACHE"  # 缓存表，记录主机最近一次端口扫描的时间
+    cache_ttl = 7 * 24 * 3600  # 缓存有效期，单位秒（默认7天）
+    # 服务指纹缓存，只在两阶段扫描时生效：发现开放端口后读取banner，banner与缓存相同的端口直接使用缓存的版本识别结果，
+    # 本次扫描中banner相同的端口也只对其中一个进行版本识别；没有banner的端口（如HTTP）仍然进行版本识别
+    enable_fingerprint = False  # 指纹缓存开关（默认False）
+    fingerprint_table_name = "FINGERPRINT"  # 指纹缓存表，记录banner的哈希和nmap版本识别结果
+    fingerprint_ttl = 30 * 24 * 3600  # 指纹有效期，单位秒（默认30天）
+    fingerprint_size = 100000  # 最多保存的指纹数量，超过时删除最久未使用的指纹（默认100000）
+    fingerprint_min_conf = 5  # 版本识别可信度（nmap的conf，按端口号猜测服务名时为3）低于该值时不缓存（默认5）
 
 
 class request:
@@ -104,10 +173,24 @@ class request:
     proxy_pool = [{'http': 'http://127.0.0.1:1080',
                    'https': 'https://127.0.0.1:1080'}]  # 代理池
 
+    # 请求引擎
+    # "thread"为多线程requests引擎；"asyncio"为异步引擎，安装了aiohttp时使用aiohttp，否则使用标准库实现（不支持代理）
+    engine = "thread"
+    async_concurrency = 1024  # asyncio引擎同时进行的请求总数上限(默认1024)
+    per_host_limit = 8  # asyncio引擎对同一主机同时进行的请求数上限(默认8)
+
+    # 标题提取方式
+    # "fast"先用正则快速提取，遇到注释、脚本等无法确定的情况再使用BeautifulSoup；"bs4"始终使用BeautifulSoup
+    title_extractor = "fast"
+    # 解析标题的进程数量，为0时直接在请求线程中解析；标题多需BeautifulSoup解析时可设为CPU核数(默认0)
+    parse_process_count = 0
+
     # 请求设置
     thread_count = None  # 请求线程数量(默认None，则根据内存大小设置)
     # 请求超时秒数(默认connect timout推荐略大于3秒，read秒)
     timeout_second = (3.05, 27)
+    max_body_size = 65536  # 每个响应最多读取的字节数，读到</title>会提前停止(默认64KB)
+    max_read_second = 10  # 读取单个响应内容的总时间上限，防止慢速响应长时间占用(默认10秒)
     ssl_verify = False  # 请求SSL验证(默认False)
     allow_redirect = True  # 请求允许重定向(默认True)
     redirect_limit = 10  # 请求跳转限制(默认10次)
@@ -126,7 +209,15 @@ class request:
         'X-Forwarded-For': '127.0.0.1'
     }
 
+class pipeline:
+    # 流水线模式设置（--pipeline）
+    batch_size = 16  # 端口扫描每批最多包含的存活主机数量，越小越早开始请求HTTP服务（默认16）
+    queue_size = 1024  # 各阶段之间队列的最大长度（默认1024）
+
+
 class export:
     result_save_format = "csv" # 默认导出文件格式
     result_save_encode = "utf-8" # 默认编码
+    # parquet/arrow格式需要安装pyarrow，按批次转换为列式数据写入
+    columnar_batch_size = 65536  # 每个row group/record batch包含的行数（默认65536）
 
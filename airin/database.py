@@ -1,24 +1,26 @@
+import json
 import sqlite3
 import time
-import random
-import pandas
-
-from sqlalchemy import create_engine
 
 from airin.config import settings
 from airin.config.log import logger
 
 
+SCHEMA_VERSION = 4  # 1为旧版的AIRIN/TEMP扁平表，4为HOST/PORT/HTTP/SCAN/TASK规范化表结构
+# SCAN.merged的取值：0为当前任务（临时表），1为已合并（主要表），2为中断后挂起的任务，可通过--resume恢复
+SCAN_SUSPENDED = 2
+
+
 class Database(object):
-    def exec(self, sql: str) -> list:
-        results = list()
+    # SQL出错时记录日志后继续抛出，由调用方决定回滚还是终止，不能让事务中的错误被忽略
+    def exec(self, sql: str, params: tuple = ()) -> list:
         try:
             logger.log("TRACE", f"Execute the SQL statement: {sql}")
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
+            self.cursor.execute(sql, params)
+            return self.cursor.fetchall()
         except Exception as identifier:
             logger.log("ERROR", repr(identifier))
-        return results
+            raise
 
     def execmany(self, sql: str, data: list) -> None:
         try:
@@ -27,15 +29,32 @@ class Database(object):
             self.cursor.executemany(sql, data)
         except Exception as identifier:
             logger.log("ERROR", repr(identifier))
+            raise
 
-    def create_table(self, table_name: str) -> None:
-        logger.log("INFOR", f"Create table: {table_name}")
-        self.exec(f"""
-        create table {table_name}(
+    def create_schema(self) -> None:
+        """
+        创建规范化的表结构：HOST保存主机，PORT保存每次扫描的端口结果，HTTP保存端口的标题信息，
+        SCAN记录每次扫描（任务）及其是否已合并，TASK记录任务中每个端口扫描块和HTTP请求块的完成情况；
+        主要表和临时表分别是已合并和当前任务扫描结果的视图
+        """
+        logger.log("INFOR", f"Create database schema version {SCHEMA_VERSION}")
+        self.exec("""
+        create table if not exists SCAN(
+            id          INTEGER PRIMARY KEY AUTOINCREMENT, 
+            created_at  REAL                NOT NULL, 
+            merged      INT                 NOT NULL DEFAULT 0, 
+            args        TEXT);""")
+        self.exec("""
+        create table if not exists HOST(
             id          INTEGER PRIMARY KEY AUTOINCREMENT, 
+            ip          TEXT                NOT NULL UNIQUE, 
             cidr        TEXT                NOT NULL, 
-            ip          TEXT, 
-            domain      TEXT, 
+            domain      TEXT);""")
+        self.exec("""
+        create table if not exists PORT(
+            id          INTEGER PRIMARY KEY AUTOINCREMENT, 
+            scan_id     INT                 NOT NULL, 
+            host_id     INT                 NOT NULL, 
             port        INT, 
             state       TEXT, 
             reason      TEXT, 
@@ -44,27 +63,261 @@ class Database(object):
             version     TEXT, 
             extrainfo   TEXT, 
             conf        TEXT, 
-            cpe         TEXT, 
+            cpe         TEXT);""")
+        self.exec("""
+        create table if not exists HTTP(
+            port_id     INTEGER PRIMARY KEY, 
             title       TEXT, 
-            status      INT);""")
+            status      INT, 
+            truncated   INT);""")
+        self.exec("""
+        create table if not exists TASK(
+            id          INTEGER PRIMARY KEY AUTOINCREMENT, 
+            scan_id     INT                 NOT NULL, 
+            kind        TEXT                NOT NULL, 
+            payload     TEXT                NOT NULL, 
+            done        INT                 NOT NULL DEFAULT 0);""")
+        self.exec("create index if not exists idx_TASK_scan on TASK (scan_id, kind, done)")
+        self.exec("create index if not exists idx_PORT_host_port on PORT (host_id, port)")
+        self.exec("create index if not exists idx_PORT_scan on PORT (scan_id)")
+        for table_name, merged in ((self.table_name, 1), (self.temp_table_name, 0)):
+            self.exec(f"""
+            create view if not exists {table_name} as
+            select
+                PORT.id, HOST.cidr, HOST.ip, HOST.domain, PORT.port, PORT.state, 
+                PORT.reason, PORT.name, PORT.product, PORT.version, 
+                PORT.extrainfo, PORT.conf, PORT.cpe, HTTP.title, HTTP.status, HTTP.truncated
+            from PORT
+                join HOST on HOST.id=PORT.host_id
+                left join HTTP on HTTP.port_id=PORT.id
+            where PORT.scan_id in (select id from SCAN where merged={merged})""")
+        self.exec(f"pragma user_version={SCHEMA_VERSION}")
+
+    def migrate(self) -> None:
+        """
+        将旧版的扁平表迁移到规范化表结构，旧表重命名为<表名>_V1保留
+        """
+        logger.log("ALERT", f"Migrate database schema to version {SCHEMA_VERSION}")
+        try:
+            self.cursor.execute("begin")
+            legacy = list()
+            for table_name, merged in ((self.table_name, 1), (self.temp_table_name, 0)):
+                if self.check_table(table_name) > 0:
+                    self.cursor.execute(f"alter table {table_name} rename to {table_name}_V1")
+                    self.cursor.execute(f"drop index if exists idx_{table_name}_ip_port")
+                    legacy.append((f"{table_name}_V1", merged))
+            self.create_schema()
+            offset = 0
+            for table_name, merged in legacy:
+                self.cursor.execute("insert into SCAN (created_at, merged) values (?, ?)", (time.time(), merged))
+                scan_id = self.cursor.lastrowid
+                self.cursor.execute(f"""
+                insert into HOST (ip, cidr, domain)
+                select ip, cidr, domain from {table_name} where ip is not NULL order by id
+                on conflict(ip) do update set cidr=excluded.cidr, domain=coalesce(excluded.domain, domain)""")
+                # 保持原有的id顺序，“每个(ip, port)最新的一条记录”在迁移后不变
+                self.cursor.execute(f"""
+                insert into PORT (
+                    id, scan_id, host_id, port, state, reason, 
+                    name, product, version, extrainfo, conf, cpe
+                ) select
+                    t.id + {offset}, {scan_id}, HOST.id, t.port, t.state, t.reason, 
+                    t.name, t.product, t.version, t.extrainfo, t.conf, t.cpe
+                from {table_name} t join HOST on HOST.ip=t.ip order by t.id""")
+                self.cursor.execute(f"""
+                insert into HTTP (port_id, title, status)
+                select t.id + {offset}, t.title, t.status from {table_name} t
+                where t.ip is not NULL and (t.title is not NULL or t.status is not NULL)""")
+                offset = self.cursor.execute("select coalesce(max(id), 0) from PORT").fetchone()[0]
+                logger.log("ALERT", f"Migrated table {table_name}, it can be dropped after checking")
+            self.connect.commit()
+        except Exception as identifier:
+            logger.log("FATAL", repr(identifier))
+            self.connect.rollback()
+            raise
+
+    def _merged(self, table_name: str) -> int:
+        """
+        主要表对应已合并的扫描（1），临时表对应未合并的扫描（0），其他表名返回None
+        """
+        return {self.table_name: 1, self.temp_table_name: 0}.get(table_name)
+
+    def get_scan_id(self, table_name: str) -> int:
+        """
+        返回写入该表时使用的扫描ID，临时表沿用未合并的扫描，没有则新建；
+        直接写入主要表时同一个连接只新建一次扫描，多次写入共用
+
+        :param str table_name :  主要表或临时表
+        :rtype  : int
+        """
+        merged = self._merged(table_name)
+        if merged == 0:
+            ret = self.exec("select max(id) from SCAN where merged=0")
+            if ret and ret[0][0] is not None:
+                return ret[0][0]
+        elif self._scan_ids.get(merged) is not None:
+            return self._scan_ids[merged]
+        self.cursor.execute("insert into SCAN (created_at, merged) values (?, ?)", (time.time(), merged))
+        if merged != 0:
+            self._scan_ids[merged] = self.cursor.lastrowid
+        return self.cursor.lastrowid
+
+    def start_job(self, args: dict) -> int:
+        """
+        新建任务作为临时表，之前中断的任务会被挂起而不是清空
+
+        :param dict args :  任务参数，恢复任务时使用
+        :return : 任务ID
+        :rtype  : int
+        """
+        self.prune_jobs()
+        self.exec(f"update SCAN set merged={SCAN_SUSPENDED} where merged=0")
+        self.exec("insert into SCAN (created_at, merged, args) values (?, 0, ?)",
+                  (time.time(), json.dumps(args, default=str)))
+        job_id = self.cursor.lastrowid
+        self.connect.commit()
+        logger.log("ALERT", f"Job ID: {job_id}, use --resume {job_id} to continue if interrupted")
+        return job_id
+
+    def resume_job(self, job_id: int) -> dict:
+        """
+        将未合并的任务恢复为临时表
+
+        :param int job_id :  任务ID
+        :return : 任务参数，任务不存在或已合并时返回None
+        :rtype  : dict
+        """
+        ret = self.exec("select args from SCAN where id=? and merged!=1", (job_id,))
+        if not ret:
+            return None
+        self.exec(f"update SCAN set merged={SCAN_SUSPENDED} where merged=0 and id!=?", (job_id,))
+        self.exec("update SCAN set merged=0 where id=?", (job_id,))
+        self.connect.commit()
+        logger.log("ALERT", f"Resume job: {job_id}")
+        return json.loads(ret[0][0] or "{}")
+
+    def prune_jobs(self, ttl: int = settings.database.suspended_ttl) -> int:
+        """
+        删除挂起超过有效期的任务及其扫描结果
+
+        :param int ttl :  有效期，单位秒
+        :return : 删除的任务数量
+        :rtype  : int
+        """
+        scans = f"select id from SCAN where merged={SCAN_SUSPENDED} and created_at<?"
+        expired = (time.time() - ttl,)
+        count = self.exec(f"select count(*) from ({scans})", expired)[0][0]
+        if count == 0:
+            return 0
+        self.exec(f"delete from TASK where scan_id in ({scans})", expired)
+        self.exec(f"delete from HTTP where port_id in (select id from PORT where scan_id in ({scans}))", expired)
+        self.exec(f"delete from PORT where scan_id in ({scans})", expired)
+        self.exec(f"delete from SCAN where id in ({scans})", expired)
+        self.connect.commit()
+        logger.log("ALERT", f"Pruned {count} suspended jobs older than {ttl} seconds")
+        return count
+
+    def list_jobs(self) -> list:
+        """
+        返回未合并的任务
+
+        :return : 由(任务ID, 创建时间, 已完成任务块数, 总任务块数)组成的list
+        :rtype  : list
+        """
+        return self.exec("""
+        select SCAN.id, SCAN.created_at, coalesce(sum(TASK.done), 0), count(TASK.id)
+        from SCAN left join TASK on TASK.scan_id=SCAN.id
+        where SCAN.merged!=1 group by SCAN.id""")
+
+    def add_tasks(self, kind: str, payloads: list, done: bool = False) -> list:
+        """
+        为当前任务添加任务块
+
+        :param str kind      :  "alive"/"port"/"http"
+        :param list payloads :  每个任务块的内容，以json保存
+        :param bool done     :  是否已完成
+        :return : 由(任务块ID, 内容)组成的list
+        :rtype  : list
+        """
+        scan_id = self.get_scan_id(self.temp_table_name)
+        results = list()
+        for payload in payloads:
+            self.cursor.execute("insert into TASK (scan_id, kind, payload, done) values (?, ?, ?, ?)",
+                                (scan_id, kind, json.dumps(payload), int(done)))
+            results.append((self.cursor.lastrowid, payload))
+        self.connect.commit()
+        return results
+
+    def get_tasks(self, kind: str, done: bool = None) -> list:
+        """
+        返回当前任务的任务块
+
+        :param str kind  :  "alive"/"port"/"http"
+        :param bool done :  按完成情况筛选，None时返回全部
+        :return : 由(任务块ID, 内容)组成的list
+        :rtype  : list
+        """
+        sql = "select id, payload from TASK where scan_id in (select id from SCAN where merged=0) and kind=?"
+        params = (kind,)
+        if done is not None:
+            sql += " and done=?"
+            params += (int(done),)
+        return [(task_id, json.loads(payload)) for task_id, payload in self.exec(sql + " order by id", params)]
+
+    def finish_task(self, task_id: int) -> None:
+        self.exec("update TASK set done=1 where id=?", (task_id,))
+        self.connect.commit()
 
     def insert_table(self, table_name: str, data: list) -> None:
         logger.log("DEBUG", f"Insert {table_name}")
+        if self._merged(table_name) is None:
+            logger.log("ERROR", f"Unable to insert into table: {table_name}")
+            return None
+        data = [row for row in data if row[1] is not None]
+        scan_id = self.get_scan_id(table_name)
+        self.execmany("""
+        insert into HOST (ip, cidr, domain) values (?, ?, ?)
+        on conflict(ip) do update set cidr=excluded.cidr, domain=coalesce(excluded.domain, domain)""",
+                      [(ip, cidr, domain) for cidr, ip, domain, *other in data])
+        self.execmany("""
+        insert into PORT (
+            scan_id, host_id, port, state, reason, 
+            name, product, version, extrainfo, conf, cpe
+        ) values (?, (select id from HOST where ip=?), ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      [(scan_id, row[1]) + tuple(row[3:12]) for row in data])
         self.execmany(f"""
-        insert into {table_name} (
-            cidr, ip, domain, port, state, 
-            reason, name, product, version, 
-            extrainfo, conf, cpe, title, status
-        ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", data)
+        insert or replace into HTTP (port_id, title, status, truncated)
+        select id, ?, ?, ? from PORT
+        where host_id=(select id from HOST where ip=?) and port=? and scan_id={scan_id}""",
+                      [(row[12], row[13], row[14], row[1], row[3])
+                       for row in data if row[12] is not None or row[13] is not None])
         self.connect.commit()
 
     def update_HTTP_info(self, table_name: str, data: list) -> None:
+        """
+        更新端口的HTTP信息
+
+        :param str table_name :  主要表、临时表或其他扁平表（如迁移保留的旧表）
+        :param list data :  (title, status, truncated, ip, port)组成的list
+        """
         logger.log("DEBUG", f"Update {table_name}")
+        merged = self._merged(table_name)
+        if merged is None:
+            # 其他表直接按(ip, port)更新，旧表没有truncated字段
+            if "truncated" in self.table_fields(table_name):
+                self.execmany(f"update {table_name} set title=?, status=?, truncated=? where ip=? and port=?", data)
+            else:
+                self.execmany(f"update {table_name} set title=?, status=? where ip=? and port=?",
+                              [(title, status, ip, port) for title, status, truncated, ip, port in data])
+            self.connect.commit()
+            return None
+        # 通过HOST.ip唯一索引和PORT(host_id, port)索引定位端口，所有更新在同一个事务中提交
         self.execmany(f"""
-        update {table_name} set
-            title=?, status=?
+        insert or replace into HTTP (port_id, title, status, truncated)
+        select PORT.id, ?, ?, ? from PORT
+            join SCAN on SCAN.id=PORT.scan_id
         where
-            ip=? and port=?""", data)
+            PORT.host_id=(select id from HOST where ip=?) and PORT.port=? and SCAN.merged={merged}""", data)
         self.connect.commit()
 
     def drop_table(self, table_name: str) -> None:
@@ -75,7 +328,7 @@ class Database(object):
     def check_table(self, table_name: str) -> int:
         logger.log("TRACE", f"Check table: {table_name}")
         ret = self.exec(
-            f"select count(name) from sqlite_master where type='table' and name='{table_name}'")
+            f"select count(name) from sqlite_master where type in ('table', 'view') and name='{table_name}'")
         logger.log("TRACE", f"Return: {ret}")
         return ret[0][0]
 
@@ -98,50 +351,339 @@ class Database(object):
         logger.log("DEBUG", f"HTTP Service list: {results}")
         return results
 
+    def _drop_superseded(self, scans: str) -> None:
+        """
+        删除被指定扫描覆盖的旧端口记录，使主要表中每个(ip, port)只保留最新一条，挂起的任务不受影响
+
+        :param str scans :  返回扫描ID的SQL子查询
+        """
+        superseded = f"""
+        select old.id from PORT new
+            join PORT old on old.host_id=new.host_id and old.port=new.port and old.id<new.id
+        where new.scan_id in ({scans}) and old.scan_id in (select id from SCAN where merged in (0, 1))"""
+        self.cursor.execute(f"delete from HTTP where port_id in ({superseded})")
+        self.cursor.execute(f"delete from PORT where id in ({superseded})")
+
     def merging_table(self, src: str, dst: str) -> None:
         """
-        表合并
+        表合并，在一个事务中完成，同一(ip, port)的记录以来源表为准更新而不是重复添加
 
         :param str src :  数据来源表名
         :param str dst :  数据接受表名
         """
         logger.log("DEBUG", f"Merging table {src} and {dst}")
-        temp_date = self.exec(
-            f"select cidr, ip, domain, port, state, reason, name, product, version, extrainfo, conf, cpe, title, status from {src}")
-        self.insert_table(dst, temp_date)
-        self.clean(src)
+        try:
+            if self._merged(src) == 0 and self._merged(dst) == 1:
+                # 临时表与主要表共用PORT表，删除被覆盖的旧记录后把扫描标记为已合并即可，任务记录不再需要
+                self._drop_superseded("select id from SCAN where merged=0")
+                self.cursor.execute("delete from TASK where scan_id in (select id from SCAN where merged=0)")
+                self.cursor.execute("update SCAN set merged=1 where merged=0")
+            elif self._merged(dst) is not None:
+                # 其他来源表（如迁移保留的旧表）用INSERT...SELECT直接在数据库内复制
+                scan_id = self.get_scan_id(dst)
+                self.cursor.execute(f"""
+                insert into HOST (ip, cidr, domain)
+                select ip, cidr, domain from {src} where ip is not NULL order by id
+                on conflict(ip) do update set cidr=excluded.cidr, domain=coalesce(excluded.domain, domain)""")
+                self.cursor.execute(f"""
+                insert into PORT (
+                    scan_id, host_id, port, state, reason, 
+                    name, product, version, extrainfo, conf, cpe
+                ) select
+                    {scan_id}, HOST.id, s.port, s.state, s.reason, 
+                    s.name, s.product, s.version, s.extrainfo, s.conf, s.cpe
+                from {src} s join HOST on HOST.ip=s.ip order by s.id""")
+                # 迁移保留的旧表没有truncated字段
+                truncated = "s.truncated" if "truncated" in self.table_fields(src) else "NULL"
+                self.cursor.execute(f"""
+                insert or replace into HTTP (port_id, title, status, truncated)
+                select PORT.id, s.title, s.status, {truncated} from {src} s
+                    join HOST on HOST.ip=s.ip
+                    join PORT on PORT.host_id=HOST.id and PORT.port=s.port and PORT.scan_id={scan_id}
+                where s.title is not NULL or s.status is not NULL order by s.id""")
+                self._drop_superseded(str(scan_id))
+            else:
+                logger.log("ERROR", f"Unable to merge into table: {dst}")
+                return None
+            self.connect.commit()
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+            self.connect.rollback()
+            raise
+        if self._merged(src) != 0 or self._merged(dst) != 1:
+            self.clean(src)
 
     def clean(self, table_name: str = settings.database.temp_table_name) -> None:
-        if self.check_table(table_name) > 0:
+        merged = self._merged(table_name)
+        if merged is not None:
+            scans = f"select id from SCAN where merged={merged}"
+            self.exec(f"delete from TASK where scan_id in ({scans})")
+            self.exec(f"delete from HTTP where port_id in (select id from PORT where scan_id in ({scans}))")
+            self.exec(f"delete from PORT where scan_id in ({scans})")
+            self.exec(f"delete from SCAN where merged={merged}")
+            self.connect.commit()
+        elif self.check_table(table_name) > 0:
             self.exec(f"delete from {table_name}")
 
+    def create_cache_table(self, table_name: str) -> None:
+        logger.log("INFOR", f"Create table: {table_name}")
+        self.exec(f"""
+        create table {table_name}(
+            ip          TEXT                NOT NULL, 
+            key         TEXT                NOT NULL, 
+            scanned_at  REAL                NOT NULL, 
+            primary key (ip, key));""")
+
+    def get_fresh_hosts(self, key: str, ttl: int = settings.database.cache_ttl) -> set:
+        """
+        返回在有效期内以相同参数扫描过的主机
+
+        :param str key :  扫描参数标识，见netscan.port_scan_key
+        :param int ttl :  有效期，单位秒
+        :rtype  : set
+        """
+        data = self.exec(
+            f"select ip from {self.cache_table_name} where key=? and scanned_at>=?", (key, time.time() - ttl))
+        return set(ip for ip, in data)
+
+    def update_cache(self, key: str, ips: list) -> None:
+        """
+        记录主机的扫描时间
+
+        :param str key  :  扫描参数标识，见netscan.port_scan_key
+        :param list ips :  已扫描的主机
+        """
+        logger.log("DEBUG", f"Update {self.cache_table_name}")
+        now = time.time()
+        self.execmany(f"""
+        insert or replace into {self.cache_table_name} (
+            ip, key, scanned_at
+        ) values (?, ?, ?)""", [(ip, key, now) for ip in ips])
+        self.connect.commit()
+
+    def create_fingerprint_table(self, table_name: str) -> None:
+        logger.log("INFOR", f"Create table: {table_name}")
+        self.exec(f"""
+        create table {table_name}(
+            hash        TEXT                PRIMARY KEY, 
+            name        TEXT, 
+            product     TEXT, 
+            version     TEXT, 
+            extrainfo   TEXT, 
+            conf        TEXT, 
+            cpe         TEXT, 
+            created_at  REAL                NOT NULL, 
+            used_at     REAL                NOT NULL);""")
+        self.exec(f"create index if not exists idx_{table_name}_used on {table_name} (used_at)")
+
+    def get_fingerprints(self, ttl: int = settings.database.fingerprint_ttl) -> dict:
+        """
+        读取有效期内的服务指纹，并删除过期的指纹
+
+        :param int ttl :  有效期，单位秒
+        :return : {banner哈希: (name, product, version, extrainfo, conf, cpe, created_at)}
+        :rtype  : dict
+        """
+        expired = time.time() - ttl
+        self.exec(f"delete from {self.fingerprint_table_name} where created_at<?", (expired,))
+        self.connect.commit()
+        data = self.exec(f"""
+        select hash, name, product, version, extrainfo, conf, cpe, created_at
+        from {self.fingerprint_table_name}""")
+        return {key: tuple(values) for key, *values in data}
+
+    def update_fingerprints(self, data: list, used: dict, size: int = settings.database.fingerprint_size) -> None:
+        """
+        保存新的服务指纹和指纹的使用时间，只保留最近使用的size个指纹
+
+        :param list data :  (hash, name, product, version, extrainfo, conf, cpe, created_at)组成的list
+        :param dict used :  {banner哈希: 最后使用时间}
+        :param int size  :  最多保存的指纹数量
+        """
+        logger.log("DEBUG", f"Update {self.fingerprint_table_name}")
+        self.execmany(f"""
+        insert or replace into {self.fingerprint_table_name} (
+            hash, name, product, version, extrainfo, conf, cpe, created_at, used_at
+        ) values (?, ?, ?, ?, ?, ?, ?, ?, ?)""", [(*itm, used.get(itm[0], itm[-1])) for itm in data])
+        self.execmany(f"update {self.fingerprint_table_name} set used_at=? where hash=?",
+                      [(used_at, key) for key, used_at in used.items()])
+        self.exec(f"""
+        delete from {self.fingerprint_table_name} where hash not in (
+            select hash from {self.fingerprint_table_name} order by used_at desc limit ?)""", (size,))
+        self.connect.commit()
+
+    def get_cached_results(self, table_name: str, ips: list) -> dict:
+        """
+        从表中读取主机每个端口最新的一条记录
+
+        :param str table_name :  查询表
+        :param list ips :  主机
+        :return : 与netscan.PortScan相同结构的数据，端口信息包含title和status
+        :rtype  : dict
+        """
+        results = dict()
+        fields = ["state", "reason", "name", "product", "version",
+                  "extrainfo", "conf", "cpe", "title", "status", "truncated"]
+        ips = list(ips)
+        for index in range(0, len(ips), 500):
+            chunk = ips[index:index + 500]
+            data = self.exec(f"""
+            select ip, port, {", ".join(fields)} from {table_name} where id in (
+                select max(id) from {table_name}
+                where port is not NULL and ip in ({", ".join("?" * len(chunk))})
+                group by ip, port)""", tuple(chunk))
+            for ip, port, *values in data:
+                results.setdefault(ip, {"ports": dict()})["ports"][port] = dict(zip(fields, values))
+        return results
+
+    def diff_table(self, src: str, dst: str, ips: list, down: list = None) -> list:
+        """
+        对比本次扫描结果与历史快照，只返回发生变化的端口
+
+        历史快照为dst表中每个(ip, port)最新的一条记录，通过(ip, port)索引逐条查询，不会把两张表全部读入内存
+
+        :param str src   :  本次扫描结果表，需在merging_table之前调用
+        :param str dst   :  历史数据表
+        :param list ips  :  本次实际进行了端口扫描的主机，用于判断端口关闭
+        :param list down :  本次存活探测中没有响应的已知主机，其历史开放端口以lost_host返回，默认None
+        :return : 在端口数据基础上增加change（new_host/open_port/closed_port/changed/lost_host）
+                  及old_product、old_version、old_title字段的dict组成的list
+        :rtype  : list
+        """
+        logger.log("DEBUG", f"Diff table {src} and {dst}")
+        fields = ["cidr", "ip", "domain", "port", "state", "reason", "name",
+                  "product", "version", "extrainfo", "conf", "cpe", "title", "status", "truncated"]
+        results = list()
+
+        # 视图不能作为left join的右表展开，所以分别查询有历史记录和无历史记录的端口
+        data = self.exec(f"""
+        select {", ".join(f"t.{field}" for field in fields)}, exists(select 1 from {dst} where ip=t.ip)
+        from {src} t
+        where t.port is not NULL and not exists(select 1 from {dst} where ip=t.ip and port=t.port)""")
+        for *values, known in data:
+            row = dict(zip(fields, values))
+            row.update(change="open_port" if known else "new_host", old_product=None, old_version=None, old_title=None)
+            results.append(row)
+
+        data = self.exec(f"""
+        select {", ".join(f"t.{field}" for field in fields)},
+            p.state, p.product, p.version, p.title
+        from {src} t join {dst} p on p.id = (
+            select max(id) from {dst} where ip=t.ip and port=t.port)
+        where t.port is not NULL and (
+            p.state is not t.state or p.product is not t.product
+            or p.version is not t.version or p.title is not t.title)""")
+        for *values, old_state, old_product, old_version, old_title in data:
+            row = dict(zip(fields, values))
+            if old_state != "open" and row["state"] == "open":
+                change = "open_port"
+            elif old_state == "open" and row["state"] != "open":
+                change = "closed_port"
+            else:
+                change = "changed"
+            row.update(change=change, old_product=old_product, old_version=old_version, old_title=old_title)
+            results.append(row)
+
+        self.exec("create temp table if not exists SCANNED (ip TEXT PRIMARY KEY)")
+        self.exec("delete from temp.SCANNED")
+        self.execmany("insert or ignore into temp.SCANNED (ip) values (?)", [(ip,) for ip in ips])
+        data = self.exec(f"""
+        select {", ".join(f"p.{field}" for field in fields)} from {dst} p
+        where p.id in (
+            select max(id) from {dst} where ip in (select ip from temp.SCANNED) group by ip, port)
+        and p.port is not NULL and p.state='open'
+        and not exists (select 1 from {src} where ip=p.ip and port=p.port)""")
+        for values in data:
+            row = dict(zip(fields, values))
+            row.update(change="closed_port", old_product=row["product"],
+                       old_version=row["version"], old_title=row["title"], state="closed")
+            results.append(row)
+
+        # 主机不再存活，无法判断端口状态，state留空
+        self.exec("create temp table if not exists DOWN (ip TEXT PRIMARY KEY)")
+        self.exec("delete from temp.DOWN")
+        self.execmany("insert or ignore into temp.DOWN (ip) values (?)", [(ip,) for ip in down or list()])
+        data = self.exec(f"""
+        select {", ".join(f"p.{field}" for field in fields)} from {dst} p
+        where p.id in (
+            select max(id) from {dst} where ip in (select ip from temp.DOWN) group by ip, port)
+        and p.port is not NULL and p.state='open'
+        and not exists (select 1 from {src} where ip=p.ip)""")
+        for values in data:
+            row = dict(zip(fields, values))
+            row.update(change="lost_host", old_product=row["product"],
+                       old_version=row["version"], old_title=row["title"], state=None)
+            results.append(row)
+
+        logger.log("ALERT", f"Diff: {len(results)} changed ports")
+        return results
+
     def close(self):
         logger.log("DEBUG", "Close database connect")
+        # 更新索引统计信息，否则查询规划器可能选择扫描整个扫描批次而不是使用(host_id, port)索引
+        self.exec("pragma analysis_limit=1000")
+        self.exec("analyze")
         self.connect.commit()
         self.connect.close()
 
-    def export_csv(self, table_name: str, path: str):
-        filename = f'all_{table_name}_data_{time.strftime("%Y%m%d%H%M%S", time.localtime())}{random.randint(0,9999)}.csv'
-        engine = create_engine(r'sqlite:///'+str(self.db_path), echo=False)
-        table = pandas.read_sql_table(table_name=table_name, con=engine)
-        table.to_csv(f"{path}/{filename}")
-        logger.log("ALERT", f"Create file: {path}/{filename}")
+    def table_fields(self, table_name: str) -> list:
+        """
+        返回表的字段名
+
+        :param str table_name :  表名
+        :rtype  : list
+        """
+        cursor = self.connect.cursor()
+        cursor.execute(f"select * from {table_name} limit 0")
+        return [itm[0] for itm in cursor.description]
+
+    def iter_table(self, table_name: str, size: int = 10000):
+        """
+        通过游标分批读取表数据，内存占用与表大小无关
+
+        :param str table_name :  表名
+        :param int size :  每批读取的行数
+        :return : 生成dict的生成器
+        """
+        cursor = self.connect.cursor()
+        try:
+            cursor.execute(f"select * from {table_name}")
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+            return None
+        fields = [itm[0] for itm in cursor.description]
+        rows = cursor.fetchmany(size)
+        while rows:
+            for row in rows:
+                yield dict(zip(fields, row))
+            rows = cursor.fetchmany(size)
 
     def __exit__(self):
         self.close()
 
     def __init__(self):
         self.db_path = settings.database.db_path
-        table_name = settings.database.table_name
-        temp_table_name = settings.database.temp_table_name
+        self.table_name = settings.database.table_name
+        self.temp_table_name = settings.database.temp_table_name
+        self._scan_ids = dict()  # {merged: 本连接直接写入主要表时使用的扫描ID}
 
         logger.log("DEBUG", f"Connect database: {self.db_path}")
         self.connect = sqlite3.connect(self.db_path)
         self.cursor = self.connect.cursor()
+        self.exec(f"pragma journal_mode={settings.database.journal_mode}")
+        self.exec("pragma synchronous=NORMAL")
+
+        version = self.exec("pragma user_version")[0][0]
+        if version < SCHEMA_VERSION:
+            if self.check_table(self.table_name) > 0 or self.check_table(self.temp_table_name) > 0:
+                self.migrate()
+            else:
+                self.create_schema()
 
-        if self.check_table(table_name) < 1:
-            logger.log("DEBUG", f"Table {table_name} is not find")
-            self.create_table(table_name)
+        self.cache_table_name = settings.database.cache_table_name
+        if self.check_table(self.cache_table_name) < 1:
+            self.create_cache_table(self.cache_table_name)
 
-        if self.check_table(temp_table_name) < 1:
-            self.create_table(temp_table_name)
+        self.fingerprint_table_name = settings.database.fingerprint_table_name
+        if self.check_table(self.fingerprint_table_name) < 1:
+            self.create_fingerprint_table(self.fingerprint_table_name)
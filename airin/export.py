@@ -1,50 +1,189 @@
 import json
 import csv
+import gzip
 import time
+from itertools import islice
 
+from airin.analysis import HostStore
 from airin.config import settings
 from airin.config.log import logger
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
-# 生成json结果文件
-def json_report(data: list, path: str, encode: str = "utf-8") -> str:
-    filename = f'all_cidr_result_{time.strftime("%Y%m%d_%H%M%S", time.localtime())}.json'
-    result_json = f"{path}/{filename}"
-    with open(result_json, mode="w", encoding=encode) as json_file:
-        json.dump(data, json_file)
-    return result_json
+
+FIELDS = ["cidr", "ip", "domain", "port", "state", "reason",
+          "name", "product", "version", "extrainfo", "conf", "cpe", "title", "status", "truncated"]
+# 差异结果在端口数据基础上增加的字段，见Database.diff_table
+DIFF_FIELDS = FIELDS + ["change", "old_product", "old_version", "old_title"]
+# 列式格式中取值重复较多、使用字典编码的字段
+DICTIONARY_FIELDS = ("cidr", "state", "reason", "name", "product", "change")
+# 列式格式中的整数字段及其类型
+INTEGER_FIELDS = {"id": "int64", "port": "int32", "status": "int32", "truncated": "int8"}
+
+
+# 打开结果文件，文件名以.gz结尾时使用gzip压缩
+def _open(filepath: str, encode: str):
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, mode="wt", encoding=encode, newline="")
+    return open(filepath, mode="w", encoding=encode, newline="")
+
+# 生成json结果文件，逐条写入而不是先构造整个list
+def json_report(data: list, file, field: list = FIELDS) -> None:
+    file.write("[")
+    for index, itm in enumerate(data):
+        if index > 0:
+            file.write(", ")
+        file.write(json.dumps(itm))
+    file.write("]")
+
+# 生成ndjson结果文件，每行一条json
+def ndjson_report(data: list, file, field: list = FIELDS) -> None:
+    for itm in data:
+        file.write(json.dumps(itm))
+        file.write("\n")
 
 # 生成csv结果文件
-def csv_report(data: list, path: str, encode: str = "utf-8") -> str:
-    filename = f'all_cidr_result_{time.strftime("%Y%m%d_%H%M%S", time.localtime())}.csv'
-    result_csv = f"{path}/{filename}"
-    field = ["cidr", "ip", "domain", "port", "state", "reason",
-                "name", "product", "version", "extrainfo", "conf", "cpe", "title", "status"]
-    with open(result_csv, mode='w', encoding=encode) as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=field)
-        writer.writeheader()
-        for itm in data:
-            writer.writerow(itm)
-    return result_csv
+def csv_report(data: list, file, field: list = FIELDS) -> None:
+    writer = csv.DictWriter(file, fieldnames=field)
+    writer.writeheader()
+    for itm in data:
+        writer.writerow(itm)
+
+# 列式格式的表结构，字典编码字段使用int32索引
+def _arrow_schema(field: list):
+    columns = list()
+    for name in field:
+        if name in DICTIONARY_FIELDS:
+            kind = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        elif name in INTEGER_FIELDS:
+            kind = pyarrow.type_for_alias(INTEGER_FIELDS[name])
+        else:
+            kind = pyarrow.string()
+        columns.append(pyarrow.field(name, kind))
+    return pyarrow.schema(columns)
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+class _RecordBatches(object):
+    """
+    把dict逐批转换为pyarrow.RecordBatch，每批最多size行
+
+    字典编码字段在整个文件中共用一个只增不减的字典，后续批次只追加新值，
+    满足Arrow IPC文件格式只允许字典增量（delta）、不允许替换字典的限制
+    """
+
+    def __init__(self, field: list, size: int = settings.export.columnar_batch_size):
+        self.schema = _arrow_schema(field)
+        self.size = max(1, size)
+        self._dictionaries = {name: dict() for name in field if name in DICTIONARY_FIELDS}
+        # 已经转换好的字典值，只把本批次新出现的值转换后拼接到末尾，没有新值时直接复用
+        self._values = {name: pyarrow.array([], pyarrow.string()) for name in self._dictionaries}
+
+    def _array(self, name: str, values: list):
+        if name in self._dictionaries:
+            dictionary = self._dictionaries[name]
+            indices = list()
+            new = list()
+            for itm in values:
+                if itm is None:
+                    indices.append(None)
+                    continue
+                index = dictionary.get(str(itm))
+                if index is None:
+                    index = dictionary[str(itm)] = len(dictionary)
+                    new.append(str(itm))
+                indices.append(index)
+            if new:
+                self._values[name] = pyarrow.concat_arrays([self._values[name], pyarrow.array(new, pyarrow.string())])
+            return pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, pyarrow.int32()), self._values[name])
+        kind = self.schema.field(name).type
+        try:
+            return pyarrow.array(values, kind)
+        except (TypeError, ValueError):
+            # 类型不一致时（如从csv读取的端口为字符串）逐个转换，无法转换的值为null
+            convert = _to_int if name in INTEGER_FIELDS else _to_str
+            return pyarrow.array([convert(itm) for itm in values], kind)
+
+    def __call__(self, data):
+        data = iter(data)
+        rows = list(islice(data, self.size))
+        while rows:
+            yield pyarrow.record_batch([self._array(name, [itm.get(name) for itm in rows])
+                                        for name in self.schema.names], schema=self.schema)
+            rows = list(islice(data, self.size))
+
+# 生成parquet结果文件，每批数据为一个row group
+def parquet_report(data: list, filepath: str, field: list = FIELDS) -> None:
+    batches = _RecordBatches(field)
+    with pyarrow.parquet.ParquetWriter(filepath, batches.schema) as writer:
+        for batch in batches(data):
+            writer.write_batch(batch)
+
+# 生成Arrow IPC文件（Feather V2），每批数据为一个record batch
+def arrow_report(data: list, filepath: str, field: list = FIELDS) -> None:
+    batches = _RecordBatches(field)
+    options = pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    with pyarrow.ipc.new_file(filepath, batches.schema, options=options) as writer:
+        for batch in batches(data):
+            writer.write_batch(batch)
 
 # 入口
-def entrance(data: list, path: str = settings.result_save_dir, fmt: str = settings.export.result_save_format, encode: str = settings.export.result_save_encode) -> str:
-    # 用于匹配文件格式与函数
+def entrance(data: list or HostStore, path: str = settings.result_save_dir, fmt: str = settings.export.result_save_format, encode: str = settings.export.result_save_encode, prefix: str = "all_cidr_result", field: list = FIELDS) -> str:
+    # 用于匹配文件格式与函数，格式后加上.gz则压缩，如csv.gz
     match = {
         "csv": csv_report,
-        "json": json_report
+        "json": json_report,
+        "ndjson": ndjson_report
     }
+    # 列式格式，需要安装pyarrow，直接写入文件路径且不支持.gz后缀
+    columnar = {
+        "parquet": parquet_report,
+        "arrow": arrow_report
+    }
+
+    # HostStore直接逐行读取，无需先调用data_conversion展开
+    if isinstance(data, HostStore):
+        data = data.rows()
 
-    # 调用对应函数
+    # 调用对应函数，data可以是list、生成器或Database.iter_table，结果逐行写入文件
     logger.log("INFOR", "Start exporting results")
     try:
-        if fmt in match:
-            filepath = match[fmt](data, path, encode)
+        base, _, compress = fmt.partition(".")
+        filename = f'{prefix}_{time.strftime("%Y%m%d_%H%M%S", time.localtime())}.{fmt}'
+        filepath = f"{path}/{filename}"
+        if base in match and compress in ("", "gz"):
+            with _open(filepath, encode) as file:
+                match[base](data, file, field)
+            logger.log("ALERT", f"The work result: {filepath}")
+        elif fmt in columnar and pyarrow is not None:
+            columnar[fmt](data, filepath, field)
             logger.log("ALERT", f"The work result: {filepath}")
+        elif fmt in columnar:
+            logger.log("ERROR", f"Exporting {fmt} requires pyarrow, please install it first")
+            filepath = None
         else:
             logger.log("ERROR", "Bad file format")
+            filepath = None
     except Exception as identifier:
         logger.log("ERROR", identifier)
         filepath = identifier
 
-    return filepath
\ No newline at end of file
+    return filepath
+
+
+# 差异结果入口
+def diff_entrance(data: list, path: str = settings.result_save_dir, fmt: str = settings.export.result_save_format, encode: str = settings.export.result_save_encode) -> str:
+    return entrance(data, path, fmt, encode, "diff_cidr_result", DIFF_FIELDS)
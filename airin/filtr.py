@@ -0,0 +1,123 @@
+import re
+import operator
+
+
+"""
+filtr将{"field", "operator", "value"}组成的筛选规则编译成判断函数，只编译一次，
+value为数值时按数值比较（"10" > "2"），否则按字符串比较
+"""
+
+
+_COMPARE = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+
+def to_number(value) -> float:
+    """
+    将值转换为数值，无法转换时返回None
+
+    :param value :  int、float或str
+    :rtype  : float
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compile_compare(op: str, value):
+    compare = _COMPARE[op]
+    missing = op == "!="  # 字段不存在或无法转换为数值时的结果
+    number = to_number(value)
+    if number is not None:
+        def test(itm) -> bool:
+            try:
+                return compare(float(itm), number)
+            except (TypeError, ValueError):
+                return missing
+    else:
+        text = str(value)
+
+        def test(itm) -> bool:
+            return missing if itm is None else compare(str(itm), text)
+    return test
+
+
+def _compile_in(op: str, value):
+    values = value.split(",") if isinstance(value, str) else list(value)
+    numbers = set(to_number(itm) for itm in values)
+    negate = op == "not in"
+    if None not in numbers:
+        def test(itm) -> bool:
+            try:
+                return (float(itm) in numbers) != negate
+            except (TypeError, ValueError):
+                return negate
+    else:
+        texts = set(str(itm) for itm in values)
+
+        def test(itm) -> bool:
+            return negate if itm is None else (str(itm) in texts) != negate
+    return test
+
+
+def _compile_regex(op: str, value):
+    pattern = re.compile(str(value))
+
+    def test(itm) -> bool:
+        return itm is not None and pattern.search(str(itm)) is not None
+    return test
+
+
+_COMPILERS = dict.fromkeys(_COMPARE, _compile_compare)
+_COMPILERS.update({"in": _compile_in, "not in": _compile_in, "regex": _compile_regex})
+
+
+def compile_rule(rule: dict):
+    """
+    将一条筛选规则编译成判断函数
+
+    :param dict rule :  {"field": str, "operator": str, "value": str/int/float/list}
+    :return : (字段名, 以字段值为参数、返回bool的函数)
+    :rtype  : (str, function)
+    """
+    field = rule.get("field")
+    op = rule.get("operator")
+    if not field:
+        raise ValueError(f"Filter rule has no field: {rule}")
+    if op not in _COMPILERS:
+        raise ValueError(f"Unknown filter operator: {op}")
+    return field, _COMPILERS[op](op, rule.get("value"))
+
+
+class RowFilter(object):
+    """
+    编译后的筛选规则，数据满足所有规则时保留
+
+    可以逐条判断dict，也可以用apply按列筛选整块数据：每条规则只取出一个字段的值进行判断，
+    并且只检查前面的规则保留下来的数据
+    """
+
+    def __init__(self, rules: list = None):
+        self.rules = [compile_rule(rule) for rule in rules or list()]
+
+    def __call__(self, row: dict) -> bool:
+        return all(test(row.get(field)) for field, test in self.rules)
+
+    def apply(self, rows: list) -> list:
+        """
+        筛选一块数据
+
+        :param list rows :  由dict组成的list
+        :return : 经过滤的数据，结构不变
+        :rtype  : list
+        """
+        for field, test in self.rules:
+            rows = [itm for itm in rows if test(itm.get(field))]
+        return rows
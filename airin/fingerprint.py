@@ -0,0 +1,202 @@
+import time
+import hashlib
+import threading
+
+from airin.config import settings
+from airin.config.log import logger
+from airin.database import Database
+
+
+"""
+fingerprint是服务指纹缓存：以开放端口主动发送的第一个数据包（banner）的哈希为键，保存nmap版本识别的结果，
+大量主机运行相同的服务（相同的镜像、设备）时，banner完全相同的端口不再重复进行版本识别
+
+一次运行中所有扫描批次共用一个缓存：load读取一次，shared在扫描线程中取得该缓存，save在运行结束时写回一次
+"""
+
+
+# 缓存的nmap版本识别字段
+FIELDS = ("name", "product", "version", "extrainfo", "conf", "cpe")
+# 不缓存的服务名：无法识别或被TCP Wrapper拦截，同一banner换一个主机可能得到不同结果
+UNCACHED_NAMES = ("", "unknown", "tcpwrapped")
+
+
+def banner_hash(banner: bytes) -> str:
+    """
+    banner的哈希，没有banner时返回None
+
+    :param bytes banner :  端口主动发送的数据
+    :rtype  : str
+    """
+    if not banner:
+        return None
+    return hashlib.sha1(banner).hexdigest()
+
+
+class FingerprintCache(object):
+    """
+    服务指纹缓存，创建时从数据库读取有效期内的指纹，扫描中在内存中查找和添加，结束时调用save写回数据库，线程安全
+
+    写回时记录指纹的最后使用时间，数据库只保留最近使用的settings.database.fingerprint_size个指纹（LRU），
+    超过settings.database.fingerprint_ttl的指纹在读取时删除
+    """
+
+    def __init__(self, db: Database = None):
+        """
+        :param Database db :  读取指纹使用的数据库连接，默认None时新建连接
+        """
+        self.hits = 0
+        self.misses = 0
+        self.total = 0  # 开放端口数量
+        self.labelled = 0  # 由指纹缓存得到结果、无需版本识别的端口数量
+        self._used = dict()  # {banner哈希: 最后使用时间}
+        self._added = list()  # 本次运行新增的指纹
+        self._lock = threading.Lock()
+        try:
+            if db is None:
+                db = Database()
+                self._data = db.get_fingerprints()
+                db.close()
+            else:
+                self._data = db.get_fingerprints()
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+            self._data = dict()
+        logger.log("DEBUG", f"Loaded {len(self._data)} service fingerprints")
+
+    def get(self, key: str) -> dict:
+        """
+        查找指纹，计入命中和未命中的统计
+
+        :param str key :  banner哈希
+        :return : 版本识别字段组成的dict，不存在时返回None
+        :rtype  : dict
+        """
+        info = self.resolve(key)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return info
+
+    def resolve(self, key: str) -> dict:
+        """
+        与get相同，但不计入统计，用于查找本次扫描中新增的指纹
+        """
+        with self._lock:
+            values = self._data.get(key)
+            if values is None:
+                return None
+            self._used[key] = time.time()
+        return dict(zip(FIELDS, values))
+
+    def put(self, key: str, info: dict) -> bool:
+        """
+        添加一个版本识别结果，没有服务名、服务名无法识别或可信度低于settings.database.fingerprint_min_conf的结果不缓存
+
+        :param str key   :  banner哈希
+        :param dict info :  nmap端口信息，见netscan._parse_host
+        :return : 是否已缓存
+        :rtype  : bool
+        """
+        if (info.get("name") or "") in UNCACHED_NAMES:
+            return False
+        try:
+            conf = int(info.get("conf") or 0)
+        except ValueError:
+            conf = 0
+        if conf < settings.database.fingerprint_min_conf:
+            return False
+        values = tuple(info.get(field) or "" for field in FIELDS)
+        now = time.time()
+        with self._lock:
+            self._data[key] = values + (now,)
+            self._added.append((key, *values, now))
+        return True
+
+    def record(self, total: int, labelled: int) -> None:
+        """
+        累计一个扫描批次的统计
+
+        :param int total    :  开放端口数量
+        :param int labelled :  由指纹缓存得到结果、无需版本识别的端口数量
+        """
+        with self._lock:
+            self.total += total
+            self.labelled += labelled
+
+    def report(self) -> None:
+        """
+        输出本次运行的命中统计
+        """
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0
+        logger.log("INFOR", f"Fingerprint cache: {self.hits} hits, {self.misses} misses ({ratio:.1%}), "
+                            f"{self.labelled}/{self.total} open ports labelled without version detection")
+
+    def save(self, db: Database = None) -> None:
+        """
+        将新增的指纹和指纹的使用时间写回数据库
+
+        :param Database db :  写入使用的数据库连接，默认None时新建连接
+        """
+        with self._lock:
+            added, used = self._added, self._used
+            self._added = list()
+            self._used = dict()
+        if not added and not used:
+            return None
+        try:
+            if db is None:
+                db = Database()
+                db.update_fingerprints(added, used)
+                db.close()
+            else:
+                db.update_fingerprints(added, used)
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def load(db: Database = None) -> FingerprintCache:
+    """
+    创建本次运行共用的指纹缓存，应在主线程中使用本次运行的数据库连接调用
+
+    :param Database db :  见FingerprintCache
+    :rtype  : FingerprintCache
+    """
+    global _shared
+    with _shared_lock:
+        _shared = FingerprintCache(db)
+        return _shared
+
+
+def shared() -> FingerprintCache:
+    """
+    返回本次运行共用的指纹缓存，未调用load时（直接调用netscan时）创建并读取一次
+
+    :rtype  : FingerprintCache
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FingerprintCache()
+        return _shared
+
+
+def save(db: Database = None) -> None:
+    """
+    运行结束时写回共用的指纹缓存并输出统计，之后的扫描会重新读取
+
+    :param Database db :  见FingerprintCache.save
+    """
+    global _shared
+    with _shared_lock:
+        cache, _shared = _shared, None
+    if cache is not None:
+        cache.save(db)
+        cache.report()
@@ -0,0 +1,291 @@
+import socket
+import ipaddress
+from array import array
+from bisect import bisect_right
+from operator import itemgetter
+
+
+"""
+iptools负责IPv4地址与整数之间的转换、扫描目标（IP/CIDR/IP范围）的解析与合并，以及CIDR索引
+"""
+
+
+def ip_to_int(ip: str) -> int:
+    """
+    将点分十进制IPv4地址转换为32位整数，每段必须是0-255且不能有前导零
+
+    :param str ip :  IPv4地址
+    :return : 32位整数
+    :rtype  : int
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError):
+        raise ValueError(f"Bad IPv4 address: {ip}") from None
+
+
+def int_to_ip(number: int) -> str:
+    """
+    将32位整数转换为点分十进制IPv4地址
+
+    :param int number :  32位整数
+    :return : IPv4地址
+    :rtype  : str
+    """
+    return f"{number >> 24 & 255}.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+def parse_cidr(cidr: str) -> (int, int):
+    """
+    解析CIDR，主机位会被清零，不带掩码的IP视为/32
+
+    :param str cidr :  CIDR字符串
+    :return : (网络地址整数, 掩码长度)
+    :rtype  : (int, int)
+    """
+    ip, slash, prefix = cidr.partition("/")
+    if slash and not prefix.isdigit():
+        raise ValueError(f"Bad CIDR: {cidr}")
+    prefix = int(prefix) if prefix else 32
+    if not 0 <= prefix <= 32:
+        raise ValueError(f"Bad CIDR: {cidr}")
+    mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+    return ip_to_int(ip) & mask, prefix
+
+
+def cidr_to_range(cidr: str) -> (int, int):
+    """
+    将CIDR转换为闭区间[起始地址, 结束地址]
+
+    :param str cidr :  CIDR字符串
+    :return : (起始地址整数, 结束地址整数)
+    :rtype  : (int, int)
+    """
+    network, prefix = parse_cidr(cidr)
+    return network, network | (0xFFFFFFFF >> prefix)
+
+
+def merge_intervals(ranges: list, adjacent: bool = True) -> list:
+    """
+    合并重叠（以及相邻）的闭区间
+
+    :param list ranges   :  由(起始地址, 结束地址)组成的list
+    :param bool adjacent :  是否合并相邻的区间
+    :return : 按地址排序的(起始地址, 结束地址)组成的list
+    :rtype  : list
+    """
+    results = list()
+    gap = 1 if adjacent else 0
+    last_start = last_end = None
+    for start, end in sorted(ranges, key=itemgetter(0)):
+        if last_end is not None and start <= last_end + gap:
+            if end > last_end:
+                last_end = end
+            continue
+        if last_end is not None:
+            results.append((last_start, last_end))
+        last_start, last_end = start, end
+    if last_end is not None:
+        results.append((last_start, last_end))
+    return results
+
+
+def merge_ranges(ranges: list) -> (array, array):
+    """
+    合并重叠或相邻的区间，返回排序后的起始地址和结束地址
+
+    :param list ranges :  由(起始地址, 结束地址)组成的list
+    :return : (起始地址array, 结束地址array)
+    :rtype  : (array, array)
+    """
+    starts = array("I")
+    ends = array("I")
+    for start, end in merge_intervals(ranges):
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+
+def in_ranges(start: int, end: int, starts: array, ends: array) -> bool:
+    """
+    二分查找区间[start, end]是否完全落在merge_ranges生成的某个区间内
+
+    :param int start  :  起始地址整数
+    :param int end    :  结束地址整数
+    :param array starts :  起始地址array
+    :param array ends   :  结束地址array
+    :rtype  : bool
+    """
+    index = bisect_right(starts, start) - 1
+    return index >= 0 and end <= ends[index]
+
+
+def _parse_target6(target: str) -> (int, int):
+    if "-" in target:
+        first, _, last = target.partition("-")
+        return int(ipaddress.IPv6Address(first)), int(ipaddress.IPv6Address(last))
+    network = ipaddress.IPv6Network(target, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def parse_target(target: str) -> (int, int, int):
+    """
+    将扫描目标解析为闭区间，无法解析时抛出ValueError
+
+    IPv4支持a.b.c.d、a.b.c.d/n、a.b.c.d-e和a.b.c.d-w.x.y.z，IPv6支持地址、CIDR和地址范围
+
+    :param str target :  IP/CIDR/IP范围
+    :return : (IP版本, 起始地址整数, 结束地址整数)
+    :rtype  : (int, int, int)
+    """
+    target = target.strip()
+    if ":" in target:
+        version = 6
+        start, end = _parse_target6(target)
+    elif "-" in target:
+        version = 4
+        first, _, last = target.partition("-")
+        start = ip_to_int(first)
+        if "." in last:
+            end = ip_to_int(last)
+        elif last.isdigit() and int(last) <= 255:
+            end = start & 0xFFFFFF00 | int(last)
+        else:
+            raise ValueError(f"Bad IP range: {target}")
+    else:
+        version = 4
+        start, end = cidr_to_range(target)
+    if end < start:
+        raise ValueError(f"Bad IP range: {target}")
+    return version, start, end
+
+
+def format_ip(number: int, version: int = 4) -> str:
+    """
+    将整数转换为IPv4或IPv6地址
+
+    :param int number  :  地址整数
+    :param int version :  IP版本
+    :rtype  : str
+    """
+    if version == 4:
+        return int_to_ip(number)
+    return str(ipaddress.IPv6Address(number))
+
+
+def range_to_prefixes(start: int, end: int, version: int = 4, min_prefix: int = 0) -> list:
+    """
+    将闭区间[start, end]转换为最少的前缀
+
+    :param int start      :  起始地址整数
+    :param int end        :  结束地址整数
+    :param int version    :  IP版本
+    :param int min_prefix :  前缀长度的最小值，用于限制单个前缀包含的地址数量
+    :return : 按地址排序的(网络地址整数, 前缀长度)组成的list
+    :rtype  : list
+    """
+    bits = 32 if version == 4 else 128
+    limit = bits - min_prefix
+    size = end - start + 1
+    if size & (size - 1) == 0 and start & (size - 1) == 0 and size.bit_length() - 1 <= limit:  # 区间本身就是一个前缀
+        return [(start, bits + 1 - size.bit_length())]
+    results = list()
+    while start <= end:
+        # 以start开头、按自身大小对齐且不超出end的最大地址块
+        size = (start & -start).bit_length() - 1 if start else bits
+        size = min(size, (end - start + 1).bit_length() - 1, limit)
+        results.append((start, bits - size))
+        start += 1 << size
+    return results
+
+
+def range_to_cidrs(start: int, end: int, version: int = 4) -> list:
+    """
+    将闭区间[start, end]转换为最少的CIDR
+
+    :param int start   :  起始地址整数
+    :param int end     :  结束地址整数
+    :param int version :  IP版本
+    :return : 按地址排序的CIDR组成的list
+    :rtype  : list
+    """
+    return [f"{format_ip(network, version)}/{prefix}" for network, prefix in range_to_prefixes(start, end, version)]
+
+
+def coalesce(targets: list, adjacent: bool = False) -> list:
+    """
+    解析扫描目标，去除重复和被包含的目标，重叠的目标合并后再转换为最少的CIDR，无法解析的目标会被忽略
+
+    :param list targets  :  IP/CIDR/IP范围组成的list
+    :param bool adjacent :  是否合并相邻的目标，默认不合并以保留cut_mask分割出的子网
+    :return : 按地址排序的CIDR组成的list，IPv4在前
+    :rtype  : list
+    """
+    ranges = {4: list(), 6: list()}
+    for target in targets:
+        try:
+            version, start, end = parse_target(str(target))
+        except ValueError:
+            continue
+        ranges[version].append((start, end))
+    results = list()
+    for version in (4, 6):
+        for start, end in merge_intervals(ranges[version], adjacent):
+            results += range_to_cidrs(start, end, version)
+    return results
+
+
+class CidrIndex(object):
+    """
+    CIDR最长前缀匹配索引
+
+    每种掩码长度对应一个{网络地址: CIDR字符串}的字典，查询时从最长掩码开始逐级匹配，
+    单个IP最多查询33次字典，与CIDR数量无关
+    """
+
+    def __init__(self, cidrs: list = None):
+        self._tables = dict()
+        self._prefixes = list()
+        for cidr in cidrs or list():
+            self.add(cidr)
+
+    def add(self, cidr: str) -> None:
+        """
+        添加CIDR，无法解析的CIDR会被忽略
+
+        :param str cidr :  CIDR字符串
+        """
+        try:
+            network, prefix = parse_cidr(cidr)
+        except ValueError:
+            return None
+        if prefix not in self._tables:
+            self._tables[prefix] = dict()
+            self._prefixes = [((0xFFFFFFFF << (32 - itm)) & 0xFFFFFFFF, self._tables[itm])
+                              for itm in sorted(self._tables, reverse=True)]
+        self._tables[prefix].setdefault(network, cidr)
+
+    def lookup(self, ip: str or int) -> str:
+        """
+        返回包含该IP的最长前缀CIDR，不存在时返回None
+
+        :param str or int ip :  IPv4地址或其整数形式
+        :return : CIDR字符串
+        :rtype  : str
+        """
+        if isinstance(ip, str):
+            try:
+                ip = ip_to_int(ip)
+            except ValueError:
+                return None
+        for mask, table in self._prefixes:
+            cidr = table.get(ip & mask)
+            if cidr is not None:
+                return cidr
+        return None
+
+    def __contains__(self, ip: str or int) -> bool:
+        return self.lookup(ip) is not None
+
+    def __len__(self) -> int:
+        return sum(len(table) for table in self._tables.values())
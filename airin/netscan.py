@@ -1,8 +1,20 @@
 import nmap
-from re import match
+import shlex
+import hashlib
+import tempfile
+import threading
+import subprocess
+from queue import Queue
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
 
+from airin import aioscan
+from airin import fingerprint
+from airin.analysis import TARGETS_FILE_SIZE, remove_targets_files, write_targets_file
 from airin.config import settings
 from airin.config.log import logger
+from airin.iptools import ip_to_int, parse_target
+from airin.ratelimit import scheduler
 
 
 """
@@ -10,25 +22,211 @@ netscan负责网络扫描及数据提取
 """
 
 
-def _NmapStart(target: str, stype: str = "alive") -> dict:
+def _nmap_arguments(target: str, stype: str = "alive", ports: str = None) -> str:
     """
-    网络扫描核心函数，直接返回原始数据
+    拼接nmap参数与扫描目标
 
     :param str target :  IP/CIDR/FilePath
-    :param str stype  :  扫描类型，"alive"/"port"可选，默认"alive"
-    :return : nmap scan result
-    :rtype  : dict
+    :param str stype  :  扫描类型，"alive"/"discovery"/"port"可选，默认"alive"
+    :param str ports  :  只扫描这些端口，如"22,80"，默认None使用参数中的设置
+    :return : nmap arguments
+    :rtype  : str
     """
-    nm = nmap.PortScanner()
     arguments = eval(f"settings.netscan.arguments_{stype}")
     arguments += " "  # 加上一个空格隔断后续参数
-    if match("\d+\.\d+\.\d+\.\d+", str(target)):  # 匹配IP或CIDR
-        arguments += target
-    else:
+    if scheduler.enabled and settings.ratelimit.enable_nmap_rate and "--max-rate" not in arguments:
+        # 每个nmap进程分得当前全局速率的一份
+        rate = max(1, int(scheduler.metrics()["limit"] / max(1, int(settings.netscan.process_count))))
+        arguments += f"--max-rate {rate} "
+    if ports:
+        arguments += f"-Pn -p{ports} "  # 端口已确认开放，无需再进行主机发现
+    try:
+        parse_target(str(target))
+    except ValueError:
         arguments += f"-iL {target}"  # 作为文件名拼接
-    result = nm.scan(hosts=" ", arguments=arguments,
-                     sudo=settings.netscan.enable_sudo)
-    return result
+    else:
+        arguments += str(target)  # IP、CIDR或IP范围
+    return arguments
+
+
+def port_scan_key() -> str:
+    """
+    端口扫描参数（含端口列表）的标识，用作扫描结果缓存的键
+
+    :rtype  : str
+    """
+    arguments = settings.netscan.arguments_port
+    discovery = settings.netscan.arguments_discovery
+    if settings.netscan.backend == "asyncio":
+        discovery = f"asyncio:{settings.netscan.ports}"
+        if not settings.netscan.enable_two_phase:
+            arguments = f"{discovery}:banner={settings.netscan.enable_banner}"
+    if settings.netscan.enable_two_phase:
+        arguments = f"{discovery}|{arguments}"
+    return hashlib.sha1(arguments.encode()).hexdigest()
+
+
+def _nmap_command(target: str, stype: str = "alive", ports: str = None) -> list:
+    """
+    以 -oX - 输出XML的nmap命令行
+
+    :param str target :  IP/CIDR/FilePath
+    :param str stype  :  扫描类型，"alive"/"discovery"/"port"可选，默认"alive"
+    :param str ports  :  见_nmap_arguments
+    :rtype  : list
+    """
+    command = ["nmap", "-oX", "-"] + shlex.split(_nmap_arguments(target, stype, ports))
+    if settings.netscan.enable_sudo:
+        command = ["sudo"] + command
+    return command
+
+
+class _Children(object):
+    """
+    记录_ScanPool正在运行的nmap进程，_ScanPool关闭时终止这些进程
+    关闭后不再登记新进程，调用方应直接结束未能登记的进程
+    """
+
+    def __init__(self):
+        self.stopped = False
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def add(self, proc: subprocess.Popen) -> bool:
+        with self._lock:
+            if self.stopped:
+                return False
+            self._procs.add(proc)
+        return True
+
+    def discard(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            self._procs.discard(proc)
+
+    def terminate(self) -> None:
+        with self._lock:
+            self.stopped = True
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+
+def _NmapStart(target: str, stype: str = "alive", ports: str = None, children: _Children = None) -> dict:
+    """
+    网络扫描核心函数，直接返回原始数据
+
+    :param str target         :  IP/CIDR/FilePath
+    :param str stype          :  扫描类型，"alive"/"discovery"/"port"可选，默认"alive"
+    :param str ports          :  见_nmap_arguments
+    :param _Children children :  登记nmap进程，默认None
+    :return : nmap scan result
+    :rtype  : dict
+    """
+    nm = nmap.PortScanner()
+    # 自行启动nmap以便_ScanPool关闭时终止进程，XML仍交给python-nmap解析
+    proc = subprocess.Popen(_nmap_command(target, stype, ports), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if children is not None and not children.add(proc):
+        proc.kill()
+    try:
+        output, error = proc.communicate()
+    finally:
+        if children is not None:
+            children.discard(proc)
+    if proc.returncode != 0:
+        raise nmap.PortScannerError(error.decode(errors="replace"))
+    return nm.analyse_nmap_xml_scan(output, nmap_err=error.decode(errors="replace"))
+
+
+def _parse_host(element: ElementTree.Element) -> (str, dict):
+    """
+    将nmap XML中的<host>节点转换为与nmap.PortScanner.scan相同结构的数据
+
+    :param Element element :  <host>节点
+    :return : (host, host data)
+    :rtype  : (str, dict)
+    """
+    addresses = dict()
+    for address in element.findall("address"):
+        addresses[address.get("addrtype")] = address.get("addr")
+    host = addresses.get("ipv4") or addresses.get("ipv6") or next(iter(addresses.values()), None)
+
+    status = element.find("status")
+    data = {
+        "hostnames": [{"name": hostname.get("name"), "type": hostname.get("type")}
+                      for hostname in element.findall("hostnames/hostname")],
+        "addresses": addresses,
+        "status": {"state": status.get("state"), "reason": status.get("reason")} if status is not None else dict()
+    }
+    for port in element.findall("ports/port"):
+        proto = port.get("protocol")
+        state = port.find("state")
+        service = port.find("service")
+        if service is None:
+            service = ElementTree.Element("service")
+        cpe = service.findall("cpe")
+        data.setdefault(proto, dict())[int(port.get("portid"))] = {
+            "state": state.get("state") if state is not None else "",
+            "reason": state.get("reason") if state is not None else "",
+            "name": service.get("name", ""),
+            "product": service.get("product", ""),
+            "version": service.get("version", ""),
+            "extrainfo": service.get("extrainfo", ""),
+            "conf": service.get("conf", ""),
+            "cpe": cpe[-1].text if cpe else ""
+        }
+    return host, data
+
+
+def _NmapStream(target: str, stype: str = "alive", ports: str = None, children: _Children = None):
+    """
+    以 -oX - 启动nmap并增量解析XML输出，每个<host>结束即返回该主机结果，
+    全部结束后再返回一次包含"nmap"扫描统计的结果
+
+    :param str target         :  IP/CIDR/FilePath
+    :param str stype          :  扫描类型，"alive"/"discovery"/"port"可选，默认"alive"
+    :param str ports          :  见_nmap_arguments
+    :param _Children children :  登记nmap进程，默认None
+    :return : 生成与nmap.PortScanner.scan相同结构的部分结果的生成器
+    """
+    command = _nmap_command(target, stype, ports)
+    command_line = " ".join(command)
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        if children is not None and not children.add(proc):
+            proc.kill()
+        scanstats = {"elapsed": "", "uphosts": "", "downhosts": "", "totalhosts": ""}
+        parser = ElementTree.XMLPullParser(events=("end",))
+        try:
+            while True:
+                # read1只读取管道中已有的数据，不会等待缓冲区填满
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if element.tag == "host":
+                        host, data = _parse_host(element)
+                        element.clear()
+                        if host:
+                            yield {"scan": {host: data}}
+                    elif element.tag == "finished":
+                        scanstats["elapsed"] = element.get("elapsed")
+                    elif element.tag == "hosts":
+                        scanstats["uphosts"] = element.get("up")
+                        scanstats["downhosts"] = element.get("down")
+                        scanstats["totalhosts"] = element.get("total")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            if children is not None:
+                children.discard(proc)
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise nmap.PortScannerError(stderr.read().decode(errors="replace"))
+
+    yield {"nmap": {"command_line": command_line, "scanstats": scanstats}, "scan": dict()}
 
 
 def _ScanInfo(data: dict) -> None:
@@ -49,34 +247,168 @@ def _ScanInfo(data: dict) -> None:
     return None
 
 
-def AliveScan(targets: list) -> list:
+def _target_host_count(target: str) -> int:
     """
-    主机存活扫描入口函数
+    估算单个扫描目标包含的主机数量
 
-    :param list targets :  IP/CIDR/FilePath into list
-    :return : alive host result
-    :rtype  : list
+    :param str target :  IP/CIDR/IP范围/FilePath
+    :return : 主机数量
+    :rtype  : int
     """
-    logger.log("INFOR", "Host alive scan start")
+    target = str(target)
+    try:
+        version, start, end = parse_target(target)
+        return end - start + 1
+    except ValueError:
+        pass
+    try:
+        with open(target, 'r') as target_file:
+            return sum(_target_host_count(line.strip()) for line in target_file if line.strip())
+    except Exception as identifier:
+        logger.log("TRACE", repr(identifier))
+    return 1
 
-    result = list()
-    len_targets = len(targets)
-    for target in targets:
-        logger.log("TRACE", f"Target: {target}")
-        logger.log("INFOR", f"The last {len_targets} targets")
-        len_targets -= 1
 
-        try:
-            data = _NmapStart(target, "alive")
-            _ScanInfo(data)
-            for host in data.get('scan'):
-                result.append(host)
+class _HostBudget(object):
+    """
+    限制所有nmap进程同时扫描的主机总数
+    单个目标超过上限时按上限计算，避免永远无法获取
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, count: int) -> int:
+        count = min(max(1, count), self.limit)
+        with self._condition:
+            while self.in_flight + count > self.limit:
+                self._condition.wait()
+            self.in_flight += count
+        return count
+
+    def release(self, count: int) -> None:
+        with self._condition:
+            self.in_flight -= count
+            self._condition.notify_all()
+
+
+# 所有扫描共用同一个主机预算，流水线模式下多个_ScanPool同时运行也不会超出上限
+_host_budget = _HostBudget(settings.netscan.max_hosts_in_flight)
 
-        except Exception as identifier:
+
+def _scan_worker(target: str, stype: str, budget: _HostBudget, results: Queue, ports: str = None,
+                 children: _Children = None) -> None:
+    count = budget.acquire(_target_host_count(target))
+    finished = False
+    try:
+        if children is not None and children.stopped:
+            return None  # 等待主机预算期间_ScanPool已关闭
+        logger.log("TRACE", f"Target: {target}, hosts in flight: {budget.in_flight}")
+        if settings.netscan.enable_stream:
+            for data in _NmapStream(target, stype, ports, children):
+                results.put((target, data))
+        else:
+            results.put((target, _NmapStart(target, stype, ports, children)))
+        finished = True
+    except Exception as identifier:
+        if children is not None and children.stopped:
+            logger.log("DEBUG", f"Scan of {target} stopped: {identifier!r}")
+        else:
             logger.log("ERROR", repr(identifier))
+    finally:
+        budget.release(count)
+        results.put((target, None if finished else False))  # 标记该目标结束，False表示扫描出错
+
+
+def _ScanPool(targets: list, stype: str = "alive", on_done=None, ports: dict = None):
+    """
+    并行运行多个nmap进程，按完成顺序逐个返回结果
+
+    进程数量由settings.netscan.process_count设置，
+    所有进程同时扫描的主机总数由settings.netscan.max_hosts_in_flight限制，
+    开启settings.netscan.enable_stream时每扫描完一个主机就返回一次部分结果，
+    生成器提前关闭时取消排队中的目标并终止正在运行的nmap进程
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :param str stype    :  扫描类型，"alive"/"discovery"/"port"可选，默认"alive"
+    :param on_done      :  目标扫描成功且其结果全部返回后以target为参数调用，用于记录断点
+    :param dict ports   :  {target: 端口列表字符串}，只扫描目标的这些端口，默认None
+    :return : 生成(target, nmap scan result)的生成器
+    """
+    ports = ports or dict()
+    if len(targets) == 0:
+        return None
+    results = Queue()
+    children = _Children()
+    process_count = max(1, min(int(settings.netscan.process_count), len(targets)))
+    len_targets = len(targets)
+    executor = ThreadPoolExecutor(max_workers=process_count, thread_name_prefix="NmapThread")
+    futures = list()
+    try:
+        for target in targets:
+            futures.append(executor.submit(_scan_worker, str(target), stype, _host_budget, results,
+                                           ports.get(str(target)), children))
+        while len_targets > 0:
+            target, data = results.get()
+            if data is None or data is False:
+                len_targets -= 1
+                logger.log("INFOR", f"The last {len_targets} targets")
+                if data is None and on_done is not None:
+                    on_done(target)
+                continue
+            if data.get("nmap"):
+                _ScanInfo(data)
+            yield target, data
+    finally:
+        # 不等待线程结束：取消排队中的目标，终止运行中的nmap后线程随即退出
+        # （shutdown的cancel_futures参数需要Python 3.9，这里逐个取消以兼容3.8）
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        children.terminate()
+
+
+def _backend_pool():
+    """
+    按settings.netscan.backend选择存活探测和端口发现使用的扫描后端
+
+    :return : _ScanPool或aioscan.ScanPool
+    """
+    if settings.netscan.backend == "asyncio":
+        return aioscan.ScanPool
+    return _ScanPool
+
+
+def AliveScanIter(targets: list):
+    """
+    主机存活扫描，每发现一个存活主机就返回该主机
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :return : 生成存活主机IP的生成器，结果已去重
+    """
+    logger.log("INFOR", "Host alive scan start")
+
+    found = set()
+    for target, data in _backend_pool()(targets, "alive"):
+        for host in data.get('scan'):
+            if host not in found:
+                found.add(host)
+                yield host
 
     logger.log("INFOR", "Host alive scan finish")
-    return list(set(result))    # 去除重复数据
+
+
+def AliveScan(targets: list) -> list:
+    """
+    主机存活扫描入口函数
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :return : alive host result
+    :rtype  : list
+    """
+    return list(AliveScanIter(targets))
 
 
 def _analysis(data: dict) -> dict:
@@ -92,27 +424,198 @@ def _analysis(data: dict) -> dict:
     return result
 
 
-def PortScan(targets: list) -> dict:
+def _service_groups(open_ports: dict) -> dict:
     """
-    端口服务扫描入口函数
+    将开放端口相同的主机分为一组，每组最多TARGETS_FILE_SIZE个主机，
+    单个主机直接作为扫描目标，多个主机写入目标文件，扫描结束后由remove_targets_files删除
 
-    :param list targets :  IP/CIDR/FilePath into list
-    :return : port scan result
+    :param dict open_ports :  {host: 开放端口的set}
+    :return : {target: (端口列表字符串, 组内主机组成的list)}
     :rtype  : dict
     """
-    logger.log("INFOR", "Host service scan start")
-    logger.log("INFOR", "It could take a long time.(Really long!)")
+    same_ports = dict()
+    for host in sorted(open_ports, key=ip_to_int):
+        same_ports.setdefault(tuple(sorted(open_ports[host])), list()).append(host)
+    groups = dict()
+    for port_list, hosts in same_ports.items():
+        ports = ",".join(str(port) for port in port_list)
+        for i in range(0, len(hosts), TARGETS_FILE_SIZE):
+            chunk = hosts[i:i + TARGETS_FILE_SIZE]
+            target = chunk[0] if len(chunk) == 1 else str(write_targets_file(chunk))
+            groups[target] = (ports, chunk)
+    return groups
 
-    result = dict()
-    for target in targets:
-        logger.log("TRACE", f"Target: {target}")
 
+def _label_from_fingerprints(open_ports: dict) -> (dict, dict):
+    """
+    读取开放端口的banner，banner与指纹缓存相同的端口直接使用缓存的版本识别结果；
+    缓存中没有的banner只对其中一个端口进行版本识别并加入缓存，banner相同的其他端口使用该结果
+
+    :param dict open_ports :  {host: 开放端口的set}
+    :return : ({host: 仍需版本识别的端口set}, {host: {port: 由指纹缓存得到的端口信息}})
+    :rtype  : (dict, dict)
+    """
+    cache = fingerprint.shared()
+    labelled = dict()
+    groups = _service_groups(open_ports)
+    keys = dict()  # {(host, port): banner哈希}
+    try:
+        for target, data in aioscan.ScanPool(list(groups), "banner", None,
+                                             {group: itm[0] for group, itm in groups.items()}):
+            for host, ports in _analysis(data).items():
+                for port, info in ports["ports"].items():
+                    key = fingerprint.banner_hash(info.get("banner")) if info.get("state") == "open" else None
+                    if key is not None:
+                        keys[(host, port)] = key
+    finally:
+        remove_targets_files(list(groups))
+
+    unknown = dict()  # {banner哈希: [(host, port)]}
+    for (host, port), key in keys.items():
+        info = cache.get(key)
+        if info is not None:
+            labelled.setdefault(host, dict())[port] = dict(info, state="open", reason="syn-ack")
+        else:
+            unknown.setdefault(key, list()).append((host, port))
+
+    if unknown:
+        # 每种未知的banner只对第一个端口进行版本识别
+        probes = dict()
+        for host, port in (pairs[0] for pairs in unknown.values()):
+            probes.setdefault(host, set()).add(port)
+        probe_groups = _service_groups(probes)
+        probed = dict()  # {banner哈希: 本批次版本识别的结果}
         try:
-            data = _NmapStart(target, "port")
-            _ScanInfo(data)
-            result.update(_analysis(data))
-        except Exception as identifier:
-            logger.log("ERROR", repr(identifier))
+            for group, data in _ScanPool(list(probe_groups), "port", None,
+                                         {group: itm[0] for group, itm in probe_groups.items()}):
+                for host, ports in _analysis(data).items():
+                    for port, info in ports["ports"].items():
+                        key = keys.get((host, port))
+                        if key is not None and info.get("state") == "open":
+                            probed[key] = info
+                            cache.put(key, info)
+        finally:
+            remove_targets_files(list(probe_groups))
+        for key, pairs in unknown.items():
+            info = cache.resolve(key)
+            if info is None:
+                # 版本识别失败或结果不可缓存，只有被识别的端口使用该结果，banner相同的其他端口仍需逐个识别
+                if key in probed:
+                    host, port = pairs[0]
+                    labelled.setdefault(host, dict())[port] = probed[key]
+                continue
+            for host, port in pairs:
+                labelled.setdefault(host, dict())[port] = dict(info, state="open", reason="syn-ack")
+
+    remaining = dict()
+    for host, ports in open_ports.items():
+        ports = ports - set(labelled.get(host, ()))
+        if ports:
+            remaining[host] = ports
+    cache.record(sum(len(ports) for ports in open_ports.values()), sum(len(ports) for ports in labelled.values()))
+    return remaining, labelled
+
+
+def _TwoPhaseScan(targets: list, on_done=None):
+    """
+    两阶段端口扫描：先用arguments_discovery找出每个主机的开放端口，
+    再把开放端口相同的主机分批，只对这些host:port使用arguments_port进行版本识别；
+    开启settings.database.enable_fingerprint时，banner命中指纹缓存的端口不再进行版本识别
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :param on_done      :  目标的所有开放端口完成版本识别后以target为参数调用
+    :return : 生成(target, nmap scan result)的生成器
+    """
+    open_ports = dict()  # {host: 开放端口的set}
+    owners = dict()  # {host: 包含该主机的原始目标}
+    discovered = list()  # 发现阶段成功结束的原始目标
+    for target, data in _backend_pool()(targets, "discovery", discovered.append):
+        for host, ports in _analysis(data).items():
+            found = [port for port, info in ports["ports"].items() if info.get("state") == "open"]
+            if found:
+                open_ports.setdefault(host, set()).update(found)
+                owners.setdefault(host, set()).add(target)
+
+    summary = f"{sum(len(itm) for itm in open_ports.values())} open ports on {len(open_ports)} hosts"
+    labelled = dict()  # {host: {port: 由指纹缓存得到的端口信息}}
+    if settings.database.enable_fingerprint and open_ports:
+        open_ports, labelled = _label_from_fingerprints(open_ports)
+
+    groups = _service_groups(open_ports)
+    pending = {target: 0 for target in discovered}  # 原始目标尚未完成版本识别的分组数量
+    group_owners = dict()
+    for group, (ports, hosts) in groups.items():
+        group_owners[group] = set(owner for host in hosts for owner in owners[host] if owner in pending)
+        for owner in group_owners[group]:
+            pending[owner] += 1
+    logger.log("INFOR", f"Discovery found {summary}, {len(groups)} service scan targets")
+
+    def group_done(group: str) -> None:
+        for owner in group_owners[group]:
+            pending[owner] -= 1
+            if pending[owner] == 0 and on_done is not None:
+                on_done(owner)
+
+    # 所有开放端口都由指纹缓存得到的主机直接返回
+    for host in [host for host in labelled if host not in open_ports]:
+        yield host, {"scan": {host: {"tcp": labelled.pop(host)}}}
+
+    # 没有开放端口或开放端口都由指纹缓存得到的目标在此时即完成
+    if on_done is not None:
+        for target in discovered:
+            if pending[target] == 0:
+                on_done(target)
+
+    try:
+        for group, data in _ScanPool(list(groups), "port", group_done, {group: itm[0] for group, itm in groups.items()}):
+            for host, host_data in data.get("scan", dict()).items():
+                if host in labelled:
+                    host_data.setdefault("tcp", dict()).update(labelled.pop(host))
+            yield group, data
+    finally:
+        remove_targets_files(list(groups))
+
+    # 版本识别失败的主机仍然返回由指纹缓存得到的端口
+    for host, ports in labelled.items():
+        yield host, {"scan": {host: {"tcp": ports}}}
+
+
+def PortScanIter(targets: list, on_done=None):
+    """
+    端口服务扫描，每完成一个目标（流式解析时为每个主机）就返回对应的结果
+
+    开启settings.netscan.enable_two_phase时先发现开放端口，再只对开放端口进行版本识别；
+    发现阶段和不分阶段的扫描使用settings.netscan.backend选择的后端
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :param on_done      :  见_ScanPool
+    :return : 生成port scan result的生成器
+    """
+    logger.log("INFOR", "Host service scan start")
+    logger.log("INFOR", "It could take a long time.(Really long!)")
+
+    if settings.netscan.enable_two_phase:
+        scan = _TwoPhaseScan(targets, on_done)
+    else:
+        scan = _backend_pool()(targets, "port", on_done)
+    for target, data in scan:
+        result = _analysis(data)
+        if result:
+            yield result
 
     logger.log("INFOR", "Host service scan finish")
+
+
+def PortScan(targets: list) -> dict:
+    """
+    端口服务扫描入口函数
+
+    :param list targets :  IP/CIDR/FilePath into list
+    :return : port scan result
+    :rtype  : dict
+    """
+    result = dict()
+    for data in PortScanIter(targets):
+        result.update(data)
+    fingerprint.save()
     return result
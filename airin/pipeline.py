@@ -0,0 +1,315 @@
+import time
+import threading
+from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
+
+import urllib3
+
+from airin import analysis
+from airin import netscan
+from airin import request
+from airin import aiorequest
+from airin.config import settings
+from airin.config.log import logger
+from airin.ratelimit import scheduler
+
+
+"""
+pipeline将存活探测、端口扫描和HTTP标题获取用有界队列串联起来，
+某个主机的端口结果一出来就开始请求它的HTTP服务，而不是等所有端口扫描结束
+"""
+
+_STOP = None  # 队列结束标记
+
+
+class _Stage(object):
+    """
+    记录单个阶段的工作线程数、处理数量和忙碌时间，用于计算利用率
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        with self._lock:
+            self.busy += seconds
+            self.items += items
+
+    def report(self, wall: float) -> None:
+        utilization = self.busy / (self.workers * wall) * 100 if wall > 0 else 0
+        logger.log("ALERT", f"Stage: {self.name: <6} \tworkers: {self.workers} \titems: {self.items} "
+                            f"\tbusy: {self.busy:.2f}s \tutilization: {utilization:.1f}%")
+
+
+class Pipeline(object):
+    """
+    流水线扫描
+
+    alive线程把存活主机放入alive_queue（缓存有效期内扫描过的主机直接使用缓存结果）；port线程从中取出主机凑成批次进行端口扫描，
+    每个主机的结果放入events；主线程负责整合数据、写入数据库，并把HTTP服务放入http_queue；
+    http线程请求后把结果放回events。HostStore和数据库连接只在主线程中使用
+    """
+
+    def __init__(self, store: analysis.HostStore, db, req: bool = True):
+        self.store = store
+        self.db = db
+        self.req = req
+        self.table_name = settings.database.temp_table_name
+        self.batch_size = settings.pipeline.batch_size
+        self.port_workers = max(1, int(settings.netscan.process_count))
+        self.engine = request.get_engine() if req else "thread"
+        # asyncio引擎在一个线程中分批并发请求
+        self.http_workers = request.req_thread_count() if self.engine == "thread" else 1
+        self.parser = None  # 多线程引擎解析标题的进程池
+        self.alive_queue = Queue(maxsize=settings.pipeline.queue_size)
+        self.http_queue = Queue(maxsize=settings.pipeline.queue_size)
+        self.events = Queue()
+        self.session = request.get_session()
+        self.cache_key = netscan.port_scan_key()
+        self.fresh = set()
+        # 中断前已扫描的主机直接使用临时表中的结果
+        self.done = set(ip for task_id, ips in db.get_tasks("port", done=True) for ip in ips)
+        self.scanned = list(self.done)  # 实际进行了端口扫描的主机
+        self.alive = set()  # 存活探测有响应的主机
+        self._port_rows = list()  # 等待批量写入数据库的端口数据
+        self._http_rows = list()  # 等待批量写入数据库的HTTP数据
+        if settings.database.enable_cache:
+            self.fresh = db.get_fresh_hosts(self.cache_key)
+        self.stages = {
+            "alive": _Stage("alive", 1),
+            "port": _Stage("port", self.port_workers),
+            "http": _Stage("http", self.http_workers)
+        }
+
+    def _alive_worker(self, targets: list) -> None:
+        stage = self.stages["alive"]
+        start = time.time()
+        try:
+            for host in netscan.AliveScanIter(targets):
+                stage.record(time.time() - start)
+                self.events.put(("alive", host))
+                if host in self.fresh:
+                    self.events.put(("cached", host))
+                elif host in self.done:
+                    self.events.put(("resumed", host))
+                else:
+                    self.alive_queue.put(host)
+                start = time.time()
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+        finally:
+            for i in range(self.port_workers):
+                self.alive_queue.put(_STOP)
+
+    def _next_batch(self) -> (list, bool):
+        batch = list()
+        host = self.alive_queue.get()
+        while host is not _STOP:
+            batch.append(host)
+            if len(batch) >= self.batch_size or self.alive_queue.empty():
+                return batch, False
+            host = self.alive_queue.get()
+        return batch, True
+
+    def _port_worker(self) -> None:
+        stage = self.stages["port"]
+        stop = False
+        try:
+            while not stop:
+                batch, stop = self._next_batch()
+                if len(batch) == 0:
+                    continue
+                size = analysis.TARGETS_FILE_SIZE
+                for chunk in [batch[i:i + size] for i in range(0, len(batch), size)]:
+                    finished = list()
+                    files = analysis.create_targets_file(chunk)
+                    start = time.time()
+                    try:
+                        for data in netscan.PortScanIter(files, finished.append):
+                            stage.record(time.time() - start, len(data))
+                            self.events.put(("port", data))
+                            start = time.time()
+                    finally:
+                        analysis.remove_targets_files(files)
+                    stage.record(time.time() - start, 0)
+                    # 扫描失败的主机不标记为完成，也不写入缓存
+                    if finished:
+                        self.events.put(("scanned", chunk))
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+        finally:
+            self.events.put(("port_done", None))
+
+    def _http_worker(self) -> None:
+        stage = self.stages["http"]
+        try:
+            target = self.http_queue.get()
+            while target is not _STOP:
+                start = time.time()
+                try:
+                    resp = request.get_resp(target.get("url"), self.session)
+                    title, status_code, truncated = request.get_resp_info(resp, self.parser)
+                except Exception as identifier:
+                    logger.log("ERROR", repr(identifier))
+                    title, status_code, truncated = str(identifier.args), None, False
+                stage.record(time.time() - start)
+                self.events.put(("http", {
+                    "cidr": target.get("cidr"),
+                    "ip": target.get("ip"),
+                    "port": target.get("port"),
+                    "title": title,
+                    "status": status_code,
+                    "truncated": truncated
+                }))
+                target = self.http_queue.get()
+        finally:
+            # 主线程按http_done计数，线程异常退出时也必须发出
+            self.events.put(("http_done", None))
+
+    def _next_http_batch(self) -> (list, bool):
+        """
+        取出队列中已有的HTTP目标，最多settings.request.async_concurrency个，队列为空时等待第一个
+        """
+        batch = list()
+        target = self.http_queue.get()
+        while target is not _STOP:
+            batch.append(target)
+            if len(batch) >= settings.request.async_concurrency or self.http_queue.empty():
+                return batch, False
+            target = self.http_queue.get()
+        return batch, True
+
+    def _async_http_worker(self) -> None:
+        stage = self.stages["http"]
+        stop = False
+        try:
+            while not stop:
+                batch, stop = self._next_http_batch()
+                if len(batch) == 0:
+                    continue
+                start = time.time()
+                results = aiorequest.bulk_request(batch, progress=False)
+                stage.record(time.time() - start, len(results))
+                for result in results:
+                    self.events.put(("http", result))
+        except Exception as identifier:
+            logger.log("ERROR", repr(identifier))
+        finally:
+            self.events.put(("http_done", None))
+
+    def _start(self, target, name: str, args: tuple = ()) -> threading.Thread:
+        thread = threading.Thread(target=target, name=name, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def _on_port(self, data: dict) -> None:
+        self.store, conver_data = analysis.data_integration(self.store, data)
+        self._port_rows += conver_data
+        self._queue_http(conver_data)
+
+    def _queue_http(self, conver_data: list) -> None:
+        if not self.req:
+            return None
+        for cidr, ip, domain, port, state, reason, name, *other, title, status, truncated in conver_data:
+            if state != "open" or title is not None:
+                continue
+            target = request.get_http_target(cidr, ip, port, name)
+            if target:
+                self.http_queue.put(target)
+
+    def _on_cached(self, host: str) -> None:
+        cached_data = self.db.get_cached_results(settings.database.table_name, [host])
+        self.store, _ = analysis.data_integration(self.store, cached_data)
+
+    def _on_resumed(self, host: str) -> None:
+        done_data = self.db.get_cached_results(self.table_name, [host])
+        self.store, conver_data = analysis.data_integration(self.store, done_data)
+        self._queue_http(conver_data)
+
+    def _on_http(self, result: dict) -> None:
+        self.store, conver_data = analysis.http_resp_integration(self.store, [result])
+        self._http_rows += conver_data
+
+    def _flush(self) -> None:
+        """
+        在一个事务中写入缓存的端口和HTTP数据，端口数据必须先于其HTTP数据写入
+        """
+        if self._port_rows:
+            self.db.insert_table(self.table_name, self._port_rows)
+            self._port_rows = list()
+        if self._http_rows:
+            self.db.update_HTTP_info(self.table_name, self._http_rows)
+            self._http_rows = list()
+
+    def run(self, targets: list) -> analysis.HostStore:
+        """
+        运行流水线
+
+        :param list targets :  IP/CIDR into list
+        :return : 整合了扫描结果的HostStore
+        :rtype  : HostStore
+        """
+        logger.log("INFOR", "Pipeline scan start")
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        wall_start = time.time()
+
+        self._start(self._alive_worker, "AliveThread", (targets,))
+        for i in range(self.port_workers):
+            self._start(self._port_worker, f"PortThread-{i}")
+        if self.req:
+            # 与request.run_request使用相同的请求引擎和标题解析方式
+            if self.engine == "asyncio":
+                self._start(self._async_http_worker, "HTTPThread-0")
+            else:
+                if settings.request.parse_process_count:
+                    self.parser = ProcessPoolExecutor(max_workers=settings.request.parse_process_count)
+                for i in range(self.http_workers):
+                    self._start(self._http_worker, f"HTTPThread-{i}")
+
+        port_running = self.port_workers
+        http_running = self.http_workers if self.req else 0
+        while port_running > 0 or http_running > 0:
+            event, data = self.events.get()
+            if event == "alive":
+                self.alive.add(data)
+                self.store.integrate_alive([data])
+            elif event == "port":
+                self._on_port(data)
+            elif event == "cached":
+                self._on_cached(data)
+            elif event == "resumed":
+                self._on_resumed(data)
+            elif event == "scanned":
+                self.scanned += data
+                self._flush()
+                self.db.add_tasks("port", [data], done=True)
+                if settings.database.enable_cache:
+                    self.db.update_cache(self.cache_key, data)
+            elif event == "http":
+                self._on_http(data)
+            elif event == "port_done":
+                port_running -= 1
+                if port_running == 0:
+                    for i in range(http_running):
+                        self.http_queue.put(_STOP)
+            elif event == "http_done":
+                http_running -= 1
+            # 事件队列空闲或缓存数据过多时才写入数据库，避免每个事件提交一次事务
+            if self.events.empty() or len(self._port_rows) + len(self._http_rows) >= settings.pipeline.queue_size:
+                self._flush()
+        self._flush()
+        if self.parser is not None:
+            self.parser.shutdown()
+
+        wall = time.time() - wall_start
+        logger.log("ALERT", f"Pipeline elapsed: {wall:.2f}s")
+        for stage in self.stages.values():
+            stage.report(wall)
+        if scheduler.enabled:
+            scheduler.report()
+        logger.log("INFOR", "Pipeline scan finish")
+        return self.store
@@ -0,0 +1,211 @@
+import time
+import threading
+
+from airin.config import settings
+from airin.config.log import logger
+from airin.iptools import ip_to_int
+
+
+"""
+ratelimit是扫描和HTTP请求共用的速率调度器：一个全局令牌桶加上每个/24网段一个令牌桶，
+每次发起连接前预约发送时间，并根据超时/错误比例按AIMD（加性增、乘性减）自动调整速率
+"""
+
+
+class _Bucket(object):
+    """
+    令牌桶，以GCRA（理论到达时间）实现：预约时返回最早可发送的时间，不需要定时补充令牌
+
+    rate为当前速率，由AIMD在min_rate和max_rate之间调整；每个统计周期结束时，
+    错误比例超过阈值则速率乘以aimd_decrease，并且不高于该周期内成功的速率，使最大速率远高于
+    对方承受能力时也能在一两个周期内降到合适的速率；否则增加max_rate * aimd_increase。
+    与TCP每个RTT最多减速一次相同，减速前发出的连接的结果不再计入，避免延迟到达的超时使速率连续减半
+    """
+    __slots__ = ("rate", "max_rate", "tat", "window_start", "attempts", "oks", "errors", "ratio", "last_rate", "cut")
+
+    def __init__(self, rate: float, now: float):
+        self.rate = float(rate)
+        self.max_rate = float(rate)
+        self.tat = now  # 理论到达时间，下一次连接按速率应在该时间之后
+        self.window_start = now
+        self.attempts = 0
+        self.oks = 0
+        self.errors = 0
+        self.ratio = 0.0  # 上一个统计周期的错误比例
+        self.last_rate = 0.0  # 上一个统计周期实际发起连接的速率
+        self.cut = now  # 上一次减速的时间
+
+    def earliest(self, now: float) -> float:
+        # 允许约10ms的突发
+        return max(now, self.tat - max(0.01, 1 / self.rate))
+
+    def commit(self, start: float) -> None:
+        self.tat = max(self.tat, start) + 1 / self.rate
+        self.attempts += 1
+
+    def count(self, ok: bool, sent: float) -> None:
+        if sent is not None and sent < self.cut:
+            return None
+        if ok:
+            self.oks += 1
+        else:
+            self.errors += 1
+
+    def adjust(self, now: float, limits) -> bool:
+        """
+        统计周期结束时按AIMD调整速率
+
+        :return : 是否结束了一个统计周期
+        :rtype  : bool
+        """
+        elapsed = now - self.window_start
+        if elapsed < limits.aimd_interval:
+            return False
+        samples = self.oks + self.errors
+        self.ratio = self.errors / samples if samples else 0.0
+        self.last_rate = self.attempts / elapsed
+        if samples >= limits.aimd_min_samples and self.ratio > limits.aimd_error_ratio:
+            delivered = self.oks / elapsed
+            self.rate = max(limits.min_rate, min(self.rate * limits.aimd_decrease, delivered))
+            self.cut = now
+        elif samples > 0:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * limits.aimd_increase)
+        self.window_start = now
+        self.attempts = self.oks = self.errors = 0
+        return True
+
+
+class Scheduler(object):
+    """
+    扫描和HTTP请求共用的速率调度器，线程安全
+
+    每次连接前调用reserve（异步代码）或acquire（线程）预约发送时间，
+    连接有结果后调用feedback报告是否超时或出错
+    """
+
+    def __init__(self, limits=settings.ratelimit):
+        self.limits = limits
+        self.enabled = limits.enable
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._global = _Bucket(limits.global_rate, now)
+        self._cidrs = dict()  # {IP整数 >> 8: _Bucket}
+        self._last_report = now
+        self.attempts = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(ip) -> int:
+        if isinstance(ip, int):
+            return ip >> 8
+        try:
+            return ip_to_int(ip) >> 8
+        except ValueError:
+            return None  # IPv6或域名，只受全局限制
+
+    def _cidr(self, key: int, now: float) -> _Bucket:
+        bucket = self._cidrs.get(key)
+        if bucket is None and self.limits.cidr_rate > 0:
+            bucket = self._cidrs[key] = _Bucket(self.limits.cidr_rate, now)
+        return bucket
+
+    def reserve(self, ip) -> float:
+        """
+        预约一次连接
+
+        :param ip :  IPv4地址（str或int）
+        :return : 需要等待的秒数
+        :rtype  : float
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            cidr = self._cidr(self._key(ip), now)
+            start = self._global.earliest(now)
+            if cidr is not None:
+                start = max(start, cidr.earliest(now))
+                cidr.commit(start)
+            self._global.commit(start)
+            self.attempts += 1
+            return start - now
+
+    def acquire(self, ip) -> None:
+        """
+        预约一次连接并等待到可发送的时间，供线程使用
+        """
+        wait = self.reserve(ip)
+        if wait > 0:
+            time.sleep(wait)
+
+    def feedback(self, ip, ok: bool, sent: float = None) -> None:
+        """
+        报告一次连接的结果
+
+        :param ip         :  IPv4地址（str或int）
+        :param bool ok    :  False表示超时、连接被重置等可能由拥塞造成的错误
+        :param float sent :  发起连接的time.monotonic()时间，早于上一次减速的结果不参与速率调整
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            cidr = self._cidrs.get(self._key(ip))
+            for bucket in (self._global, cidr):
+                if bucket is not None:
+                    bucket.count(ok, sent)
+            if not ok:
+                self.errors += 1
+            if cidr is not None:
+                cidr.adjust(now, self.limits)
+            if self._global.adjust(now, self.limits):
+                self._prune(now)
+            if now - self._last_report >= self.limits.report_interval:
+                self._last_report = now
+                self._log()
+
+    def _prune(self, now: float) -> None:
+        """
+        删除长时间未使用且已恢复到最大速率的/24令牌桶
+        """
+        idle = 10 * self.limits.aimd_interval
+        for key in [key for key, bucket in self._cidrs.items()
+                    if bucket.rate >= bucket.max_rate and now - bucket.tat > idle]:
+            del self._cidrs[key]
+
+    def metrics(self) -> dict:
+        """
+        当前速率和错误统计
+
+        :return : {"rate": 上一个统计周期的实际速率, "limit": 当前全局速率上限, "error_ratio": 上一个统计周期的错误比例,
+                   "attempts": 总连接数, "errors": 总错误数, "throttled": 被限速的/24网段数量}
+        :rtype  : dict
+        """
+        with self._lock:
+            return {
+                "rate": self._global.last_rate,
+                "limit": self._global.rate,
+                "error_ratio": self._global.ratio,
+                "attempts": self.attempts,
+                "errors": self.errors,
+                "throttled": self._throttled()
+            }
+
+    def _throttled(self) -> int:
+        return sum(1 for bucket in self._cidrs.values() if bucket.rate < bucket.max_rate)
+
+    def _log(self) -> None:
+        bucket = self._global
+        logger.log("INFOR", f"Rate: {bucket.last_rate:.0f}/s \tlimit: {bucket.rate:.0f}/s "
+                            f"\terrors: {bucket.ratio:.1%} \tthrottled /24: {self._throttled()}")
+
+    def report(self) -> None:
+        """
+        输出当前速率和错误统计
+        """
+        with self._lock:
+            self._log()
+
+
+# 所有扫描和请求共用同一个调度器
+scheduler = Scheduler()
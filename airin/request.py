@@ -1,8 +1,16 @@
+import os
+import re
+import html
 import json
+import time
 import random
+import socket
 import urllib3
-from threading import Thread
+import http.client
+from threading import Lock, Thread, Timer
+from urllib.parse import urlsplit
 from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
 
 import tqdm
 import requests
@@ -10,6 +18,7 @@ from bs4 import BeautifulSoup
 
 from airin.config import settings
 from airin.config.log import logger
+from airin.ratelimit import scheduler
 
 
 # 以下代码来自OneForAll，内容有删改
@@ -24,6 +33,56 @@ def req_thread_count():
     return count
 
 
+TITLE_PATTERNS = [(re.compile(rf'<{tag}\b', re.I), re.compile(rf'<{tag}\b[^>]*>(.*?)</{tag}\s*>', re.I | re.S))
+                  for tag in ('title', 'h1', 'h2', 'h3')]
+META_PATTERN = re.compile(r'<meta\b([^>]*)>', re.I)
+ATTR_PATTERN = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+# html.parser不会解析注释、script和style中的标签，先将其整体去除
+SKIP_PATTERN = re.compile(r'<!--.*?-->|<(script|style)\b[^>]*>.*?</\1\s*>', re.I | re.S)
+# 去除后仍存在时（未闭合或CDATA），正则结果可能与BeautifulSoup不一致，交给BeautifulSoup处理
+AMBIGUOUS_PATTERN = re.compile(r'<!--|<script|<style|<!\[cdata\[', re.I)
+# 标签的属性值中含有<时（如<div title='<title>x</title>'>），正则可能匹配到属性值中的标签，交给BeautifulSoup处理
+ATTR_TAG_PATTERN = re.compile(r'<[a-z][^<>]*?=\s*(?:"[^"]*<|\'[^\']*<|<)', re.I)
+
+
+def _fast_html_title(markup):
+    """
+    用预编译的正则按title、h1、h2、h3、meta description、meta keywords的顺序提取标题
+
+    :param markup: html标签
+    :return: 标题，无法确定时返回None
+    """
+    if ATTR_TAG_PATTERN.search(markup):
+        return None
+    markup = SKIP_PATTERN.sub('', markup)
+    if AMBIGUOUS_PATTERN.search(markup):
+        return None
+    for open_pattern, pattern in TITLE_PATTERNS:
+        result = pattern.search(markup)
+        if result:
+            return html.unescape(TAG_PATTERN.sub('', result.group(1)))
+        if open_pattern.search(markup):
+            return None  # 有开始标签但没有结束标签
+    metas = dict()
+    for result in META_PATTERN.finditer(markup):
+        attrs = dict()
+        for key, *value in ATTR_PATTERN.findall(result.group(1)):
+            attrs.setdefault(key.lower(), ''.join(value))
+        name = attrs.get('name')
+        if name in ('description', 'keywords') and name not in metas:
+            if 'content' not in attrs:
+                return None
+            metas[name] = html.unescape(attrs.get('content'))
+    for name in ('description', 'keywords'):
+        if name in metas:
+            return metas.get(name)
+    # 去掉标签后的文本不会比BeautifulSoup得到的文本更长，超过200字符时结果必然为'None'
+    if len(html.unescape(TAG_PATTERN.sub('', markup))) > 200:
+        return 'None'
+    return None
+
+
 def get_html_title(markup):
     """
     获取标题
@@ -31,6 +90,11 @@ def get_html_title(markup):
     :param markup: html标签
     :return: 标题
     """
+    if settings.request.title_extractor == 'fast':
+        title = _fast_html_title(markup)
+        if title is not None:
+            return title
+
     soup = BeautifulSoup(markup, 'html.parser')
 
     title = soup.title
@@ -49,12 +113,13 @@ def get_html_title(markup):
     if h3:
         return h3.text
 
+    # 没有content属性的meta标签不作为标题
     desc = soup.find('meta', attrs={'name': 'description'})
-    if desc:
+    if desc and desc.get('content') is not None:
         return desc['content']
 
     word = soup.find('meta', attrs={'name': 'keywords'})
-    if word:
+    if word and word.get('content') is not None:
         return word['content']
 
     text = soup.text
@@ -72,27 +137,160 @@ def get_progress_bar(total):
     return bar
 
 
-def get_resp(url, session):
+class BodyReader(object):
+    """
+    按字节预算读取响应内容
+
+    读到</title>、超出settings.request.max_body_size字节或超过settings.request.max_read_second秒时停止，
+    后两种情况视为截断(truncated)
+    """
+
+    def __init__(self):
+        self.limit = settings.request.max_body_size
+        self.deadline = time.time() + settings.request.max_read_second
+        self.content = bytearray()
+        self.truncated = False
+
+    def feed(self, chunk):
+        """
+        :param bytes chunk: 新读取的数据
+        :return bool: 是否应停止读取
+        """
+        start = max(0, len(self.content) - 8)
+        self.content += chunk
+        if b'</title' in self.content[start:].lower():
+            return True
+        if len(self.content) >= self.limit:
+            del self.content[self.limit:]
+            self.truncated = True
+            return True
+        if time.time() > self.deadline:
+            self.truncated = True
+            return True
+        return False
+
+
+def get_timeout():
+    """
+    请求的(连接超时, 读取超时)，读取超时不超过settings.request.max_read_second，
+    服务器停止发送数据时，单次读取最多等待到该时间
+    """
     timeout = settings.request.timeout_second
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    if read is None or read > settings.request.max_read_second:
+        read = settings.request.max_read_second
+    return connect, read
+
+
+def _iter_raw(resp, deadline):
+    """
+    逐块返回已解压的响应内容，慢速响应也能按时限停止
+
+    urllib3 2.x的read1只返回已到达的数据，每块数据后都会检查时限；
+    urllib3 1.x没有read1，stream(amt)会一直等到读满amt字节，由定时器在时限到达时关闭socket的读写，
+    阻塞中的读取随即返回已读到的数据
+    """
+    raw = resp.raw
+    if hasattr(raw, 'read1'):
+        while True:
+            chunk = raw.read1(8192, decode_content=True)
+            if not chunk:
+                break
+            yield chunk
+        return None
+    lock = Lock()
+    reading = [True]
+
+    def abort():
+        with lock:
+            if not reading[0]:
+                return None
+            try:
+                # fileno()返回的文件描述符属于响应，复制一份后关闭读写，不影响响应自身的关闭
+                with socket.socket(fileno=os.dup(raw.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, ValueError):
+                pass
+
+    timer = Timer(max(0.0, deadline - time.time()), abort)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield from raw.stream(8192, decode_content=True)
+    finally:
+        with lock:
+            reading[0] = False
+        timer.cancel()
+
+
+def read_content(resp):
+    """
+    流式读取requests响应，读取结束后关闭连接
+
+    :param resp: 以stream=True发起请求得到的响应
+    :return: (content, truncated)
+    """
+    reader = BodyReader()
+    try:
+        for chunk in _iter_raw(resp, reader.deadline):
+            if reader.feed(chunk):
+                break
+    except (requests.RequestException, urllib3.exceptions.HTTPError,
+            http.client.HTTPException, OSError) as e:
+        # urllib3和http.client的读取错误不会被包装为requests异常，已读取的部分仍可用于提取标题
+        logger.log('DEBUG', repr(e))
+        reader.truncated = True
+    finally:
+        resp.close()
+    return bytes(reader.content), reader.truncated
+
+
+def is_congested(error):
+    """
+    请求错误是否可能由拥塞造成（超时、连接被拒绝或重置），SSL等错误不计入
+    """
+    if isinstance(error, requests.exceptions.SSLError):
+        return False
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def get_resp(url, session):
+    timeout = get_timeout()
     redirect = settings.request.allow_redirect
     proxy = None
     if settings.request.enable_proxy:
-        proxy = random.choice(settings.proxy_pool)
+        proxy = random.choice(settings.request.proxy_pool)
+    host = urlsplit(url).hostname
+    scheduler.acquire(host)
+    sent = time.monotonic()
     try:
-        resp = session.get(url, timeout=timeout,
+        resp = session.get(url, timeout=timeout, stream=True,
                            allow_redirects=redirect, proxies=proxy)
+        resp._content, resp.truncated = read_content(resp)
+        scheduler.feedback(host, True, sent)
     except Exception as e:
         logger.log('DEBUG', e.args)
+        scheduler.feedback(host, not is_congested(e), sent)
         resp = e
     return resp
 
 
-def request(urls_queue, resp_queue, session):
+def request(urls_queue, resp_queue, session, parser=None):
     while not urls_queue.empty():
         index, url, cidr, ip, port = urls_queue.get()
-        resp = get_resp(url, session)
-        resp_queue.put((index, resp, cidr, ip, port))
-        urls_queue.task_done()
+        try:
+            try:
+                resp = get_resp(url, session)
+                # 在请求线程中解析，队列中只保存结果，响应对象随即释放
+                title, status_code, truncated = get_resp_info(resp, parser)
+                del resp
+            except Exception as e:
+                logger.log('ERROR', repr(e))
+                title, status_code, truncated = str(e.args), None, False
+            resp_queue.put((index, title, status_code, truncated, cidr, ip, port))
+        finally:
+            # 无论成功与否都要标记完成，否则urls_queue.join()会一直等待
+            urls_queue.task_done()
 
 
 def progress(bar, total, urls_queue):
@@ -103,6 +301,7 @@ def progress(bar, total, urls_queue):
         bar.update()
         if remaining == 0:
             break
+        time.sleep(0.1)  # 避免空转抢占解析线程的GIL
 
 
 def get_session():
@@ -118,7 +317,10 @@ def get_session():
 
 
 def decode_resp_text(resp):
-    content = resp.content
+    return decode_content(resp.content)
+
+
+def decode_content(content):
     if not content:
         return str('')
     try:
@@ -134,24 +336,69 @@ def decode_resp_text(resp):
     return content
 
 
+def parse_content(content):
+    """
+    解码响应内容并提取标题，可在子进程中运行
+
+    :param bytes content: 响应内容
+    :return: 标题
+    """
+    return get_html_title(decode_content(content))
+
+
+def get_resp_info(resp, parser=None):
+    """
+    从响应中提取标题和状态码，请求出错时标题为异常信息
+
+    :param resp: requests响应或异常
+    :param parser: 用于解析的进程池，为None时在当前线程解析
+    :return: (title, status_code, truncated)
+    """
+    if isinstance(resp, Exception):
+        return str(resp.args), None, False
+    try:
+        if parser is None:
+            title = parse_content(resp.content)
+        else:
+            title = parser.submit(parse_content, resp.content).result()
+    except Exception as e:
+        # 解析失败不影响状态码
+        logger.log('DEBUG', repr(e))
+        title = str(e.args)
+    return title, resp.status_code, getattr(resp, 'truncated', False)
+
+
+def get_http_target(cidr, ip, port, name):
+    """
+    根据nmap识别的服务名生成请求目标，非HTTP服务返回None
+
+    :param str cidr: CIDR
+    :param str ip: IP
+    :param int port: 端口
+    :param str name: nmap识别的服务名
+    :return dict: {"url", "cidr", "ip", "port"}
+    """
+    if not name or "http" not in name:
+        return None
+    if "https" in name or port == 443:
+        url = f"https://{ip}:{port}"
+    else:
+        url = f"http://{ip}:{port}"
+    return {"url": url, "cidr": cidr, "ip": ip, "port": port}
+
+
 def get_html_info(resp_queue):
     results = list()
     while not resp_queue.empty():
-        index, resp, cidr, ip, port = resp_queue.get()
-
-        if isinstance(resp, Exception):
-            title = str(resp.args)
-            status_code = None
-        else:
-            title = get_html_title(decode_resp_text(resp))
-            status_code = resp.status_code
+        index, title, status_code, truncated, cidr, ip, port = resp_queue.get()
 
         results.append({
             "cidr": cidr,
             "ip": ip,
             "port": port,
             "title": title,
-            "status": status_code
+            "status": status_code,
+            "truncated": truncated
         })
     return results
 
@@ -178,15 +425,35 @@ def bulk_request(targets: list):
                              args=(bar, task_count, urls_queue), daemon=True)
     progress_thread.start()
 
+    parser = None
+    if settings.request.parse_process_count:
+        parser = ProcessPoolExecutor(max_workers=settings.request.parse_process_count)
+
     for i in range(thread_count):
         request_thread = Thread(target=request, name=f'RequestThread-{i}',
-                                args=(urls_queue, resp_queue, session), daemon=True)
+                                args=(urls_queue, resp_queue, session, parser), daemon=True)
         request_thread.start()
 
     urls_queue.join()
+    if parser is not None:
+        parser.shutdown()
     return resp_queue
 
 
+def get_engine():
+    """
+    返回实际使用的请求引擎，标准库实现的asyncio引擎不支持代理，开启代理时改用多线程引擎
+
+    :return str: "thread"或"asyncio"
+    """
+    from airin import aiorequest  # aiorequest依赖本模块，在此处导入
+    engine = settings.request.engine
+    if engine == 'asyncio' and settings.request.enable_proxy and aiorequest.aiohttp is None:
+        logger.log('ALERT', 'The stdlib asyncio engine does not support proxy, use thread engine')
+        engine = 'thread'
+    return engine
+
+
 def run_request(targets: list):
     """
     HTTP request entrance
@@ -198,7 +465,17 @@ def run_request(targets: list):
     """
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     logger.log('INFOR', f'Start requesting HTTP service')
-    resp_queue = bulk_request(targets)
-    results = get_html_info(resp_queue)
+    start = time.time()
+    from airin import aiorequest  # aiorequest依赖本模块，在此处导入
+    if get_engine() == 'asyncio':
+        results = aiorequest.bulk_request(targets)
+    else:
+        resp_queue = bulk_request(targets)
+        results = get_html_info(resp_queue)
+    elapsed = time.time() - start
+    if elapsed > 0:
+        logger.log('INFOR', f'Requested {len(results)} pages in {elapsed:.2f}s ({len(results) / elapsed:.1f} pages/sec)')
+    if scheduler.enabled:
+        scheduler.report()
     logger.log('INFOR', f'Finish requesting HTTP service')
     return results
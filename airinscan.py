@@ -5,10 +5,13 @@ import fire
 from datetime import datetime
 
 from airin import analysis
+from airin import iptools
 from airin import netscan
 from airin import Database
 from airin import request
 from airin import export
+from airin import fingerprint
+from airin.pipeline import Pipeline
 from airin.config import settings
 from airin.config.log import logger
 
@@ -37,27 +40,34 @@ class AirinScan(object):
         python3 airinscan.py 192.168.0.1 - run
         python3 airinscan.py 192.168.0.0/24 - run
         python3 airinscan.py 172.16.1.2 192.168.0.0/24 - run
+        python3 airinscan.py 192.168.0.1-100 - run
         python3 airinscan.py 192.168.0.1 ./list.txt - run
         python3 airinscan.py ./result.csv --filtr False - run
         python3 airinscan.py ./result.json --req False - run
         python3 airinscan.py ./result.csv --fmt json - run
         python3 airinscan.py ./result.json --path False - run
         python3 airinscan.py ./result.txt --cutmask False - run
+        python3 airinscan.py ./result.csv --pipeline True - run
+        python3 airinscan.py ./result.csv --diff True - run
+        python3 airinscan.py --resume 3 - run
 
     Note:
         " - run" is a fixed format
-        --fmt   csv/json (result format)
+        --fmt   csv/json/ndjson, add .gz to compress, e.g. csv.gz; parquet/arrow need pyarrow (result format)
         --path  Result path (default None, automatically generated)
 
-    :param tuple    targets  :   One or more IP/CIDR or File path of .txt/.csv/.json
+    :param tuple    targets  :   One or more IP/CIDR/IP range or File path of .txt/.csv/.json/.ndjson (may be .gz)
     :param bool     filtr    :   Filter scan target (default True)
     :param bool     req      :   HTTP requests page title (defalut True)
     :param str      fmt      :   Result format (default csv)
     :param str      path     :   Result path (default None, automatically generated)
-    :param bool     cutmask  :   CIDR where the segmentation mask is greater than the set value (default True)
+    :param bool     cutmask  :   Split CIDRs shorter than min_mask by known IP density into balanced scan units (default True)
+    :param bool     pipeline :   Request HTTP services while port scanning is still running (default False)
+    :param bool     diff     :   Only export changes since the previous scan in the database (default False)
+    :param int      resume   :   Resume an interrupted job by its ID (default None)
     """
 
-    def __init__(self, *targets: tuple, filtr: bool = None, req: bool = None, fmt: str = None, path: str = None, cutmask: bool = None, analysis_only: bool = None):
+    def __init__(self, *targets: tuple, filtr: bool = None, req: bool = None, fmt: str = None, path: str = None, cutmask: bool = None, analysis_only: bool = None, pipeline: bool = None, diff: bool = None, resume: int = None):
         self.targets = targets
         self.filtr = filtr
         self.req = req
@@ -65,14 +75,24 @@ class AirinScan(object):
         self.path = path
         self.cutmask = cutmask
         self.analysis_only = analysis_only
-        self.datas = list()
-        self._dict_list = list()
-        self._str_list = list()
+        self.pipeline = pipeline
+        self.diff = diff
+        self.resume = resume
+        self._dict_reducer = analysis.DataReducer()
+        self._str_reducer = analysis.DataReducer()
         self.reduce_datas = dict()
         self._scan_targets = list()
         self._alive_list = list()
         self._port_dict = dict()
         self.http_service_list = list()
+        self.diff_datas = list()
+
+    @property
+    def datas(self):
+        """
+        Result rows converted from reduce_datas, a generator once reduce_datas is a HostStore
+        """
+        return analysis.data_conversion(self.reduce_datas)
 
     def config_param(self):
         """
@@ -90,6 +110,10 @@ class AirinScan(object):
             self.cutmask = bool(settings.analysis.enable_cut_cidr)
         if self.analysis_only is None:
             self.analysis_only = False
+        if self.pipeline is None:
+            self.pipeline = False
+        if self.diff is None:
+            self.diff = False
 
     def check_param(self):
         """
@@ -105,26 +129,136 @@ class AirinScan(object):
         """
         logger.log("DEBUG", f"Targets arguments: {self.targets}")
         for target in self.targets:
-            if target.endswith(".csv"):
-                self._dict_list += analysis.load_csv(target)
-            elif target.endswith(".json"):
-                self._dict_list += analysis.load_json(target)
-            elif target.endswith(".txt"):
-                self._str_list += analysis.load_txt(target)
+            kind = analysis.file_kind(target)
+            if kind is not None:
+                # 分块读取文件，每块筛选后直接整理，不保留原始数据
+                reducer = self._str_reducer if kind == "txt" else self._dict_reducer
+                for chunk in analysis.iter_file(target):
+                    reducer.feed(chunk)
             elif analysis.check_ip_fmt(target):
-                self._str_list.append(target)
+                self._str_reducer.feed([target])
             else:
                 logger.log("ALERT", f"Bad arguments: {target}")
-        self._str_list = list(set(self._str_list))
+
+    def load_cache(self, db: Database) -> list:
+        """
+        Merge the cached results of recently scanned alive hosts, return the hosts to be scanned
+        """
+        if not settings.database.enable_cache:
+            return self._alive_list
+        fresh = db.get_fresh_hosts(netscan.port_scan_key())
+        cached_list = [ip for ip in self._alive_list if ip in fresh]
+        if len(cached_list) > 0:
+            logger.log("ALERT", f"Use cached results of {len(cached_list)} hosts")
+            cached_data = db.get_cached_results(settings.database.table_name, cached_list)
+            self.reduce_datas, _ = analysis.data_integration(self.reduce_datas, cached_data)
+        return [ip for ip in self._alive_list if ip not in fresh]
+
+    def job_args(self) -> dict:
+        """
+        Parameters saved with the job for --resume
+        """
+        return {"targets": list(self.targets), "filtr": self.filtr, "req": self.req, "fmt": self.fmt,
+                "path": self.path, "cutmask": self.cutmask, "pipeline": self.pipeline, "diff": self.diff}
+
+    def load_job(self):
+        """
+        Restore the parameters of the job to be resumed
+        """
+        if self.resume is None:
+            return None
+        db = Database()
+        args = db.resume_job(self.resume)
+        db.close()
+        if args is None:
+            logger.log("FATAL", f"Job {self.resume} does not exist or has been merged")
+            exit(1)
+        for key, value in args.items():
+            setattr(self, key, value)
+
+    def alive_scan(self, db: Database) -> list:
+        """
+        Alive scan, the result is saved with the job and will not be scanned again when resuming
+        """
+        tasks = db.get_tasks("alive", done=True)
+        if tasks:
+            return tasks[-1][1]
+        alive_list = netscan.AliveScan(self._scan_targets)
+        alive_list.sort()
+        db.add_tasks("alive", [alive_list], done=True)
+        return alive_list
+
+    def port_scan(self, db: Database, scan_list: list) -> list:
+        """
+        Port scan by chunks, a chunk is marked as done after all its results are saved
+
+        :return : The hosts of the finished chunks, chunks whose nmap scan failed are left out
+        """
+        temp_table_name = settings.database.temp_table_name
+        tasks = db.get_tasks("port")
+        if tasks:
+            done_list = [ip for task_id, ips in db.get_tasks("port", done=True) for ip in ips]
+            if len(done_list) > 0:
+                logger.log("ALERT", f"Skip {len(done_list)} hosts scanned before the interruption")
+                done_data = db.get_cached_results(temp_table_name, done_list)
+                self.reduce_datas, _ = analysis.data_integration(self.reduce_datas, done_data)
+        else:
+            scan_list.sort()
+            size = analysis.TARGETS_FILE_SIZE
+            tasks = db.add_tasks("port", [scan_list[i:i + size] for i in range(0, len(scan_list), size)])
+
+        pending = dict()
+        for task_id, ips in db.get_tasks("port", done=False):
+            for target in analysis.create_targets_file(ips):
+                pending[str(target)] = task_id
+        try:
+            for self._port_dict in netscan.PortScanIter(list(pending), lambda target: db.finish_task(pending[target])):
+                self.reduce_datas, conver_data = analysis.data_integration(self.reduce_datas, self._port_dict)
+                logger.log("INFOR", "Save the data to the database")
+                db.insert_table(temp_table_name, conver_data)
+        finally:
+            analysis.remove_targets_files(list(pending))
+        # 只返回扫描成功的任务块，失败的主机不写入缓存，下次仍会扫描
+        return [ip for task_id, ips in db.get_tasks("port", done=True) for ip in ips]
+
+    def down_hosts(self, targets: list, alive: list) -> list:
+        """
+        Known hosts in the scan targets that did not respond to the alive scan
+
+        :param list targets :  CIDRs of the input data that were scanned
+        :param list alive   :  Alive hosts
+        """
+        alive = set(alive)
+        return [ip for cidr in targets if cidr in self.reduce_datas
+                for ip in self.reduce_datas[cidr] if ip not in alive]
+
+    def http_request(self, db: Database):
+        """
+        Request HTTP services by chunks, a chunk is marked as done after its results are saved
+        """
+        temp_table_name = settings.database.temp_table_name
+        if not db.get_tasks("http"):
+            self.http_service_list = db.get_http_service(temp_table_name)
+            size = settings.database.task_http_size
+            db.add_tasks("http", [self.http_service_list[i:i + size]
+                                  for i in range(0, len(self.http_service_list), size)])
+        tasks = db.get_tasks("http", done=False)
+        logger.log("INFOR", f"Total number of request targets: {sum(len(targets) for task_id, targets in tasks)}")
+        for task_id, targets in tasks:
+            resp_results = request.run_request(targets)
+            self.reduce_datas, conver_data = analysis.http_resp_integration(self.reduce_datas, resp_results)
+            db.update_HTTP_info(temp_table_name, conver_data)
+            db.finish_task(task_id)
 
     def main(self):
         """
         Main function
         """
-        if len(self._str_list) > 0:
-            self.reduce_datas.update(analysis.data_reduction(self._str_list))
-        if len(self._dict_list) > 0:
-            self.reduce_datas.update(analysis.data_reduction(self._dict_list))
+        if len(self._str_reducer) > 0:
+            self.reduce_datas.update(self._str_reducer.result())
+        if len(self._dict_reducer) > 0:
+            self.reduce_datas.update(self._dict_reducer.result())
+        self.reduce_datas = analysis.HostStore(self.reduce_datas)
 
         if self.analysis_only is False:
             logger.log("INFOR", "Create scan targets")
@@ -133,47 +267,66 @@ class AirinScan(object):
                 self._scan_targets = analysis.filtr_cidr_targets(self.reduce_datas)
             else:
                 self._scan_targets = [i for i in self.reduce_datas]
-            self._scan_targets.sort()
+            cidr_targets = self._scan_targets
 
             if self.cutmask:
-                self._scan_targets = analysis.cut_mask(self._scan_targets, self.reduce_datas)
+                # 按已知IP的密度分割大网段，并打包成大小均衡的扫描单元
+                self._scan_targets = analysis.plan_targets(self._scan_targets, self.reduce_datas)
+            else:
+                # 去除重复和被其他CIDR包含的目标，并按地址排序
+                self._scan_targets = iptools.coalesce(self._scan_targets)
             logger.log("DEBUG", f"Targets: {self._scan_targets}")
 
-            self._alive_list = netscan.AliveScan(self._scan_targets)
-            self._alive_list.sort()
-
-            if len(self._alive_list) > 0:
-                self.reduce_datas, _ = analysis.data_integration(self.reduce_datas, self._alive_list)
-                targets_files = analysis.create_targets_file(self._alive_list)
-                len_targets_files = len(targets_files)
-
+            try:
                 db = Database()
-                db.clean()
-
+                if self.resume is None:
+                    db.start_job(self.job_args())
                 temp_table_name = settings.database.temp_table_name
-                for target in targets_files:
-                    logger.log("INFOR", f"The last {len_targets_files} files")
-                    len_targets_files -= 1
-                    self._port_dict = netscan.PortScan([str(target)])
-                    self.reduce_datas, conver_data = analysis.data_integration(self.reduce_datas, self._port_dict)
-                    logger.log("INFOR", "Save the data to the database")
-                    db.insert_table(temp_table_name, conver_data)
-
-                if self.req:
-                    self.http_service_list = db.get_http_service(temp_table_name)
-                    logger.log("INFOR", f"Total number of request targets: {len(self.http_service_list)}")
-                    resp_results = request.run_request(self.http_service_list)
-                    self.reduce_datas, conver_data = analysis.http_resp_integration(self.reduce_datas, resp_results)
-                    db.update_HTTP_info(temp_table_name, conver_data)
-
-                db.merging_table(temp_table_name, settings.database.table_name)
+                if settings.netscan.enable_two_phase and settings.database.enable_fingerprint:
+                    # 所有扫描批次共用一个指纹缓存，结束时写回一次
+                    fingerprint.load(db)
+
+                if self.pipeline:
+                    pipeline = Pipeline(self.reduce_datas, db, self.req)
+                    self.reduce_datas = pipeline.run(self._scan_targets)
+                    if self.diff:
+                        self.diff_datas = db.diff_table(temp_table_name, settings.database.table_name, pipeline.scanned,
+                                                        self.down_hosts(cidr_targets, pipeline.alive))
+                    db.merging_table(temp_table_name, settings.database.table_name)
+                else:
+                    self._alive_list = self.alive_scan(db)
+
+                    if len(self._alive_list) > 0:
+                        self.reduce_datas, _ = analysis.data_integration(self.reduce_datas, self._alive_list)
+
+                        scan_list = self.port_scan(db, self.load_cache(db))
+                        if settings.database.enable_cache:
+                            db.update_cache(netscan.port_scan_key(), scan_list)
+
+                        if self.req:
+                            self.http_request(db)
+
+                        if self.diff:
+                            self.diff_datas = db.diff_table(temp_table_name, settings.database.table_name, scan_list,
+                                                            self.down_hosts(cidr_targets, self._alive_list))
+
+                        db.merging_table(temp_table_name, settings.database.table_name)
+                    else:
+                        logger.log("ALERT", "No alive host")
+                        if self.diff:
+                            # 所有已知主机都不再存活
+                            self.diff_datas = db.diff_table(temp_table_name, settings.database.table_name, list(),
+                                                            self.down_hosts(cidr_targets, list()))
+                fingerprint.save(db)
                 db.close()
-            else:
-                logger.log("ALERT", "No alive host")
+            finally:
+                # plan_targets写入的目标文件
+                analysis.remove_targets_files(self._scan_targets)
 
-        self.datas = analysis.data_conversion(self.reduce_datas)
-        logger.log("TRACE", self.datas)
-        export.entrance(self.datas, self.path, self.fmt)
+        if self.diff:
+            export.diff_entrance(self.diff_datas, self.path, self.fmt)
+        else:
+            export.entrance(self.reduce_datas, self.path, self.fmt)
 
     def run(self):
         """
@@ -185,6 +338,7 @@ class AirinScan(object):
         logger.log('INFOR', 'Start running AirinScan')
 
         self.config_param()
+        self.load_job()
         self.check_param()
         self.load_data()
         self.main()
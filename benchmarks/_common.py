@@ -0,0 +1,69 @@
+# coding=utf-8
+
+"""
+基准测试的公共函数：把仓库根目录加入sys.path、计时、读取峰值内存、输出结果表格
+
+每个基准测试都是独立脚本，在仓库根目录下运行，如 python3 benchmarks/bench_title.py
+结果、临时文件和数据库目录指向退出时删除的临时目录，日志只输出到终端，基准不会在results/中留下文件
+"""
+
+import sys
+import time
+import atexit
+import shutil
+import pathlib
+import resource
+import tempfile
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from airin.config import settings  # noqa: E402
+from airin.config.log import logger, stdout_fmt  # noqa: E402
+
+WORK_DIR = pathlib.Path(tempfile.mkdtemp(prefix="airin-bench-"))
+atexit.register(shutil.rmtree, WORK_DIR, True)
+settings.result_save_dir = WORK_DIR
+settings.temp_save_dir = WORK_DIR
+settings.database.db_path = WORK_DIR.joinpath("airin.sqlite3")
+logger.remove()
+logger.add(sys.stderr, level="INFOR", format=stdout_fmt)
+
+
+def timed(func, *args, **kwargs) -> (float, object):
+    """
+    运行一次func
+
+    :return : (耗时秒数, 返回值)
+    :rtype  : (float, object)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def peak_rss() -> int:
+    """
+    当前进程的峰值常驻内存，单位字节
+
+    Linux下读取/proc/self/status的VmHWM，ru_maxrss在exec后会保留父进程的峰值，不适合子进程中测量
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def table(header: list, rows: list) -> None:
+    """
+    按列对齐输出结果
+    """
+    rows = [[str(itm) for itm in row] for row in [header] + rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print("  ".join(itm.rjust(width) for itm, width in zip(row, widths)))
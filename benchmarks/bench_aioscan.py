@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+asyncio扫描后端的基准：在127.0.0.1~127.0.0.N的--ports个端口上对比aioscan.ScanPool与线程池阻塞connect的TCP connect扫描
+
+  threads   ThreadPoolExecutor中每个线程阻塞地connect一个端口
+  aioscan   aioscan.ScanPool的"port"扫描，并发数为settings.netscan.async_concurrency
+
+python3 benchmarks/bench_aioscan.py [--hosts 16] [--ports 2000] [--open 20] [--threads 256] [--first-port 50000]
+每个主机上监听--open个端口，其余为从--first-port开始的端口，没有其他进程监听时为closed；速率调度和banner读取在基准中关闭，两种方法的open端口数应相同
+"""
+
+import socket
+import argparse
+import resource
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import table, timed
+
+from airin import aioscan
+from airin.config import settings
+from airin.ratelimit import scheduler
+
+
+def listen(hosts: list, count: int) -> list:
+    """
+    在每个主机上监听count个端口，返回监听的socket
+    """
+    sockets = list()
+    for host in hosts:
+        for i in range(count):
+            sock = socket.socket()
+            sock.bind((host, 0))
+            sock.listen(64)
+            sockets.append(sock)
+    return sockets
+
+
+def probe(address: tuple) -> bool:
+    with socket.socket() as sock:
+        sock.settimeout(settings.netscan.connect_timeout)
+        return sock.connect_ex(address) == 0
+
+
+def thread_scan(hosts: list, ports: dict, threads: int) -> int:
+    addresses = [(host, port) for host in hosts for port in aioscan._parse_ports(ports[host])]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return sum(executor.map(probe, addresses, chunksize=64))
+
+
+def async_scan(hosts: list, ports: dict) -> int:
+    count = 0
+    for target, data in aioscan.ScanPool(hosts, "port", None, ports):
+        for info in data["scan"].values():
+            count += sum(1 for port in info.get("tcp", dict()).values() if port["state"] == "open")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=16)
+    parser.add_argument("--ports", type=int, default=2000)
+    parser.add_argument("--open", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=256)
+    parser.add_argument("--first-port", type=int, default=50000)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    scheduler.enabled = False
+    settings.netscan.enable_banner = False
+
+    hosts = [f"127.0.0.{i}" for i in range(1, args.hosts + 1)]
+    sockets = listen(hosts, args.open)
+    ports = dict()
+    for host in hosts:
+        opened = [sock.getsockname()[1] for sock in sockets if sock.getsockname()[0] == host]
+        closed = [port for port in range(args.first_port, args.first_port + args.ports - args.open) if port not in opened]
+        ports[host] = ",".join(str(port) for port in opened + closed)
+    attempts = sum(len(aioscan._parse_ports(itm)) for itm in ports.values())
+
+    rows = list()
+    for name, func, concurrency in (("threads", lambda: thread_scan(hosts, ports, args.threads), args.threads),
+                                    ("aioscan", lambda: async_scan(hosts, ports), aioscan._concurrency())):
+        elapsed, found = timed(func)
+        rows.append([name, concurrency, attempts, found, f"{elapsed:.2f}s", f"{attempts / elapsed:.0f}"])
+    for sock in sockets:
+        sock.close()
+    print(f"{args.hosts} hosts x {args.ports} ports, {args.open} open per host")
+    table(["method", "concurrency", "attempts", "open", "time", "attempts/sec"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+CDN过滤的基准：对比合并区间上二分查找的_filtr_cdn与原来逐个CDN网段遍历整个列表并list.remove的实现
+
+python3 benchmarks/bench_cdn.py [--rows 1000000] [--cdn-ratio 0.1] [--sample 1000]
+使用内置的cdn_ip_cidr.json，输入为OneForAll形式的dict行（ip字段可含多个逗号分隔的IP）和IP字符串行；
+原实现只处理dict行（str分支的判断条件写错，从不过滤），只对前sample行计时并按比例估算（结果标记为est.），
+估算值偏小，因为list.remove本身与行数成正比
+"""
+
+import random
+import argparse
+
+from _common import table, timed
+
+from airin import analysis
+from airin.config import settings
+from airin.iptools import int_to_ip
+
+try:
+    from IPy import IP
+except ImportError:
+    from ipaddress import ip_network as IP
+
+
+def remove_loop(data: list) -> list:
+    """
+    原来的_filtr_cdn（dict分支）：每个CDN网段都从后向前遍历整个列表，命中的行用list.remove删除
+    """
+    for cdn_cidr in settings.analysis.cdn_ip_cidr:
+        data_len = len(data) - 1
+        cdn_ip_list = IP(cdn_cidr)
+        while data_len >= 0:
+            for ip in data[data_len].get(settings.analysis.ip_field).split(","):
+                if ip in cdn_ip_list:
+                    data.remove(data[data_len])
+                    break
+            data_len -= 1
+    return data
+
+
+def synthetic(rows: int, cdn_ratio: float, seed: int) -> list:
+    """
+    生成IP字符串，约cdn_ratio比例的IP位于CDN网段内
+    """
+    rand = random.Random(seed)
+    starts, ends = settings.analysis.cdn_ip_ranges
+    ips = list()
+    for i in range(rows):
+        if rand.random() < cdn_ratio:
+            index = rand.randrange(len(starts))
+            ips.append(int_to_ip(rand.randint(starts[index], ends[index])))
+        else:
+            ips.append(int_to_ip(rand.randrange(1 << 24, 224 << 24)))
+    return ips
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--cdn-ratio", type=float, default=0.1)
+    parser.add_argument("--sample", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    ips = synthetic(args.rows, args.cdn_ratio, args.seed)
+    field = settings.analysis.ip_field
+    dict_rows = [{field: ip if i % 4 else f"{ip},{ips[i - 1]}", "subdomain": f"host{i}.example.com"}
+                 for i, ip in enumerate(ips)]
+
+    rows = list()
+    for name, data in (("dict", dict_rows), ("str", ips)):
+        elapsed, kept = timed(analysis._filtr_cdn, list(data))
+        if name == "dict":
+            sample = data[:args.sample]
+            loop_elapsed, loop_kept = timed(remove_loop, list(sample))
+            assert loop_kept == analysis._filtr_cdn(list(sample))
+            baseline = f"{loop_elapsed * len(data) / len(sample):.1f}s est."
+            speedup = f"{loop_elapsed * len(data) / len(sample) / elapsed:.0f}x"
+        else:
+            baseline = speedup = "-"
+        rows.append([name, len(data), len(data) - len(kept), baseline, f"{elapsed:.2f}s", speedup])
+    print(f"{len(settings.analysis.cdn_ip_cidr)} CDN CIDRs merged into {len(settings.analysis.cdn_ip_ranges[0])} ranges")
+    table(["rows", "count", "removed", "remove loop", "_filtr_cdn", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+IP分配到CIDR的基准：对比CidrIndex最长前缀匹配(analysis._distribution)与原来逐个CIDR构造IP对象判断的嵌套循环
+
+python3 benchmarks/bench_distribution.py [--sizes 10000,100000,1000000] [--cidrs 500] [--sample 2000]
+嵌套循环的耗时与IP数量成正比，超过--sample个IP时只对前sample个IP计时并按比例估算（结果标记为est.），
+估算值偏小，因为嵌套循环中不属于任何CIDR的IP会不断加入新的/24
+"""
+
+import random
+import argparse
+
+from _common import table, timed
+
+from airin import analysis
+from airin.iptools import int_to_ip
+
+try:
+    from IPy import IP
+except ImportError:
+    from ipaddress import ip_network as IP
+
+
+def nested_loop(ip_dict: dict, cidr_dict: dict) -> dict:
+    """
+    原来的_distribution：每个IP依次与每个CIDR比较，每次比较都重新构造IP对象
+    """
+    results = cidr_dict
+    for ip in ip_dict:
+        no_cidr = True
+        for cidr in cidr_dict:
+            if ip in IP(cidr):
+                results[cidr][ip] = {"domain": ",".join(ip_dict.get(ip))}
+                no_cidr = False
+                break
+        if no_cidr:
+            tmp = ip.split(".")
+            tmp[-1] = "0"
+            tmp = f'{".".join(tmp)}/24'
+            results[tmp] = dict()
+            results[tmp][ip] = {"domain": ",".join(ip_dict.get(ip))}
+    return results
+
+
+def synthetic(size: int, cidrs: int, seed: int) -> (dict, list):
+    """
+    生成互不重叠的/16~/24 CIDR，约80%的IP落在这些CIDR中，其余为随机地址
+
+    :return : ({IP: {domain: None}}, CIDR组成的list)
+    :rtype  : (dict, list)
+    """
+    rand = random.Random(seed)
+    networks = list()
+    for block in rand.sample(range(1, 224), cidrs // 8 + 1):
+        for sub in rand.sample(range(256), 8):
+            prefix = rand.choice((16, 20, 22, 24)) if sub == 0 else 24
+            networks.append(((block << 24) | (sub << 16), prefix))
+    networks = networks[:cidrs]
+    ip_dict = dict()
+    while len(ip_dict) < size:
+        if rand.random() < 0.8:
+            network, prefix = rand.choice(networks)
+            ip = network + rand.randrange(1 << (32 - prefix))
+        else:
+            ip = rand.randrange(1 << 32)
+        ip_dict[int_to_ip(ip)] = {f"host{len(ip_dict)}.example.com": None}
+    return ip_dict, [f"{int_to_ip(network)}/{prefix}" for network, prefix in networks]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--cidrs", type=int, default=500)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rows = list()
+    for size in [int(itm) for itm in args.sizes.split(",")]:
+        ip_dict, cidrs = synthetic(size, args.cidrs, args.seed)
+        elapsed, indexed = timed(analysis._distribution, ip_dict, {cidr: dict() for cidr in cidrs})
+
+        sample = dict(list(ip_dict.items())[:args.sample])
+        loop_elapsed, looped = timed(nested_loop, sample, {cidr: dict() for cidr in cidrs})
+        estimated = size > len(sample)
+        loop_elapsed *= size / len(sample)
+        # CIDR互不重叠时两种方法的分配结果相同
+        same = all(ip in indexed.get(cidr, ()) for cidr, ips in looped.items() for ip in ips)
+        rows.append([size, args.cidrs, f"{loop_elapsed:.2f}s" + (" est." if estimated else ""),
+                     f"{elapsed:.2f}s", f"{loop_elapsed / elapsed:.0f}x", same])
+    table(["ips", "cidrs", "nested loop", "CidrIndex", "speedup", "same result"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+结果导出的基准：统计导出--rows行时进程峰值内存的增量
+
+  generator     export.entrance逐行读取生成器（与HostStore.rows相同）
+  sqlite        export.entrance逐行读取Database.iter_table的游标
+  materialized  原来的做法：先展开为dict组成的list（data_conversion），json格式再用json.dump整体写入，
+                行数由--baseline-rows指定，内存与行数成正比，5M行需要数GB内存
+
+python3 benchmarks/bench_export.py [--rows 5000000] [--baseline-rows 500000] [--formats csv,json,ndjson.gz]
+每项在独立的子进程中运行，峰值内存互不影响；sqlite数据源会先生成一个--rows行的临时数据库
+"""
+
+import sys
+import json
+import pathlib
+import argparse
+import tempfile
+import subprocess
+
+from _common import peak_rss, table, timed
+
+from airin import export
+from airin import Database
+from airin.config import settings
+from airin.iptools import int_to_ip
+
+TABLE_NAME = "RESULT"
+
+
+def generate(rows: int):
+    """
+    生成与data_conversion结构相同的行
+    """
+    for i in range(rows):
+        ip = int_to_ip((10 << 24) + i // 2)
+        yield {"cidr": f"{int_to_ip(((10 << 24) + i // 2) & 0xFFFFFF00)}/24", "ip": ip,
+               "domain": f"host{i // 2}.example.com", "port": 80 + i % 2, "state": "open", "reason": "syn-ack",
+               "name": "http", "product": "nginx", "version": "1.24", "extrainfo": None, "conf": "10",
+               "cpe": "cpe:/a:igor_sysoev:nginx:1.24", "title": f"Welcome {i % 1000}", "status": 200,
+               "truncated": 0}
+
+
+def create_database(path: pathlib.Path, rows: int) -> None:
+    settings.database.db_path = path
+    db = Database()
+    db.exec(f"create table {TABLE_NAME} ({', '.join(export.FIELDS)})")
+    batch = list()
+    for row in generate(rows):
+        batch.append(tuple(row.values()))
+        if len(batch) >= 100000:
+            db.execmany(f"insert into {TABLE_NAME} values ({', '.join('?' * len(export.FIELDS))})", batch)
+            batch = list()
+    if batch:
+        db.execmany(f"insert into {TABLE_NAME} values ({', '.join('?' * len(export.FIELDS))})", batch)
+    db.connect.commit()
+    db.close()
+
+
+def materialized(data, path: str, fmt: str) -> str:
+    data = list(data)
+    filepath = f"{path}/materialized.{fmt}"
+    with export._open(filepath, settings.export.result_save_encode) as file:
+        if fmt.startswith("json"):
+            json.dump(data, file)
+        else:
+            getattr(export, f"{fmt.partition('.')[0]}_report")(data, file)
+    return filepath
+
+
+def child(source: str, fmt: str, rows: int, path: str) -> None:
+    """
+    子进程中导出一次，输出 "耗时 峰值内存增量 文件大小"
+    """
+    settings.database.db_path = pathlib.Path(path, "airin.sqlite3")
+    db = Database()
+    baseline = peak_rss()
+    if source == "sqlite":
+        data = db.iter_table(TABLE_NAME)
+    else:
+        data = generate(rows)
+    if source == "materialized":
+        elapsed, filepath = timed(materialized, data, path, fmt)
+    else:
+        elapsed, filepath = timed(export.entrance, data, path, fmt)
+    db.close()
+    size = pathlib.Path(filepath).stat().st_size
+    pathlib.Path(filepath).unlink()
+    print(elapsed, peak_rss() - baseline, size)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--baseline-rows", type=int, default=500000)
+    parser.add_argument("--formats", default="csv,json,ndjson.gz")
+    parser.add_argument("--child", nargs=4, metavar=("SOURCE", "FORMAT", "ROWS", "PATH"))
+    args = parser.parse_args()
+    if args.child:
+        source, fmt, rows, path = args.child
+        return child(source, fmt, int(rows), path)
+
+    results = list()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        elapsed, _ = timed(create_database, pathlib.Path(temp_dir, "airin.sqlite3"), args.rows)
+        print(f"Created a {args.rows} rows database in {elapsed:.1f}s")
+        for fmt in args.formats.split(","):
+            for source, rows in (("materialized", args.baseline_rows), ("generator", args.rows),
+                                 ("sqlite", args.rows)):
+                output = subprocess.run([sys.executable, __file__, "--child", source, fmt, str(rows), temp_dir],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+                elapsed, rss, size = output.stdout.split()[-3:]
+                results.append([fmt, source, rows, f"{float(elapsed):.1f}s", f"{int(rss) / 2 ** 20:.0f}MiB",
+                                f"{int(rss) / rows:.1f}B", f"{int(size) / 2 ** 20:.0f}MiB"])
+    table(["format", "source", "rows", "time", "peak RSS increase", "per row", "file size"], results)
+
+
+if __name__ == "__main__":
+    main()
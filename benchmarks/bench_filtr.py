@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+数据筛选的基准：在--rows行OneForAll导出数据上对比原来每行eval一次筛选表达式与编译后的RowFilter
+
+  eval      原来的做法：规则拼接成表达式字符串，每行eval一次，所有值按字符串比较
+  row       RowFilter逐行判断
+  apply     RowFilter.apply按列筛选整块数据（_data_filtr使用的方式）
+
+python3 benchmarks/bench_filtr.py [--rows 1000000]
+使用settings.analysis中默认的筛选规则，OneForAll的csv中所有字段都是字符串，
+level >= 10的行在eval中会因为"10" <= "2"被错误地保留
+"""
+
+import random
+import argparse
+
+from _common import table, timed
+
+from airin.config import settings
+from airin.filtr import RowFilter
+
+
+def synthetic(rows: int, seed: int) -> list:
+    """
+    生成与OneForAll导出的csv相同的行，所有值都是字符串
+    """
+    rand = random.Random(seed)
+    return [{"id": str(i), "alive": rand.choice("01"), "request": "1", "resolve": "1", "url": f"http://s{i}.example.com",
+             "subdomain": f"s{i}.example.com", "level": str(rand.choice((1, 1, 1, 2, 2, 3, 10, 11))),
+             "cname": "", "ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "public": "1",
+             "cdn": rand.choice("0001"), "port": "80", "status": rand.choice(("200", "301", "404")), "reason": "OK",
+             "title": f"Title {i % 977}"} for i in range(rows)]
+
+
+def eval_loop(data: list, rules: list) -> list:
+    """
+    原来的_data_filtr：Settings._analysis_join_arguments拼接的表达式对每行eval
+    """
+    expression = " and ".join(f"itm.get(\"{rule.get('field')}\") {rule.get('operator')} \"{rule.get('value')}\""
+                              for rule in rules)
+    return [itm for itm in data if eval(expression)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rules = settings.analysis.dict_filtr_arguments
+    data = synthetic(args.rows, args.seed)
+    compiled = RowFilter(rules)
+    methods = (("eval", lambda: eval_loop(data, rules)),
+               ("row", lambda: [itm for itm in data if compiled(itm)]),
+               ("apply", lambda: compiled.apply(data)))
+    rows = list()
+    results = dict()
+    for name, func in methods:
+        elapsed, results[name] = timed(func)
+        wrong = sum(1 for itm in results[name] if int(itm["level"]) > 2)
+        rows.append([name, args.rows, len(results[name]), wrong, f"{elapsed:.2f}s",
+                     f"{elapsed / args.rows * 1e6:.2f}us"])
+    assert results["row"] == results["apply"]
+    print(f"Rules: {rules}")
+    table(["method", "rows", "kept", "kept with level > 2", "time", "per row"], rows)
+
+
+if __name__ == "__main__":
+    main()
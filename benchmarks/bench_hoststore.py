@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+主机数据内存占用的基准：对比{CIDR: {IP: {...}}}嵌套dict与HostStore保存相同扫描结果时每个主机占用的内存
+
+python3 benchmarks/bench_hoststore.py [--hosts 10000,100000] [--ports 2]
+内存由tracemalloc统计，只计算保存结果的数据结构，不含生成的扫描结果，tracemalloc会使运行明显变慢；
+扫描结果中的字符串每个主机都是新对象，与解析nmap输出时相同
+"""
+
+import argparse
+import tracemalloc
+
+from _common import table, timed
+
+from airin import analysis
+from airin.iptools import int_to_ip
+
+SERVICES = [("http", "nginx", "1.24", "cpe:/a:igor_sysoev:nginx:1.24"),
+            ("ssh", "OpenSSH", "8.9p1 Ubuntu 3", "cpe:/a:openbsd:openssh:8.9p1"),
+            ("https", "Apache httpd", "2.4.57", "cpe:/a:apache:http_server:2.4.57")]
+
+
+def _fresh(text: str) -> str:
+    return (text + " ")[:-1]
+
+
+def scan_batches(hosts: int, ports: int, batch: int = 1000):
+    """
+    按批生成{CIDR: {IP: {"domain", "ports"}}}形式的扫描结果，每个/16为一个CIDR
+    """
+    base = 10 << 24
+    for start in range(0, hosts, batch):
+        data = dict()
+        for host in range(start, min(hosts, start + batch)):
+            ip = base + host
+            cidr = f"{int_to_ip(ip & 0xFFFF0000)}/16"
+            port_data = dict()
+            for i in range(ports):
+                name, product, version, cpe = SERVICES[(host + i) % len(SERVICES)]
+                port_data[80 + i] = {"state": _fresh("open"), "reason": _fresh("syn-ack"), "name": _fresh(name),
+                                     "product": _fresh(product), "version": _fresh(version), "extrainfo": _fresh(""),
+                                     "conf": _fresh("10"), "cpe": _fresh(cpe), "title": f"Welcome {host % 100}",
+                                     "status": 200, "truncated": 0}
+            data.setdefault(cidr, dict())[int_to_ip(ip)] = {"domain": f"host{host}.example.com", "ports": port_data}
+        yield data
+
+
+def build_dict(hosts: int, ports: int) -> dict:
+    store = dict()
+    for data in scan_batches(hosts, ports):
+        for cidr, ips in data.items():
+            store.setdefault(cidr, dict()).update(ips)
+    return store
+
+
+def build_store(hosts: int, ports: int) -> analysis.HostStore:
+    store = analysis.HostStore()
+    for data in scan_batches(hosts, ports):
+        for cidr, ips in data.items():
+            for ip, info in ips.items():
+                store.add_host(cidr, ip, info["domain"])
+        store.integrate_ports({ip: {"ports": info["ports"]} for ips in data.values() for ip, info in ips.items()})
+    return store
+
+
+def measure(func, *args) -> (float, int, object):
+    """
+    :return : (耗时秒数, 结果占用的字节数, 结果)
+    :rtype  : (float, int, object)
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    elapsed, result = timed(func, *args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return elapsed, size, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", default="10000,100000")
+    parser.add_argument("--ports", type=int, default=2)
+    args = parser.parse_args()
+
+    rows = list()
+    for hosts in [int(itm) for itm in args.hosts.split(",")]:
+        sizes = dict()
+        for name, func in (("nested dict", build_dict), ("HostStore", build_store)):
+            elapsed, sizes[name], result = measure(func, hosts, args.ports)
+            if name == "HostStore":
+                assert result.host_count() == hosts
+            del result
+            rows.append([hosts, args.ports, name, f"{elapsed:.1f}s", f"{sizes[name] / 2 ** 20:.0f}MiB",
+                         f"{sizes[name] / hosts:.0f}B", f"{sizes['nested dict'] / sizes[name]:.1f}x"])
+    table(["hosts", "ports/host", "store", "build", "memory", "per host", "reduction"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+HTTP信息更新的基准：在有--rows个端口的表上更新--rows条标题
+
+  normalized    Database.update_HTTP_info更新临时表，通过HOST.ip和PORT(host_id, port)索引定位端口，一个事务提交
+  flat          原来的做法：没有索引的扁平表，每条update按ip和port扫描整个表，耗时与行数的平方成正比，
+                行数由--baseline-rows指定，同时输出按每行耗时估算的--rows行耗时
+
+python3 benchmarks/bench_http_update.py [--rows 100000] [--baseline-rows 5000]
+"""
+
+import sqlite3
+import pathlib
+import argparse
+import tempfile
+
+from _common import table, timed
+
+from airin import Database
+from airin.config import settings
+from airin.iptools import int_to_ip
+
+FLAT_TABLE = "FLAT"
+
+
+def port_rows(rows: int) -> list:
+    """
+    每个主机两个HTTP端口，与insert_table使用的tuple相同
+    """
+    data = list()
+    for i in range(rows):
+        ip = int_to_ip((10 << 24) + i // 2)
+        data.append((f"{int_to_ip(((10 << 24) + i // 2) & 0xFFFFFF00)}/24", ip, None, 80 + i % 2, "open", "syn-ack",
+                     "http", "nginx", "1.24", None, "10", None, None, None, 0))
+    return data
+
+
+def http_rows(data: list) -> list:
+    """
+    update_HTTP_info使用的(title, status, truncated, ip, port)
+    """
+    return [(f"Welcome {row[1]}", 200, 0, row[1], row[3]) for row in data]
+
+
+def normalized(path: pathlib.Path, rows: int) -> (float, int):
+    settings.database.db_path = path
+    db = Database()
+    db.start_job(dict())
+    data = port_rows(rows)
+    db.insert_table(settings.database.temp_table_name, data)
+    elapsed, _ = timed(db.update_HTTP_info, settings.database.temp_table_name, http_rows(data))
+    updated = db.exec(f"select count(*) from {settings.database.temp_table_name} where title is not NULL")[0][0]
+    db.close()
+    return elapsed, updated
+
+
+def flat(path: pathlib.Path, rows: int) -> (float, int):
+    connect = sqlite3.connect(path)
+    connect.execute(f"""create table {FLAT_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, cidr TEXT NOT NULL,
+        ip TEXT, domain TEXT, port INT, state TEXT, reason TEXT, name TEXT, product TEXT, version TEXT,
+        extrainfo TEXT, conf TEXT, cpe TEXT, title TEXT, status INT)""")
+    data = port_rows(rows)
+    connect.executemany(f"insert into {FLAT_TABLE} values (NULL, {', '.join('?' * 14)})", [row[:14] for row in data])
+    connect.commit()
+    updates = [(title, status, ip, port) for title, status, truncated, ip, port in http_rows(data)]
+
+    def update():
+        connect.executemany(f"update {FLAT_TABLE} set title=?, status=? where ip=? and port=?", updates)
+        connect.commit()
+    elapsed, _ = timed(update)
+    updated = connect.execute(f"select count(*) from {FLAT_TABLE} where title is not NULL").fetchone()[0]
+    connect.close()
+    return elapsed, updated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--baseline-rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = list()
+    for name, func, rows in (("normalized", normalized, args.rows), ("flat", flat, args.baseline_rows)):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            elapsed, updated = func(pathlib.Path(temp_dir, "airin.sqlite3"), rows)
+        # 扁平表每条update扫描整个表，按行数的平方估算
+        estimate = elapsed * (args.rows / rows) ** 2
+        results.append([name, rows, updated, f"{elapsed:.2f}s", f"{elapsed / rows * 1e6:.1f}us",
+                        f"{estimate:.1f}s"])
+    print(f"SQLite {sqlite3.sqlite_version}")
+    table(["method", "rows", "updated", "time", "per row", f"estimated for {args.rows} rows"], results)
+
+
+if __name__ == "__main__":
+    main()
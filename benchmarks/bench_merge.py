@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+表合并的基准：在临时表有--rows行、主要表已有一半相同(ip, port)的数据库上对比
+  set-based     Database.merging_table，在数据库内完成，同一(ip, port)只保留最新一条
+  flat table    Database.merging_table从扁平的旧表合并（INSERT...SELECT）
+  round trip    原来的做法：select *读入Python后用insert_table逐行写回主要表
+
+python3 benchmarks/bench_merge.py [--rows 1000000] [--ports 2]
+每种方法使用独立的临时数据库，同时输出合并后主要表的行数，重复的(ip, port)会使行数超过唯一值数量
+"""
+
+import sqlite3
+import pathlib
+import argparse
+import tempfile
+
+from _common import peak_rss, table, timed
+
+from airin import Database
+from airin.config import settings
+from airin.iptools import int_to_ip
+
+FLAT_TABLE = "LEGACY"
+
+
+def scan_rows(hosts: range, ports: int, title: str):
+    """
+    按批生成insert_table使用的tuple
+    """
+    batch = list()
+    for host in hosts:
+        ip = int_to_ip((10 << 24) + host)
+        cidr = f"{int_to_ip(((10 << 24) + host) & 0xFFFFFF00)}/24"
+        for port in range(80, 80 + ports):
+            batch.append((cidr, ip, f"host{host}.example.com", port, "open", "syn-ack", "http", "nginx",
+                          "1.24", "", "10", "cpe:/a:igor_sysoev:nginx:1.24", title, 200, 0))
+        if len(batch) >= 100000:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def prepare(path: pathlib.Path, rows: int, ports: int, flat: bool) -> Database:
+    """
+    主要表中为上一次扫描的前一半主机，本次扫描的所有主机写入临时表或扁平表
+    """
+    settings.database.db_path = path
+    db = Database()
+    hosts = rows // ports
+    for batch in scan_rows(range(hosts // 2), ports, "old"):
+        db.insert_table(settings.database.table_name, batch)
+    if flat:
+        columns = ", ".join(f"{name} {kind}" for name, kind in (
+            ("cidr", "TEXT"), ("ip", "TEXT"), ("domain", "TEXT"), ("port", "INT"), ("state", "TEXT"),
+            ("reason", "TEXT"), ("name", "TEXT"), ("product", "TEXT"), ("version", "TEXT"),
+            ("extrainfo", "TEXT"), ("conf", "TEXT"), ("cpe", "TEXT"), ("title", "TEXT"), ("status", "INT"),
+            ("truncated", "INT")))
+        db.exec(f"create table {FLAT_TABLE} (id INTEGER PRIMARY KEY, {columns})")
+        for batch in scan_rows(range(hosts), ports, "new"):
+            db.execmany(f"insert into {FLAT_TABLE} values (NULL, {', '.join('?' * 15)})", batch)
+        db.connect.commit()
+    else:
+        db.start_job(dict())
+        for batch in scan_rows(range(hosts), ports, "new"):
+            db.insert_table(settings.database.temp_table_name, batch)
+    return db
+
+
+def round_trip(db: Database) -> None:
+    """
+    原来的merging_table：整个临时表读入内存再写回
+    """
+    data = [row[1:] for row in db.exec(f"select * from {settings.database.temp_table_name}")]
+    db.insert_table(settings.database.table_name, data)
+    db.clean(settings.database.temp_table_name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--ports", type=int, default=2)
+    args = parser.parse_args()
+
+    methods = (("set-based", False, lambda db: db.merging_table(settings.database.temp_table_name,
+                                                                 settings.database.table_name)),
+               ("flat table", True, lambda db: db.merging_table(FLAT_TABLE, settings.database.table_name)),
+               ("round trip", False, round_trip))
+    rows = list()
+    for name, flat, merge in methods:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prepare_elapsed, db = timed(prepare, pathlib.Path(temp_dir, "airin.sqlite3"), args.rows, args.ports, flat)
+            rss = peak_rss()
+            elapsed, _ = timed(merge, db)
+            merged, unique, new = db.exec(f"""
+            select count(*), count(distinct ip || ':' || port), sum(title='new')
+            from {settings.database.table_name}""")[0]
+            rows.append([name, args.rows, f"{prepare_elapsed:.1f}s", f"{elapsed:.2f}s", merged, unique, new,
+                         f"{max(0, peak_rss() - rss) / 2 ** 20:.0f}MiB"])
+            db.close()
+    print(f"SQLite {sqlite3.sqlite_version}")
+    table(["method", "temp rows", "prepare", "merge", "main rows", "unique", "new title", "extra peak RSS"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+扫描目标规划的基准：在合成的/8和/12网段上对比固定分割成/24(cut_mask)与按密度规划(plan_targets)，
+输出耗时、工作单元数量、实际探测的地址数量（浪费的探测 = 探测地址数 - 已知IP数）和工作单元大小的分布
+
+python3 benchmarks/bench_plan_targets.py [--seed 1] [--dense-blocks 2000] [--scattered 50000]
+已知IP由若干密集的/24（每个20~200个IP）和零散的单个IP组成，/12的规模按地址数等比缩小
+"""
+
+import random
+import argparse
+import pathlib
+import tempfile
+import statistics
+
+from _common import table, timed
+
+from airin import analysis
+from airin.config import settings
+from airin.iptools import int_to_ip, parse_cidr, parse_target
+
+
+def synthetic(cidr: str, dense_blocks: int, scattered: int, seed: int) -> dict:
+    """
+    在cidr内生成已知IP
+
+    :return : {cidr: IP字符串组成的list}
+    :rtype  : dict
+    """
+    rand = random.Random(seed)
+    network, prefix = parse_cidr(cidr)
+    blocks = 1 << (24 - prefix)
+    ips = set()
+    for block in rand.sample(range(blocks), min(blocks, dense_blocks)):
+        base = network + (block << 8)
+        ips.update(base + host for host in rand.sample(range(256), rand.randint(20, 200)))
+    size = 1 << (32 - prefix)
+    ips.update(network + rand.randrange(size) for i in range(scattered))
+    return {cidr: [int_to_ip(ip) for ip in sorted(ips)]}
+
+
+def unit_sizes(targets: list) -> list:
+    """
+    每个工作单元包含的地址数量，目标文件按其中每行的目标累加
+    """
+    sizes = list()
+    for target in targets:
+        path = pathlib.Path(target)
+        lines = path.read_text().split() if path.suffix == ".txt" and path.exists() else [target]
+        sizes.append(sum(end - start + 1 for version, start, end in (parse_target(line) for line in lines)))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dense-blocks", type=int, default=2000)
+    parser.add_argument("--scattered", type=int, default=50000)
+    args = parser.parse_args()
+
+    rows = list()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        settings.temp_save_dir = pathlib.Path(temp_dir)
+        for cidr in ("10.0.0.0/8", "172.16.0.0/12"):
+            scale = 1 << (parse_cidr(cidr)[1] - 8)  # 按地址数等比缩小
+            data = synthetic(cidr, args.dense_blocks // scale, args.scattered // scale, args.seed)
+            known = len(data[cidr])
+            for name, func in (("cut_mask", analysis.cut_mask), ("plan_targets", analysis.plan_targets)):
+                elapsed, targets = timed(func, [cidr], data)
+                sizes = unit_sizes(targets)
+                probed = sum(sizes)
+                rows.append([cidr, known, name, f"{elapsed:.3f}s", len(targets), probed, probed - known,
+                             min(sizes), int(statistics.median(sizes)), max(sizes)])
+                analysis.remove_targets_files(targets)
+    table(["cidr", "known", "planner", "time", "units", "probed", "wasted", "min unit", "median", "max unit"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+HTTP标题请求引擎的基准：在带注入延迟的本地HTTP服务器上对比多线程引擎(request.bulk_request)与asyncio引擎(aiorequest)
+
+python3 benchmarks/bench_request.py [--requests 5000] [--hosts 50] [--latency 0.2] [--threads 32]
+服务器在127.0.0.1~127.0.0.N的同一端口上监听，模拟N个主机，每个响应前等待latency秒（±20%抖动）；
+速率调度在基准中关闭，asyncio引擎的并发数和单主机并发数使用settings.request中的设置
+"""
+
+import random
+import asyncio
+import argparse
+import resource
+import threading
+
+from _common import table, timed
+
+from airin import aiorequest
+from airin import request
+from airin.config import settings
+from airin.ratelimit import scheduler
+
+
+class LatencyServer(object):
+    """
+    asyncio实现的HTTP服务器，在独立线程的事件循环中运行，可同时保持数千个连接
+    """
+
+    def __init__(self, hosts: int, latency: float):
+        self.hosts = [f"127.0.0.{i}" for i in range(1, hosts + 1)]
+        self.latency = latency
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+            body = f"<html><head><title>{writer.get_extra_info('sockname')[0]}</title></head></html>".encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def _start(self) -> None:
+        first = await asyncio.start_server(self._handle, self.hosts[0], 0, backlog=4096)
+        self.port = first.sockets[0].getsockname()[1]
+        if len(self.hosts) > 1:
+            await asyncio.start_server(self._handle, self.hosts[1:], self.port, backlog=4096)
+        self._ready.set()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self.loop.run_forever()
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *args):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def thread_engine(targets: list) -> list:
+    return request.get_html_info(request.bulk_request(targets))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--hosts", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    scheduler.enabled = False
+    settings.request.thread_count = args.threads
+    settings.request.enable_proxy = False
+
+    rows = list()
+    with LatencyServer(args.hosts, args.latency) as server:
+        targets = list()
+        for i in range(args.requests):
+            ip = server.hosts[i % len(server.hosts)]
+            targets.append({"url": f"http://{ip}:{server.port}/{i}", "cidr": f"{ip}/32", "ip": ip, "port": server.port})
+        engines = (("thread", thread_engine, f"{args.threads} threads"),
+                   ("asyncio", aiorequest.bulk_request,
+                    f"{settings.request.async_concurrency} total, {settings.request.per_host_limit}/host, "
+                    f"{'aiohttp' if aiorequest.aiohttp else 'stdlib'}"))
+        for name, func, concurrency in engines:
+            elapsed, results = timed(func, targets)
+            ok = sum(1 for itm in results if itm["status"] == 200 and itm["title"] == itm["ip"])
+            rows.append([name, concurrency, len(results), ok, f"{elapsed:.2f}s", f"{len(results) / elapsed:.0f}"])
+    print(f"\n{args.requests} requests to {args.hosts} hosts, {args.latency * 1000:.0f}ms latency")
+    table(["engine", "concurrency", "results", "ok", "time", "pages/sec"], rows)
+
+
+if __name__ == "__main__":
+    main()
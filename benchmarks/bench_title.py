@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+标题提取的微基准：在保存的页面语料上对比正则快速路径(title_extractor="fast")与BeautifulSoup，
+同时检查两者结果是否一致，快速路径无法确定而回退到BeautifulSoup的页面单独计数
+
+python3 benchmarks/bench_title.py [--pages 保存页面的目录] [--rounds 200]
+默认语料为benchmarks/pages，可以用扫描时保存的响应内容替换
+"""
+
+import argparse
+import pathlib
+
+from _common import table, timed
+
+from airin import request
+from airin.config import settings
+
+
+def extract_all(contents: list, extractor: str, rounds: int) -> list:
+    settings.request.title_extractor = extractor
+    titles = list()
+    for i in range(rounds):
+        titles = [request.parse_content(content) for content in contents]
+    return titles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", default=pathlib.Path(__file__).parent.joinpath("pages"))
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    paths = sorted(pathlib.Path(args.pages).glob("*.htm*"))
+    contents = [path.read_bytes() for path in paths]
+    fallback = [path.name for path, content in zip(paths, contents)
+                if request._fast_html_title(request.decode_content(content)) is None]
+
+    rows = list()
+    results = dict()
+    for extractor in ("bs4", "fast"):
+        elapsed, results[extractor] = timed(extract_all, contents, extractor, args.rounds)
+        pages = len(contents) * args.rounds
+        rows.append([extractor, pages, f"{elapsed:.3f}s", f"{elapsed / pages * 1e6:.1f}us"])
+    table(["extractor", "pages", "total", "per page"], rows)
+
+    print(f"\n{len(paths)} pages, fast path fell back to BeautifulSoup on {len(fallback)}: {', '.join(fallback)}")
+    mismatches = [(path.name, fast, bs4) for path, fast, bs4 in zip(paths, results["fast"], results["bs4"]) if fast != bs4]
+    for name, fast, bs4 in mismatches:
+        print(f"MISMATCH {name}: fast={fast!r} bs4={bs4!r}")
+    if not mismatches:
+        print("fast and bs4 titles identical on every page")
+
+
+if __name__ == "__main__":
+    main()
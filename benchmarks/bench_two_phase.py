@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+两阶段端口扫描的基准：对比一次-sV扫描所有端口（enable_two_phase = False，默认）与先发现开放端口再只对开放端口版本识别
+
+  single      PortScanIter不分阶段，每个目标用arguments_port（含自定义端口列表）扫描
+  two-phase   _TwoPhaseScan先用arguments_discovery发现开放端口，再按开放端口分组进行版本识别
+
+默认用不运行nmap的模拟扫描器代替_ScanPool：--hosts个主机按/24分成目标，其中--up比例的主机有开放端口，
+输出每个阶段的扫描器调用次数、进入-sV的主机数和主机:端口数，以及两阶段分组、目标文件读写等本身的耗时
+python3 benchmarks/bench_two_phase.py [--hosts 65536] [--up 0.05] [--seed 1]
+
+指定--nmap时使用真实的nmap扫描这些目标并计时，端口列表为settings.netscan.ports
+python3 benchmarks/bench_two_phase.py --nmap 127.0.0.1 [--nmap 192.168.1.0/24 ...]
+"""
+
+import random
+import argparse
+import pathlib
+
+from _common import table, timed
+
+from airin import netscan
+from airin.config import setting, settings
+from airin.iptools import int_to_ip, parse_target
+
+SERVICES = [(22,), (80, 443), (22, 80), (3389,), (8080,), (22, 80, 443, 8443)]
+
+
+class StubScanner(object):
+    """
+    代替_ScanPool的模拟扫描器，按open_ports返回开放端口并统计每个阶段的扫描量
+    """
+
+    def __init__(self, open_ports: dict):
+        self.open_ports = open_ports
+        self.stats = dict()  # {stype: [调用次数, 主机数, 主机:端口数]}
+
+    def __call__(self, targets: list, stype: str = "alive", on_done=None, ports: dict = None):
+        ports = ports or dict()
+        stats = self.stats.setdefault(stype, [0, 0, 0])
+        for target in targets:
+            path = pathlib.Path(str(target))
+            if path.suffix == ".txt":
+                hosts = path.read_text().split()
+            else:
+                _, start, end = parse_target(str(target))
+                hosts = [int_to_ip(i) for i in range(start, end + 1)]
+            scanned = ports.get(str(target))
+            scanned = [int(port) for port in scanned.split(",")] if scanned else settings.netscan.ports
+            stats[0] += 1
+            stats[1] += len(hosts)
+            stats[2] += len(hosts) * len(scanned)
+            scan = dict()
+            for host in hosts:
+                found = [port for port in self.open_ports.get(host, ()) if port in scanned]
+                if found:
+                    scan[host] = {"tcp": {port: {"state": "open", "name": "stub"} for port in found}}
+            yield target, {"scan": scan}
+            if on_done is not None:
+                on_done(target)
+
+
+def synthetic(hosts: int, up: float, seed: int) -> (list, dict):
+    """
+    :return : (/24目标组成的list, {host: 开放端口的tuple})
+    :rtype  : (list, dict)
+    """
+    rand = random.Random(seed)
+    base = 10 << 24
+    targets = [f"{int_to_ip(base + i)}/24" for i in range(0, hosts, 256)]
+    open_ports = {int_to_ip(base + i): rand.choice(SERVICES) for i in range(hosts) if rand.random() < up}
+    return targets, open_ports
+
+
+def configure(two_phase: bool) -> None:
+    """
+    按setting.py中的参数重新拼接自定义端口列表
+    """
+    settings.netscan.enable_two_phase = two_phase
+    settings.netscan.arguments_port = setting.netscan.arguments_port
+    settings.netscan.arguments_discovery = setting.netscan.arguments_discovery
+    settings._netscan_join_ports()
+
+
+def scan(targets: list) -> int:
+    return sum(len(info["ports"]) for data in netscan.PortScanIter(targets) for info in data.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=65536)
+    parser.add_argument("--up", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--nmap", action="append", metavar="TARGET")
+    args = parser.parse_args()
+
+    settings.netscan.backend = "nmap"
+    settings.database.enable_fingerprint = False
+    rows = list()
+    if args.nmap:
+        for name, two_phase in (("single", False), ("two-phase", True)):
+            configure(two_phase)
+            elapsed, found = timed(scan, args.nmap)
+            rows.append([name, found, f"{elapsed:.2f}s"])
+        print(f"nmap on {', '.join(args.nmap)}, {len(settings.netscan.ports)} ports")
+        table(["method", "open ports", "time"], rows)
+        return None
+
+    targets, open_ports = synthetic(args.hosts, args.up, args.seed)
+    for name, two_phase in (("single", False), ("two-phase", True)):
+        configure(two_phase)
+        stub = StubScanner(open_ports)
+        netscan._ScanPool = stub
+        elapsed, found = timed(scan, targets)
+        discovery = stub.stats.get("discovery", [0, 0, 0])
+        version = stub.stats.get("port", [0, 0, 0])
+        rows.append([name, found, discovery[0], version[0], version[1], version[2], f"{elapsed:.2f}s"])
+    print(f"{args.hosts} hosts in {len(targets)} /24 targets, {len(open_ports)} hosts with open ports, "
+          f"{len(settings.netscan.ports)} ports")
+    table(["method", "open ports", "discovery calls", "-sV calls", "-sV hosts", "-sV host:ports", "time"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from datetime import datetime
 
 from airin import Database
 from airin import request
+from airin import export
 from airin.config import settings
 from airin.config.log import logger
 
@@ -20,15 +21,24 @@ class Control(object):
     
     def show(self):
         """
-        枚举表名
+        枚举表名和视图名（主要表和临时表是视图）
         """
-        ret = self.db.exec("select name from sqlite_master where type='table'")
-        for name in ret:
-            logger.log("INFOR", f"Table name: {name[0]}")
+        ret = self.db.exec(
+            "select name, type from sqlite_master where type in ('table', 'view') and name not like 'sqlite_%'")
+        for name, kind in ret:
+            logger.log("INFOR", f"{kind.capitalize()} name: {name}")
     
+    def jobs(self):
+        """
+        枚举未合并的任务，可通过 airinscan.py --resume <任务ID> - run 恢复
+        """
+        for job_id, created_at, done, total in self.db.list_jobs():
+            dt = datetime.fromtimestamp(created_at).strftime('%Y-%m-%d %H:%M:%S')
+            logger.log("INFOR", f"Job ID: {job_id} \tcreated: {dt} \tchunks: {done}/{total}")
+
     def merging(self, src, dst):
         """
-        表合并
+        表合并，在数据库内以INSERT...SELECT完成，同一(ip, port)的记录会被更新而不是重复添加
 
         :param str src:  数据来源表名
         :param str dst:  数据接收表名
@@ -45,14 +55,16 @@ class Control(object):
     #     for itm in ret:
     #         logger.log("INFOR", f"{itm}")
     
-    def export(self, name: str, path: str = settings.result_save_dir):
+    def export(self, name: str, path: str = settings.result_save_dir, fmt: str = "csv"):
         """
-        将表数据导出为csv
+        将表数据逐行导出为文件
 
         :param str name:  表名
         :param str path:  保存路径
+        :param str fmt :  csv/json/ndjson，加上.gz则压缩，如csv.gz；parquet/arrow需要安装pyarrow
         """
-        self.db.export_csv(name, path)
+        export.entrance(self.db.iter_table(name), path, fmt, prefix=f"all_{name}_data",
+                        field=self.db.table_fields(name))
     
     def request(self, name: str):
         """
@@ -65,7 +77,8 @@ class Control(object):
         resp_results = request.run_request(targets)
         conver_data = list()
         for itm in resp_results:
-            conver_data.append((itm.get("title"), itm.get("status"), itm.get("ip"), itm.get("port")))
+            conver_data.append((itm.get("title"), itm.get("status"), int(bool(itm.get("truncated"))),
+                                itm.get("ip"), itm.get("port")))
         self.db.update_HTTP_info(name, conver_data)
     
     def __exit__(self):
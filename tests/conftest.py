@@ -0,0 +1,92 @@
+import os
+import sys
+import pathlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from airin.config import settings  # noqa: E402
+from airin.config.log import logger, stdout_fmt  # noqa: E402
+
+
+"""
+测试的公共夹具：临时数据库、假nmap、本地HTTP服务器
+"""
+
+# 测试中的日志只输出到终端，不写入results/airin.log
+logger.remove()
+logger.add(sys.stderr, level="INFOR", format=stdout_fmt)
+
+
+@pytest.fixture(autouse=True)
+def tmp_results(tmp_path, monkeypatch):
+    """
+    每个测试的结果、临时文件目录和数据库都指向pytest的临时目录，不在results/中留下文件
+    """
+    monkeypatch.setattr(settings, "result_save_dir", tmp_path, raising=False)
+    monkeypatch.setattr(settings, "temp_save_dir", tmp_path, raising=False)
+    monkeypatch.setattr(settings.database, "db_path", tmp_path.joinpath("airin.sqlite3"))
+    return tmp_path
+
+
+@pytest.fixture
+def tmp_db(tmp_results):
+    """
+    使用临时数据库的测试，返回数据库和临时文件所在的目录
+    """
+    return tmp_results
+
+
+@pytest.fixture
+def fake_nmap(tmp_path, monkeypatch):
+    """
+    把tests/fakebin放到PATH最前面代替nmap，返回记录nmap调用的日志文件
+    """
+    log = tmp_path.joinpath("nmap.log")
+    monkeypatch.setenv("PATH", f"{ROOT.joinpath('tests', 'fakebin')}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_NMAP_LOG", str(log))
+    monkeypatch.setattr(settings.netscan, "enable_sudo", False)
+    monkeypatch.setattr(settings.ratelimit, "enable", False)
+    return log
+
+
+class _Handler(BaseHTTPRequestHandler):
+    routes = dict()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        route = self.routes.get(self.path)
+        if route is None:
+            self.send_error(404)
+            return None
+        route(self)
+
+
+@pytest.fixture
+def http_server():
+    """
+    本地HTTP服务器，routes为{path: 以handler为参数的函数}，返回(base_url, routes)
+    """
+    handler = type("Handler", (_Handler,), {"routes": dict()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", handler.routes
+    server.shutdown()
+    server.server_close()
+
+
+def send_body(handler, body: bytes, status: int = 200, length: bool = True) -> None:
+    handler.send_response(status)
+    handler.send_header("Content-Type", "text/html")
+    if length:
+        handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
@@ -0,0 +1,121 @@
+import gzip
+import time
+import threading
+
+import pytest
+
+from airin import aiorequest
+from airin import request
+from airin.config import settings
+from conftest import send_body
+
+
+def _gzip(handler) -> None:
+    body = gzip.compress("<title>压缩</title>".encode())
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/html; charset=utf-8")
+    handler.send_header("Content-Encoding", "gzip")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def _redirect(handler) -> None:
+    handler.send_response(302)
+    handler.send_header("Location", "/plain")
+    handler.send_header("Content-Length", "0")
+    handler.end_headers()
+
+
+@pytest.mark.parametrize("engine", ["asyncio", "thread"])
+def test_engines_return_same_results(http_server, monkeypatch, engine):
+    base, routes = http_server
+    routes["/plain"] = lambda handler: send_body(handler, b"<html><title>plain</title></html>")
+    routes["/gzip"] = _gzip
+    routes["/redirect"] = _redirect
+    routes["/missing"] = lambda handler: send_body(handler, b"<title>not found</title>", 404)
+    monkeypatch.setattr(settings.request, "engine", engine)
+    monkeypatch.setattr(settings.request, "enable_proxy", False)
+    paths = ["/plain", "/gzip", "/redirect", "/missing"]
+    targets = [{"url": f"{base}{path}", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": i}
+               for i, path in enumerate(paths)]
+    results = sorted(request.run_request(targets), key=lambda itm: itm["port"])
+    assert [set(itm) for itm in results] == [{"cidr", "ip", "port", "title", "status", "truncated"}] * 4
+    assert [(itm["title"], itm["status"], bool(itm["truncated"])) for itm in results] == [
+        ("plain", 200, False), ("压缩", 200, False), ("plain", 200, False), ("not found", 404, False)]
+
+
+def test_per_host_limit(http_server, monkeypatch):
+    base, routes = http_server
+    active = [0, 0]  # [当前连接数, 最大连接数]
+    lock = threading.Lock()
+
+    def slow(handler):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+        send_body(handler, b"<title>slow</title>")
+    routes["/slow"] = slow
+    monkeypatch.setattr(settings.request, "per_host_limit", 3)
+    monkeypatch.setattr(aiorequest.scheduler, "enabled", False)
+    targets = [{"url": f"{base}/slow", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": i} for i in range(12)]
+    start = time.time()
+    results = aiorequest.bulk_request(targets)
+    assert len(results) == 12 and all(itm["title"] == "slow" for itm in results)
+    assert active[1] == 3
+    assert time.time() - start < 12 * 0.2
+
+
+def test_asyncio_huge_body_truncated(http_server, monkeypatch):
+    base, routes = http_server
+    # 没有</title>，只能读到max_body_size为止
+    routes["/"] = lambda handler: send_body(handler, b"<html>" + b"a" * (8 << 20))
+    monkeypatch.setattr(settings.request, "max_body_size", 65536)
+    targets = [{"url": f"{base}/", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": 80}]
+    start = time.time()
+    result, = aiorequest.bulk_request(targets)
+    assert time.time() - start < 5
+    assert (result["status"], result["truncated"]) == (200, True)
+
+
+def test_title_parsed_off_event_loop(http_server, monkeypatch):
+    base, routes = http_server
+    routes["/"] = lambda handler: send_body(handler, b"<title>parsed</title>")
+    threads = list()
+    parse_content = request.parse_content
+
+    def parse(content):
+        threads.append(threading.current_thread())
+        return parse_content(content)
+    monkeypatch.setattr(request, "parse_content", parse)
+    monkeypatch.setattr(aiorequest.scheduler, "enabled", False)
+    targets = [{"url": f"{base}/", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": i} for i in range(3)]
+    results = aiorequest.bulk_request(targets)
+    assert [itm["title"] for itm in results] == ["parsed"] * 3
+    # 事件循环在主线程中运行
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+
+def test_parse_process_pool(http_server, monkeypatch):
+    base, routes = http_server
+    routes["/"] = lambda handler: send_body(handler, b"<title>pool</title>")
+    monkeypatch.setattr(settings.request, "parse_process_count", 1)
+    monkeypatch.setattr(aiorequest.scheduler, "enabled", False)
+    targets = [{"url": f"{base}/", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": i} for i in range(3)]
+    assert [itm["title"] for itm in aiorequest.bulk_request(targets)] == ["pool"] * 3
+
+
+def test_rate_wait_does_not_hold_global_limit(http_server, monkeypatch):
+    base, routes = http_server
+    routes["/"] = lambda handler: send_body(handler, b"<title>ok</title>")
+    monkeypatch.setattr(settings.request, "async_concurrency", 1)
+    # 第一个主机需要等待发送时间，等待期间其他主机的请求不受影响
+    monkeypatch.setattr(aiorequest.scheduler, "reserve", lambda ip: 1.0 if ip == "10.0.0.1" else 0)
+    monkeypatch.setattr(aiorequest.scheduler, "feedback", lambda *args: None)
+    targets = [{"url": f"{base}/", "cidr": "10.0.0.0/24", "ip": ip, "port": i}
+               for i, ip in enumerate(["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"])]
+    results = aiorequest.bulk_request(targets)
+    assert [itm["ip"] for itm in results] == ["10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.1"]
@@ -0,0 +1,152 @@
+import socket
+import threading
+
+import pytest
+
+from airin import aioscan
+from airin.config import settings
+from airin.ratelimit import scheduler
+
+
+@pytest.fixture
+def fast_scan(monkeypatch):
+    """
+    缩短超时时间、关闭重试和速率调度
+    """
+    monkeypatch.setattr(settings.netscan, "connect_timeout", 0.3)
+    monkeypatch.setattr(settings.netscan, "connect_retries", 0)
+    monkeypatch.setattr(settings.netscan, "banner_timeout", 0.5)
+    monkeypatch.setattr(settings.netscan, "enable_banner", True)
+    monkeypatch.setattr(scheduler, "enabled", False)
+
+
+@pytest.fixture
+def ports():
+    """
+    本地的四个端口：发送banner的open、不发送数据的open、closed、filtered，返回{状态: 端口}
+    """
+    sockets = list()
+
+    def listen(backlog: int = 16) -> socket.socket:
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(backlog)
+        sockets.append(sock)
+        return sock
+
+    def serve(sock: socket.socket, banner: bytes) -> None:
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return None
+            sockets.append(conn)
+            try:
+                conn.sendall(banner)
+            except OSError:
+                pass  # 不读取banner时扫描端直接发送RST关闭连接
+
+    result = dict()
+    for name, banner in (("banner", b"SSH-2.0-OpenSSH_8.9\r\n"), ("silent", b"")):
+        sock = listen()
+        result[name] = sock.getsockname()[1]
+        threading.Thread(target=serve, args=(sock, banner), daemon=True).start()
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    result["closed"] = closed.getsockname()[1]
+    closed.close()
+    # 不accept且已连接队列已满的端口，之后的SYN被内核丢弃，连接超时
+    full = listen(0)
+    result["filtered"] = full.getsockname()[1]
+    held = socket.socket()
+    held.connect(("127.0.0.1", result["filtered"]))
+    sockets.append(held)
+    yield result
+    for sock in sockets:
+        sock.close()
+
+
+def _scan(targets: list, stype: str, ports: dict = None) -> (dict, list, list):
+    """
+    :return : ({ip: 主机数据}, 统计信息list, 完成的目标list)
+    :rtype  : (dict, list, list)
+    """
+    hosts = dict()
+    stats = list()
+    done = list()
+    for target, data in aioscan.ScanPool(targets, stype, done.append, ports):
+        if data.get("nmap"):
+            stats.append(data["nmap"]["scanstats"])
+        hosts.update(data["scan"])
+    return hosts, stats, done
+
+
+def test_port_states(fast_scan, ports):
+    spec = ",".join(str(port) for port in ports.values())
+    hosts, stats, done = _scan(["127.0.0.1"], "port", {"127.0.0.1": spec})
+    tcp = hosts["127.0.0.1"]["tcp"]
+    assert tcp[ports["banner"]]["state"] == "open"
+    assert tcp[ports["banner"]]["extrainfo"] == "SSH-2.0-OpenSSH_8.9"
+    assert tcp[ports["silent"]]["state"] == "open"
+    assert tcp[ports["silent"]]["extrainfo"] == ""
+    assert (tcp[ports["closed"]]["state"], tcp[ports["closed"]]["reason"]) == ("closed", "conn-refused")
+    assert (tcp[ports["filtered"]]["state"], tcp[ports["filtered"]]["reason"]) == ("filtered", "no-response")
+    assert stats == [{"elapsed": stats[0]["elapsed"], "uphosts": "1", "downhosts": "0", "totalhosts": "1"}]
+    assert done == ["127.0.0.1"]
+
+
+def test_banner_disabled(fast_scan, ports, monkeypatch):
+    monkeypatch.setattr(settings.netscan, "enable_banner", False)
+    hosts, _, _ = _scan(["127.0.0.1"], "port", {"127.0.0.1": str(ports["banner"])})
+    assert hosts["127.0.0.1"]["tcp"][ports["banner"]]["extrainfo"] == ""
+    hosts, _, _ = _scan(["127.0.0.1"], "banner", {"127.0.0.1": str(ports["banner"])})
+    assert hosts["127.0.0.1"]["tcp"][ports["banner"]]["extrainfo"] == "SSH-2.0-OpenSSH_8.9"
+
+
+def test_alive(fast_scan, ports, monkeypatch):
+    # closed端口的RST也说明主机存活，存活探测的结果中没有端口
+    monkeypatch.setattr(settings.netscan, "alive_ports", [ports["filtered"], ports["closed"]])
+    hosts, stats, done = _scan(["127.0.0.1"], "alive")
+    assert hosts["127.0.0.1"]["status"] == {"state": "up", "reason": "conn-refused"}
+    assert "tcp" not in hosts["127.0.0.1"]
+    assert stats[0]["uphosts"] == "1"
+    assert done == ["127.0.0.1"]
+
+
+def test_no_response_is_down(fast_scan, ports, monkeypatch):
+    monkeypatch.setattr(settings.netscan, "alive_ports", [ports["filtered"]])
+    hosts, stats, done = _scan(["127.0.0.1"], "alive")
+    assert hosts == dict()
+    assert (stats[0]["uphosts"], stats[0]["downhosts"]) == ("0", "1")
+    assert done == ["127.0.0.1"]
+
+
+def test_failed_target_not_done(fast_scan, ports):
+    # 没有可扫描端口的目标失败，不调用on_done，其他目标不受影响
+    hosts, _, done = _scan(["127.0.0.1", "127.0.0.2"], "port",
+                           {"127.0.0.1": str(ports["closed"]), "127.0.0.2": ""})
+    assert list(hosts) == ["127.0.0.1"]
+    assert done == ["127.0.0.1"]
+
+
+def test_many_closed_ports_collapsed(fast_scan):
+    # 与nmap的extraports相同，超过EXTRAPORTS_THRESHOLD个closed端口时不逐个列出
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    port = server.getsockname()[1]
+    try:
+        spec = f"{port},{port + 1}-{port + aioscan.EXTRAPORTS_THRESHOLD * 2}"
+        hosts, _, _ = _scan(["127.0.0.1"], "port", {"127.0.0.1": spec})
+    finally:
+        server.close()
+    assert hosts["127.0.0.1"]["tcp"][port]["state"] == "open"
+    assert all(info["state"] != "closed" for info in hosts["127.0.0.1"]["tcp"].values())
+
+
+def test_spread_visits_every_host_once():
+    hosts = list(aioscan._spread(100, 100 + 65535))
+    assert sorted(hosts) == list(range(100, 100 + 65536))
+    assert (hosts[1] - hosts[0]) >> 8 != 0
+    assert list(aioscan._spread(5, 9)) == [5, 6, 7, 8, 9]
+    assert aioscan._parse_ports("22, 80,8000-8002") == [22, 80, 8000, 8001, 8002]
@@ -0,0 +1,101 @@
+import pytest
+
+from airin import analysis
+from airin import netscan
+from airin import Database
+from airin.config import settings
+from airinscan import AirinScan
+
+
+def test_port_scan_caches_only_finished_chunks(tmp_db, fake_nmap, monkeypatch):
+    monkeypatch.setattr(analysis, "TARGETS_FILE_SIZE", 2)
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", False)
+    monkeypatch.setenv("FAKE_NMAP_FAIL", "10.0.0.3")
+    scan = AirinScan()
+    scan.reduce_datas = analysis.HostStore(dict())
+    db = Database()
+    db.start_job(dict())
+    scanned = scan.port_scan(db, ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"])
+    assert sorted(scanned) == ["10.0.0.1", "10.0.0.2"]
+    assert len(db.get_tasks("port", done=False)) == 1
+    db.close()
+
+
+def test_resume_scans_only_pending_chunks(tmp_db, monkeypatch):
+    monkeypatch.setattr(analysis, "TARGETS_FILE_SIZE", 2)
+    db = Database()
+    db.start_job(dict())
+    # 中断前：存活探测已完成，第一个端口扫描块已完成并写入临时表
+    db.add_tasks("alive", [["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]], done=True)
+    (first, _), _ = db.add_tasks("port", [["10.0.0.1", "10.0.0.2"], ["10.0.0.3", "10.0.0.4"]])
+    db.insert_table(settings.database.temp_table_name, [
+        ("10.0.0.0/24", ip, None, 22, "open", "syn-ack", "ssh", None, None, None, "3", None, None, None, None)
+        for ip in ("10.0.0.1", "10.0.0.2")])
+    db.finish_task(first)
+
+    def alive_scan(targets):
+        raise AssertionError("alive scan should not run again")
+
+    scanned = list()
+
+    def port_scan_iter(targets, on_done=None):
+        for target in targets:
+            ips = open(target).read().split()
+            scanned.extend(ips)
+            yield {ip: {"ports": {80: {"state": "open", "reason": "syn-ack", "name": "http"}}} for ip in ips}
+            on_done(target)
+    monkeypatch.setattr(netscan, "AliveScan", alive_scan)
+    monkeypatch.setattr(netscan, "PortScanIter", port_scan_iter)
+
+    scan = AirinScan()
+    scan.reduce_datas = analysis.HostStore({"10.0.0.0/24": dict()})
+    alive = scan.alive_scan(db)
+    assert alive == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    assert sorted(scan.port_scan(db, alive)) == alive
+    assert scanned == ["10.0.0.3", "10.0.0.4"]
+    assert db.get_tasks("port", done=False) == list()
+    # 已完成块的结果从临时表读回
+    ports = {(row["ip"], row["port"]) for row in scan.reduce_datas.rows()}
+    assert ports == {("10.0.0.1", 22), ("10.0.0.2", 22), ("10.0.0.3", 80), ("10.0.0.4", 80)}
+    db.close()
+
+
+def _seed(ips: list) -> None:
+    db = Database()
+    db.insert_table(settings.database.table_name, [
+        ("10.0.0.0/24", ip, None, port, "open", "syn-ack", "http", "nginx", "1.24", None, "10", None, None, None, 0)
+        for ip in ips for port in (22, 80)])
+    db.close()
+
+
+def _run_diff(tmp_db, *targets, pipeline: bool = False) -> list:
+    scan = AirinScan(*targets, filtr=False, req=False, fmt="csv", path=str(tmp_db), cutmask=False,
+                     pipeline=pipeline, diff=True)
+    scan.config_param()
+    scan.load_data()
+    scan.main()
+    path, = tmp_db.glob("diff_cidr_result*.csv")
+    header, *lines = open(path).read().splitlines()
+    fields = header.split(",")
+    return sorted((itm[fields.index("ip")], itm[fields.index("port")], itm[fields.index("change")])
+                  for itm in (line.split(",") for line in lines))
+
+
+def test_diff_no_alive_host_reports_lost_hosts(tmp_db, fake_nmap, monkeypatch):
+    monkeypatch.setenv("FAKE_NMAP_UP", "10.9.9.9")
+    _seed(["10.0.0.1", "10.0.0.2", "10.0.1.1"])
+    # 10.0.1.1不在本次扫描目标中
+    assert _run_diff(tmp_db, "10.0.0.1", "10.0.0.2") == [
+        ("10.0.0.1", "22", "lost_host"), ("10.0.0.1", "80", "lost_host"),
+        ("10.0.0.2", "22", "lost_host"), ("10.0.0.2", "80", "lost_host")]
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_diff_reports_down_hosts(tmp_db, fake_nmap, monkeypatch, pipeline):
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", False)
+    monkeypatch.setenv("FAKE_NMAP_UP", "10.0.0.1,10.0.0.3")
+    monkeypatch.setenv("FAKE_NMAP_OPEN", "80")
+    _seed(["10.0.0.1", "10.0.0.2"])
+    assert _run_diff(tmp_db, "10.0.0.1", "10.0.0.2", "10.0.0.3", pipeline=pipeline) == [
+        ("10.0.0.1", "22", "closed_port"), ("10.0.0.2", "22", "lost_host"), ("10.0.0.2", "80", "lost_host"),
+        ("10.0.0.3", "80", "new_host")]
@@ -0,0 +1,87 @@
+import pytest
+
+from airin import analysis
+from airin.config import settings
+
+
+def _write_csv(path, rows: int, late: int, encoding: str) -> None:
+    lines = ["ip,title"]
+    for i in range(rows):
+        title = "中文标题" if i >= late else "ascii"
+        lines.append(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255},{title}")
+    path.write_bytes("\n".join(lines).encode(encoding, errors="replace") + b"\n")
+
+
+def test_iter_file_late_gbk(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.analysis, "enable_dict_filtr", False)
+    path = tmp_path.joinpath("hosts.csv")
+    _write_csv(path, 30000, 25000, "gbk")
+    rows = [itm for chunk in analysis.iter_file(path, size=10000) for itm in chunk]
+    assert len(rows) == 30000
+    assert rows[-1]["title"] == "中文标题"
+    assert rows[0]["ip"] == "10.0.0.0"
+
+
+def test_iter_file_undecodable_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.analysis, "enable_dict_filtr", False)
+    path = tmp_path.joinpath("hosts.txt")
+    path.write_bytes(b"10.0.0.1\n" * 10000 + b"10.0.0.2\x80\xff\n")
+    with pytest.raises(UnicodeDecodeError):
+        list(analysis.iter_file(path, size=1000))
+
+
+def _scan_result() -> dict:
+    ports = {80: {"state": "open", "reason": "syn-ack", "name": "http", "product": "nginx", "version": "1.24"},
+             22: {"state": "open", "reason": "syn-ack", "name": "ssh"}}
+    return {"10.0.0.2": {"ports": ports}, "10.0.1.9": {"ports": {443: {"state": "open", "name": "https"}}},
+            "192.168.0.1": {"ports": {80: {"state": "open"}}}}
+
+
+def test_host_store_matches_nested_dict():
+    data = {"10.0.0.0/24": {"10.0.0.1": {"domain": "a.example.com"}}, "10.0.1.0/24": dict()}
+    store = analysis.HostStore(data)
+    data = {cidr: {ip: dict(info) for ip, info in ips.items()} for cidr, ips in data.items()}
+    results = dict()
+    for name, srcdata in (("dict", data), ("store", store)):
+        srcdata, _ = analysis.data_integration(srcdata, ["10.0.0.2", "10.0.1.9", "192.168.0.1"])
+        srcdata, conver = analysis.data_integration(srcdata, _scan_result())
+        srcdata, http = analysis.http_resp_integration(srcdata, [
+            {"cidr": "10.0.0.0/24", "ip": "10.0.0.2", "port": 80, "title": "t", "status": 200}])
+        results[name] = (sorted(conver, key=str), http, list(analysis.data_conversion(srcdata)))
+    assert results["store"] == results["dict"]
+    assert not isinstance(analysis.data_conversion(store), list)  # HostStore逐行生成，不展开全部结果
+    assert store.host_count() == 3
+    assert "192.168.0.1" not in [row["ip"] for row in results["store"][2]]
+
+
+def test_host_store_interns_and_reuses_records():
+    store = analysis.HostStore({"10.0.0.0/24": dict()})
+    store.integrate_alive(["10.0.0.1", "10.0.0.2"])
+    first = store.integrate_ports({"10.0.0.1": {"ports": {80: {"name": "".join(["ht", "tp"])}}},
+                                   "10.0.0.2": {"ports": {80: {"name": "".join(["ht", "tp"])}}}})
+    assert first[0][6] is first[1][6]
+    store.integrate_ports({"10.0.0.1": {"ports": {80: {"name": "https"}}}})
+    rows = list(store.rows())
+    assert len(rows) == 2 and rows[0]["name"] == "https"
+    assert store["10.0.0.0/24"] == ["10.0.0.1", "10.0.0.2"]
+    assert store.ip_ints("10.0.0.0/24") == [0x0A000001, 0x0A000002]
+
+
+def test_filtr_cdn_dict_and_str_rows():
+    starts, ends = settings.analysis.cdn_ip_ranges
+    inside = analysis.int_to_ip(starts[0])
+    field = settings.analysis.ip_field
+    assert analysis._filtr_cdn(["1.1.1.1", inside, "8.8.4.4"]) == ["1.1.1.1", "8.8.4.4"]
+    rows = [{field: "1.1.1.1"}, {field: f"1.1.1.2,{inside}"}, {field: "8.8.4.4"}]
+    assert analysis._filtr_cdn(rows) == [rows[0], rows[2]]
+
+
+def test_is_cdn_matches_json_cidrs():
+    import ipaddress
+    networks = [ipaddress.ip_network(cidr, strict=False) for cidr in settings.analysis.cdn_ip_cidr]
+    for network in networks[::25]:
+        assert analysis._is_cdn(str(network.network_address))
+        assert analysis._is_cdn(str(network))
+    # CIDR只有一部分位于CDN网段内时不过滤
+    widest = min(networks, key=lambda network: network.prefixlen)
+    assert not analysis._is_cdn(str(widest.supernet(new_prefix=max(0, widest.prefixlen - 4))))
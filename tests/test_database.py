@@ -0,0 +1,220 @@
+import time
+import sqlite3
+
+import pytest
+
+from airin import analysis
+from airin import export
+from airin import Database
+from airin.config import settings
+
+
+def _port_scan(ip: str, port: int) -> dict:
+    return {ip: {"ports": {port: {"state": "open", "reason": "syn-ack", "name": "http"}}}}
+
+
+def test_truncated_persisted_and_exported(tmp_db):
+    store = analysis.HostStore({"10.0.0.0/24": {"10.0.0.1": dict()}})
+    db = Database()
+    db.start_job(dict())
+    store, conver_data = analysis.data_integration(store, _port_scan("10.0.0.1", 80))
+    db.insert_table(settings.database.temp_table_name, conver_data)
+    store, conver_data = analysis.http_resp_integration(store, [
+        {"cidr": "10.0.0.0/24", "ip": "10.0.0.1", "port": 80, "title": "t", "status": 200, "truncated": True}])
+    db.update_HTTP_info(settings.database.temp_table_name, conver_data)
+    rows = list(db.iter_table(settings.database.temp_table_name))
+    assert rows[0]["truncated"] == 1
+    cached = db.get_cached_results(settings.database.temp_table_name, ["10.0.0.1"])
+    assert cached["10.0.0.1"]["ports"][80]["truncated"] == 1
+    db.close()
+
+    path = export.entrance(store, str(tmp_db), "csv")
+    header, row = open(path).read().splitlines()[:2]
+    assert header.split(",")[-1] == "truncated" and row.split(",")[-1] == "1"
+
+
+def test_migrate_flat_tables(tmp_db):
+    connect = sqlite3.connect(settings.database.db_path)
+    for table_name, title in ((settings.database.table_name, "old"), (settings.database.temp_table_name, "new")):
+        connect.execute(f"""create table {table_name} (id INTEGER PRIMARY KEY AUTOINCREMENT, cidr TEXT NOT NULL,
+            ip TEXT, domain TEXT, port INT, state TEXT, reason TEXT, name TEXT, product TEXT, version TEXT,
+            extrainfo TEXT, conf TEXT, cpe TEXT, title TEXT, status INT)""")
+        connect.execute(f"insert into {table_name} values (NULL, {', '.join('?' * 14)})",
+                        ("10.0.0.0/24", "10.0.0.1", None, 80, "open", "syn-ack", "http", "nginx", "1.24", None, "10",
+                         None, title, 200))
+    connect.commit()
+    connect.close()
+    db = Database()
+    assert db.exec("pragma user_version") == [(4,)]
+    assert [(itm["title"], itm["truncated"]) for itm in db.iter_table(settings.database.table_name)] == [("old", None)]
+    assert [itm["title"] for itm in db.iter_table(settings.database.temp_table_name)] == ["new"]
+    assert db.exec(f"select count(*) from {settings.database.table_name}_V1") == [(1,)]
+    assert "truncated" in db.table_fields("HTTP") and "args" in db.table_fields("SCAN")
+    db.close()
+
+
+def test_exec_errors_propagate(tmp_db):
+    db = Database()
+    with pytest.raises(sqlite3.OperationalError):
+        db.exec("select * from NOT_A_TABLE")
+    db.close()
+
+
+def test_failed_migration_rolls_back(tmp_db):
+    connect = sqlite3.connect(settings.database.db_path)
+    # 缺少cpe等字段的旧表，迁移时复制数据会出错
+    connect.execute(f"create table {settings.database.table_name} (id INTEGER PRIMARY KEY, cidr TEXT, ip TEXT)")
+    connect.execute(f"insert into {settings.database.table_name} (cidr, ip) values ('10.0.0.0/24', '10.0.0.1')")
+    connect.commit()
+    connect.close()
+    with pytest.raises(sqlite3.OperationalError):
+        Database()
+    connect = sqlite3.connect(settings.database.db_path)
+    tables = [name for name, in connect.execute("select name from sqlite_master where type='table'")]
+    assert settings.database.table_name in tables and "PORT" not in tables
+    connect.close()
+
+
+def test_update_http_info_user_table(tmp_db):
+    db = Database()
+    db.exec("create table LEGACY (id INTEGER PRIMARY KEY, ip TEXT, port INT, title TEXT, status INT)")
+    db.exec("insert into LEGACY (ip, port) values ('10.0.0.1', 80)")
+    db.update_HTTP_info("LEGACY", [("t", 200, 1, "10.0.0.1", 80)])
+    assert db.exec("select title, status from LEGACY") == [("t", 200)]
+    db.close()
+
+
+def test_insert_main_table_reuses_scan(tmp_db):
+    store = analysis.HostStore({"10.0.0.0/24": {"10.0.0.1": dict(), "10.0.0.2": dict()}})
+    db = Database()
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        store, conver_data = analysis.data_integration(store, _port_scan(ip, 80))
+        db.insert_table(settings.database.table_name, conver_data)
+    assert db.exec("select count(*) from SCAN where merged=1") == [(1,)]
+    assert len(list(db.iter_table(settings.database.table_name))) == 2
+    db.close()
+
+
+def test_prune_suspended_jobs(tmp_db, monkeypatch):
+    store = analysis.HostStore({"10.0.0.0/24": {"10.0.0.1": dict()}})
+    db = Database()
+    old = db.start_job(dict())
+    store, conver_data = analysis.data_integration(store, _port_scan("10.0.0.1", 80))
+    db.insert_table(settings.database.temp_table_name, conver_data)
+    db.add_tasks("port", [["10.0.0.1"]], done=True)
+    recent = db.start_job(dict())
+    assert [job[0] for job in db.list_jobs()] == [old, recent]
+    db.exec("update SCAN set created_at=? where id=?", (time.time() - settings.database.suspended_ttl - 1, old))
+    db.start_job(dict())
+    assert old not in [job[0] for job in db.list_jobs()]
+    assert recent in [job[0] for job in db.list_jobs()]
+    assert db.exec("select count(*) from PORT") == [(0,)]
+    assert db.exec("select count(*) from TASK") == [(0,)]
+    db.close()
+
+
+def test_show_lists_views(tmp_db, monkeypatch):
+    import standby_control
+    names = list()
+    monkeypatch.setattr(standby_control.logger, "log", lambda level, message: names.append(message))
+    control = standby_control.Control()
+    control.show()
+    control.db.close()
+    assert f"View name: {settings.database.table_name}" in names
+    assert f"View name: {settings.database.temp_table_name}" in names
+    assert "Table name: PORT" in names
+
+
+def _row(ip: str, port: int, title: str) -> tuple:
+    return ("10.0.0.0/24", ip, None, port, "open", "syn-ack", "http", None, None, None, None, None, title, 200, 0)
+
+
+def test_merge_temp_upserts_rescanned_ports(tmp_db):
+    db = Database()
+    db.insert_table(settings.database.table_name, [_row("10.0.0.1", 80, "old"), _row("10.0.0.2", 80, "kept")])
+    db.start_job(dict())
+    db.insert_table(settings.database.temp_table_name, [_row("10.0.0.1", 80, "new"), _row("10.0.0.3", 22, None)])
+    db.merging_table(settings.database.temp_table_name, settings.database.table_name)
+    rows = sorted((itm["ip"], itm["port"], itm["title"]) for itm in db.iter_table(settings.database.table_name))
+    assert rows == [("10.0.0.1", 80, "new"), ("10.0.0.2", 80, "kept"), ("10.0.0.3", 22, None)]
+    assert list(db.iter_table(settings.database.temp_table_name)) == list()
+    assert db.get_tasks("port") == list()
+    db.close()
+
+
+def test_merge_flat_table(tmp_db):
+    db = Database()
+    db.insert_table(settings.database.table_name, [_row("10.0.0.1", 80, "old")])
+    db.exec("""create table LEGACY (id INTEGER PRIMARY KEY, cidr TEXT, ip TEXT, domain TEXT, port INT,
+        state TEXT, reason TEXT, name TEXT, product TEXT, version TEXT, extrainfo TEXT, conf TEXT, cpe TEXT,
+        title TEXT, status INT)""")
+    db.execmany(f"insert into LEGACY values (NULL, {', '.join('?' * 14)})",
+                [_row("10.0.0.1", 80, "new")[:14], _row("10.0.0.4", 443, "flat")[:14]])
+    db.merging_table("LEGACY", settings.database.table_name)
+    rows = sorted((itm["ip"], itm["port"], itm["title"], itm["truncated"])
+                  for itm in db.iter_table(settings.database.table_name))
+    assert rows == [("10.0.0.1", 80, "new", None), ("10.0.0.4", 443, "flat", None)]
+    assert db.exec("select count(*) from LEGACY") == [(0,)]
+    db.close()
+
+
+def test_merge_failure_rolls_back(tmp_db, monkeypatch):
+    db = Database()
+    db.insert_table(settings.database.table_name, [_row("10.0.0.1", 80, "old")])
+    db.start_job(dict())
+    db.insert_table(settings.database.temp_table_name, [_row("10.0.0.1", 80, "new")])
+
+    def broken(scans):
+        db.cursor.execute("select * from NOT_A_TABLE")
+    monkeypatch.setattr(db, "_drop_superseded", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        db.merging_table(settings.database.temp_table_name, settings.database.table_name)
+    assert [itm["title"] for itm in db.iter_table(settings.database.table_name)] == ["old"]
+    assert [itm["title"] for itm in db.iter_table(settings.database.temp_table_name)] == ["new"]
+    db.close()
+
+
+def _service(ip: str, port: int, state: str = "open", product: str = "nginx", version: str = "1.24",
+             title: str = None) -> tuple:
+    return ("10.0.0.0/24", ip, None, port, state, "syn-ack", "http", product, version, None, "10", None, title, 200, 0)
+
+
+def _diff(tmp_db) -> list:
+    db = Database()
+    db.insert_table(settings.database.table_name, [
+        _service("10.0.0.1", 80, title="Old"), _service("10.0.0.1", 22, product="OpenSSH", version="8.9"),
+        _service("10.0.0.1", 443), _service("10.0.0.2", 80), _service("10.0.0.4", 8080, version="1.22"),
+        _service("10.0.0.5", 80)])
+    db.start_job(dict())
+    db.insert_table(settings.database.temp_table_name, [
+        _service("10.0.0.1", 80, version="1.25", title="New"), _service("10.0.0.1", 22, product="OpenSSH", version="8.9"),
+        _service("10.0.0.1", 8443), _service("10.0.0.2", 80, state="closed"), _service("10.0.0.3", 80)])
+    rows = db.diff_table(settings.database.temp_table_name, settings.database.table_name,
+                         ["10.0.0.1", "10.0.0.2", "10.0.0.3"], ["10.0.0.4"])
+    db.close()
+    return rows
+
+
+def test_diff_table(tmp_db):
+    changes = {(itm["ip"], itm["port"]): itm for itm in _diff(tmp_db)}
+    # 10.0.0.1:22没有变化，10.0.0.5既没有扫描也不在未存活主机中
+    assert sorted(changes) == [("10.0.0.1", 80), ("10.0.0.1", 443), ("10.0.0.1", 8443), ("10.0.0.2", 80),
+                               ("10.0.0.3", 80), ("10.0.0.4", 8080)]
+    expected = {
+        ("10.0.0.1", 80): ("changed", "open", "1.25", "New", "nginx", "1.24", "Old"),
+        ("10.0.0.1", 443): ("closed_port", "closed", "1.24", None, "nginx", "1.24", None),
+        ("10.0.0.1", 8443): ("open_port", "open", "1.24", None, None, None, None),
+        ("10.0.0.2", 80): ("closed_port", "closed", "1.24", None, "nginx", "1.24", None),
+        ("10.0.0.3", 80): ("new_host", "open", "1.24", None, None, None, None),
+        ("10.0.0.4", 8080): ("lost_host", None, "1.22", None, "nginx", "1.22", None)}
+    for key, row in changes.items():
+        assert (row["change"], row["state"], row["version"], row["title"],
+                row["old_product"], row["old_version"], row["old_title"]) == expected[key]
+
+
+def test_diff_entrance(tmp_db):
+    path = export.diff_entrance(_diff(tmp_db), str(tmp_db), "csv")
+    lines = open(path).read().splitlines()
+    assert lines[0].split(",") == export.DIFF_FIELDS
+    changes = sorted(line.split(",")[export.DIFF_FIELDS.index("change")] for line in lines[1:])
+    assert changes == ["changed", "closed_port", "closed_port", "lost_host", "new_host", "open_port"]
@@ -0,0 +1,87 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from airin import export
+from airin import Database
+from airin.config import settings
+
+
+def _rows(count: int) -> list:
+    return [{"cidr": f"10.0.{i // 100}.0/24", "ip": f"10.0.{i // 100}.{i % 100}", "port": 80,
+             "state": "open", "name": "http" if i % 2 else None} for i in range(count)]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "json", "ndjson", "csv.gz", "json.gz", "ndjson.gz"])
+def test_text_formats_stream_generator(tmp_path, fmt):
+    rows = [dict(itm, truncated=0) for itm in _rows(300)]
+    consumed = list()
+
+    def generate():
+        for itm in rows:
+            consumed.append(itm)
+            yield itm
+    filepath = export.entrance(generate(), str(tmp_path), fmt, field=list(rows[0]))
+    assert filepath.endswith(f".{fmt}") and len(consumed) == 300
+    opener = gzip.open if fmt.endswith(".gz") else open
+    with opener(filepath, "rt", encoding=settings.export.result_save_encode, newline="") as file:
+        if fmt.startswith("csv"):
+            loaded = list(csv.DictReader(file))
+            assert [itm["ip"] for itm in loaded] == [itm["ip"] for itm in rows]
+            assert loaded[0]["name"] == "" and loaded[1]["name"] == "http"
+        elif fmt.startswith("ndjson"):
+            assert [json.loads(line) for line in file] == rows
+        else:
+            assert json.load(file) == rows
+
+
+def test_export_from_database_cursor(tmp_db):
+    db = Database()
+    db.exec("create table RESULT (ip TEXT, port INT)")
+    db.execmany("insert into RESULT values (?, ?)", [(f"10.0.0.{i}", 80) for i in range(25)])
+    db.connect.commit()
+    # 每次只从游标读取10行
+    filepath = export.entrance(db.iter_table("RESULT", size=10), str(tmp_db), "ndjson", field=db.table_fields("RESULT"))
+    db.close()
+    assert [json.loads(line) for line in open(filepath)] == [{"ip": f"10.0.0.{i}", "port": 80} for i in range(25)]
+
+
+def test_dictionary_values_converted_once(monkeypatch):
+    pyarrow = pytest.importorskip("pyarrow")
+    converted = list()
+    array = export.pyarrow.array
+
+    def counting(values, kind=None, *args, **kwargs):
+        if kind == pyarrow.string():
+            converted.extend(values)
+        return array(values, kind, *args, **kwargs)
+    monkeypatch.setattr(export.pyarrow, "array", counting)
+    batches = list(export._RecordBatches(["cidr", "ip"], size=50)(_rows(1000)))
+    assert len(batches) == 20
+    # 每个批次只转换新出现的cidr，而不是重建整个字典
+    cidrs = [value for value in converted if value.endswith("/24")]
+    assert len(cidrs) == 10
+    assert batches[-1].column(0).dictionary.to_pylist() == [f"10.0.{i}.0/24" for i in range(10)]
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_columnar_roundtrip(tmp_path, monkeypatch, fmt):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    # 每50行一个批次，字典在批次间增长
+    monkeypatch.setattr(export._RecordBatches.__init__, "__defaults__", (50,))
+    rows = _rows(1000)
+    field = ["cidr", "ip", "port", "state", "name"]
+    filepath = str(tmp_path.joinpath(f"result.{fmt}"))
+    getattr(export, f"{fmt}_report")(rows, filepath, field)
+    if fmt == "arrow":
+        with pyarrow.ipc.open_file(filepath) as reader:
+            assert reader.num_record_batches == 20
+            table = reader.read_all()
+    else:
+        table = pyarrow.parquet.read_table(filepath)
+    assert table.num_rows == 1000
+    assert table.column("cidr").to_pylist() == [itm["cidr"] for itm in rows]
+    assert table.column("name").to_pylist() == [itm["name"] for itm in rows]
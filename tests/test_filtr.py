@@ -0,0 +1,48 @@
+import pytest
+
+from airin import analysis
+from airin.config import settings
+from airin.filtr import RowFilter
+
+ROWS = [{"level": "1", "cdn": "0", "title": "Admin Login"}, {"level": "2", "cdn": "1", "title": "nginx"},
+        {"level": "10", "cdn": "0", "title": "admin panel"}, {"level": "", "cdn": "0"}]
+
+
+@pytest.mark.parametrize("rule, expected", [
+    ({"field": "level", "operator": "<=", "value": "2"}, [0, 1]),  # 按数值比较，"10" > "2"
+    ({"field": "level", "operator": ">", "value": 2}, [2]),
+    ({"field": "cdn", "operator": "==", "value": "0"}, [0, 2, 3]),
+    ({"field": "level", "operator": "!=", "value": "1"}, [1, 2, 3]),
+    ({"field": "level", "operator": "in", "value": "1,10"}, [0, 2]),
+    ({"field": "level", "operator": "not in", "value": [1, 10]}, [1, 3]),
+    ({"field": "title", "operator": "regex", "value": "(?i)^admin"}, [0, 2]),
+    ({"field": "title", "operator": "==", "value": "nginx"}, [1]),
+    ({"field": "title", "operator": "!=", "value": "nginx"}, [0, 2, 3]),
+])
+def test_rule_semantics(rule, expected):
+    row_filter = RowFilter([rule])
+    assert [i for i, itm in enumerate(ROWS) if row_filter(itm)] == expected
+    assert row_filter.apply(ROWS) == [ROWS[i] for i in expected]
+
+
+def test_rules_combined_with_and():
+    row_filter = RowFilter([{"field": "cdn", "operator": "==", "value": 0},
+                            {"field": "level", "operator": "<=", "value": "2"}])
+    assert row_filter.apply(ROWS) == [ROWS[0]]
+    assert RowFilter().apply(ROWS) == ROWS
+
+
+@pytest.mark.parametrize("rule", [{"field": "level", "operator": "~=", "value": "1"},
+                                  {"operator": "==", "value": "1"}])
+def test_bad_rule_raises(rule):
+    with pytest.raises(ValueError):
+        RowFilter([rule])
+
+
+def test_bad_rule_passes_rows_through(monkeypatch):
+    monkeypatch.setattr(settings.analysis, "enable_dict_filtr", True)
+    monkeypatch.setattr(settings.analysis, "dict_filtr_arguments", [{"field": "level", "operator": "~="}])
+    monkeypatch.setattr(settings.analysis, "dict_filtr", None)
+    settings._analysis_compile_filtr()
+    assert settings.analysis.dict_filtr is None
+    assert analysis._data_filtr(ROWS) == ROWS
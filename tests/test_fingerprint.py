@@ -0,0 +1,92 @@
+import socket
+import threading
+
+import pytest
+
+from airin import netscan
+from airin import fingerprint
+from airin import Database
+from airin.config import settings
+
+
+@pytest.fixture
+def banner_server():
+    """
+    接受连接后立即发送SSH banner，监听所有地址以便127.0.0.x都能连接，返回端口
+    """
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("0.0.0.0", 0))
+    server.listen(64)
+
+    def serve():
+        while True:
+            try:
+                conn, addr = server.accept()
+            except OSError:
+                return None
+            try:
+                conn.sendall(b"SSH-2.0-OpenSSH_8.9\r\n")
+            except OSError:
+                pass
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def two_phase(tmp_db, fake_nmap, monkeypatch, banner_server):
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", True)
+    monkeypatch.setattr(settings.netscan, "backend", "nmap")
+    monkeypatch.setattr(settings.database, "enable_fingerprint", True)
+    monkeypatch.setattr(settings.netscan, "arguments_discovery", f"-p{banner_server} -T4 -n -Pn --open")
+    monkeypatch.setenv("FAKE_NMAP_OPEN", str(banner_server))
+    yield fake_nmap
+    fingerprint.save()
+
+
+def _version_scans(log) -> int:
+    return sum(1 for line in log.read_text().splitlines() if "-sV" in line)
+
+
+@pytest.mark.parametrize("info, cached", [
+    ({"name": "ssh", "product": "OpenSSH", "conf": "10"}, True),
+    ({"name": "unknown", "conf": "10"}, False),
+    ({"name": "tcpwrapped", "conf": "8"}, False),
+    ({"name": "", "conf": "10"}, False),
+    ({"name": "ssh", "conf": "3"}, False),
+])
+def test_put_skips_unusable_results(tmp_db, info, cached):
+    cache = fingerprint.FingerprintCache()
+    assert cache.put("key", info) is cached
+    assert (cache.resolve("key") is not None) is cached
+
+
+def test_cache_shared_across_batches(two_phase, monkeypatch):
+    monkeypatch.setenv("FAKE_NMAP_SERVICE", "ssh,OpenSSH,8.9")
+    db = Database()
+    fingerprint.load(db)
+    monkeypatch.setattr(fingerprint, "Database", None)  # 批次中不应再打开数据库
+    first = list(netscan.PortScanIter(["127.0.0.1"]))
+    second = list(netscan.PortScanIter(["127.0.0.2"]))
+    assert _version_scans(two_phase) == 1
+    assert list(first[0]["127.0.0.1"]["ports"].values())[0]["product"] == "OpenSSH"
+    assert list(second[0]["127.0.0.2"]["ports"].values())[0]["product"] == "OpenSSH"
+    assert fingerprint.shared().hits == 1
+    fingerprint.save(db)
+    assert len(db.get_fingerprints()) == 1
+    db.close()
+
+
+def test_tcpwrapped_not_cached(two_phase, monkeypatch):
+    monkeypatch.setenv("FAKE_NMAP_SERVICE", "tcpwrapped,,")
+    db = Database()
+    fingerprint.load(db)
+    list(netscan.PortScanIter(["127.0.0.1"]))
+    list(netscan.PortScanIter(["127.0.0.2"]))
+    assert _version_scans(two_phase) == 2  # 每个批次都只识别一次，结果不缓存
+    fingerprint.save(db)
+    assert len(db.get_fingerprints()) == 0
+    db.close()
@@ -0,0 +1,75 @@
+import random
+import ipaddress
+
+import pytest
+
+from airin import analysis
+from airin.iptools import CidrIndex, coalesce, int_to_ip, ip_to_int, parse_target
+
+
+def test_cidr_index_longest_prefix():
+    index = CidrIndex(["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "bad"])
+    assert index.lookup("10.1.2.3") == "10.1.2.0/24"
+    assert index.lookup("10.1.3.3") == "10.1.0.0/16"
+    assert index.lookup("10.2.0.1") == "10.0.0.0/8"
+    assert index.lookup("11.0.0.1") is None
+
+
+def test_cidr_index_matches_linear_scan():
+    rand = random.Random(1)
+    cidrs = [f"{int_to_ip(rand.randrange(1 << 32) & ~((1 << (32 - prefix)) - 1))}/{prefix}"
+             for prefix in [rand.randint(8, 28) for i in range(300)]]
+    networks = [ipaddress.ip_network(cidr) for cidr in cidrs]
+    index = CidrIndex(cidrs)
+    for i in range(2000):
+        ip = ipaddress.ip_address(rand.randrange(1 << 32) if i % 2 else
+                                  int(rand.choice(networks).network_address) + rand.randrange(16))
+        matches = [network for network in networks if ip in network]
+        expected = str(max(matches, key=lambda network: network.prefixlen)) if matches else None
+        assert index.lookup(str(ip)) == expected
+
+
+def test_distribution_assigns_longest_prefix():
+    ip_dict = {"10.1.2.3": {"a.example.com": None}, "10.9.0.1": dict(), "192.168.1.7": {"b.example.com": None}}
+    results = analysis._distribution(ip_dict, {"10.0.0.0/8": dict(), "10.1.2.0/24": dict()})
+    assert results["10.1.2.0/24"] == {"10.1.2.3": {"domain": "a.example.com"}}
+    assert results["10.0.0.0/8"] == {"10.9.0.1": {"domain": ""}}
+    # 不属于任何CIDR的IP归入其所在的/24
+    assert results["192.168.1.0/24"] == {"192.168.1.7": {"domain": "b.example.com"}}
+
+
+@pytest.mark.parametrize("target, expected", [
+    ("10.0.0.1", ("10.0.0.1", "10.0.0.1")),
+    (" 10.0.0.1/24 ", ("10.0.0.0", "10.0.0.255")),
+    ("10.0.0.0/0", ("0.0.0.0", "255.255.255.255")),
+    ("10.0.0.5-20", ("10.0.0.5", "10.0.0.20")),
+    ("10.0.0.250-10.0.1.5", ("10.0.0.250", "10.0.1.5")),
+])
+def test_parse_target(target, expected):
+    assert parse_target(target) == (4, ip_to_int(expected[0]), ip_to_int(expected[1]))
+
+
+def test_parse_target6():
+    assert parse_target("2001:db8::/126") == (6, int(ipaddress.ip_address("2001:db8::")),
+                                              int(ipaddress.ip_address("2001:db8::3")))
+
+
+@pytest.mark.parametrize("target", ["999.1.1.1", "01.2.3.4", "1.2.3", "/33", "1.2.3.4/33", "1.2.3.4/",
+                                    "1.2.3.4/-1", "1.2.3.4/ 8", "1.2.3.4-300", "1.2.3.4-", "1.2.3.20-10",
+                                    "1.2.3.4-1.2.3.3", "2001:db8::9-2001:db8::1", "example.com", ""])
+def test_parse_target_rejects(target):
+    with pytest.raises(ValueError):
+        parse_target(target)
+
+
+def test_coalesce_merges_nested_targets():
+    targets = ["10.0.0.0/24", "10.0.0.128/25", "10.0.0.7", "10.0.0.0/24", "10.0.0.200-10.0.1.3",
+               "192.168.1.1", "192.168.1.1/32", "bad", "999.1.1.1", "2001:db8::/64", "2001:db8::1"]
+    assert coalesce(targets) == ["10.0.0.0/24", "10.0.1.0/30", "192.168.1.1/32", "2001:db8::/64"]
+
+
+def test_coalesce_adjacent():
+    # 默认保留相邻的子网，adjacent为True时合并为最少的CIDR
+    assert coalesce(["10.0.1.0/24", "10.0.0.0/24"]) == ["10.0.0.0/24", "10.0.1.0/24"]
+    assert coalesce(["10.0.1.0/24", "10.0.0.0/24"], adjacent=True) == ["10.0.0.0/23"]
+    assert coalesce(["10.0.0.1-10.0.0.6"]) == ["10.0.0.1/32", "10.0.0.2/31", "10.0.0.4/31", "10.0.0.6/32"]
@@ -0,0 +1,149 @@
+import time
+import pathlib
+
+import pytest
+
+from airin import analysis
+from airin import netscan
+from airin.config import settings
+from airin.iptools import int_to_ip, parse_target
+
+
+def _calls(log: pathlib.Path) -> list:
+    return log.read_text().splitlines() if log.exists() else list()
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_scan_pool_results(fake_nmap, monkeypatch, stream):
+    monkeypatch.setattr(settings.netscan, "enable_stream", stream)
+    monkeypatch.setenv("FAKE_NMAP_UP", "10.0.0.1,10.0.1.1")
+    done = list()
+    targets = ["10.0.0.0/30", "10.0.1.0/30"]
+    hosts = set()
+    for target, data in netscan._ScanPool(targets, "port", on_done=done.append):
+        hosts.update(data["scan"])
+        for host, info in data["scan"].items():
+            assert sorted(info["tcp"]) == [22, 80]
+    assert hosts == {"10.0.0.1", "10.0.1.1"}
+    assert sorted(done) == targets
+
+
+def test_scan_pool_failed_target_not_done(fake_nmap, monkeypatch):
+    monkeypatch.setenv("FAKE_NMAP_FAIL", "10.0.1.0/30")
+    done = list()
+    list(netscan._ScanPool(["10.0.0.0/30", "10.0.1.0/30"], "port", on_done=done.append))
+    assert done == ["10.0.0.0/30"]
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_scan_pool_close_cancels(fake_nmap, monkeypatch, stream):
+    monkeypatch.setattr(settings.netscan, "enable_stream", stream)
+    monkeypatch.setattr(settings.netscan, "process_count", 4)
+    monkeypatch.setenv("FAKE_NMAP_SLEEP", "2")
+    targets = [f"10.0.{i}.1" for i in range(12)]
+    gen = netscan._ScanPool(targets, "alive")
+    next(gen)
+    begin = time.time()
+    gen.close()
+    assert time.time() - begin < 1
+    time.sleep(2.5)  # 被取消的目标不应在之后启动
+    assert len(_calls(fake_nmap)) < 12
+
+
+@pytest.mark.parametrize("two_phase", [False, True])
+def test_custom_ports_joined(monkeypatch, two_phase):
+    monkeypatch.setattr(settings.netscan, "enable_custom_ports", True)
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", two_phase)
+    monkeypatch.setattr(settings.netscan, "ports", [22, 8080])
+    monkeypatch.setattr(settings.netscan, "arguments_port", "-T4 -sV -n")
+    monkeypatch.setattr(settings.netscan, "arguments_discovery", "-T4 -n -Pn --open")
+    settings._netscan_join_ports()
+    joined = settings.netscan.arguments_discovery if two_phase else settings.netscan.arguments_port
+    other = settings.netscan.arguments_port if two_phase else settings.netscan.arguments_discovery
+    assert joined.startswith("-p22,8080 ")
+    assert "-p" not in other
+
+
+def test_two_phase_off_by_default():
+    from airin.config import setting
+    assert setting.netscan.enable_two_phase is False
+
+
+def _stub_pool(open_ports: dict, calls: list, fail: str = None):
+    """
+    代替_ScanPool的扫描器，不运行nmap：目标文件按行读取，IP/CIDR展开为主机，
+    只返回open_ports中记录的开放端口，指定ports时只返回其中的端口，版本识别阶段的端口带有product；
+    每次调用以(stype, {主机: 扫描的端口列表字符串})记录到calls
+    """
+    def pool(targets: list, stype: str = "alive", on_done=None, ports: dict = None):
+        ports = ports or dict()
+        scanned = dict()
+        for target in targets:
+            path = pathlib.Path(str(target))
+            hosts = path.read_text().split() if path.suffix == ".txt" else None
+            if hosts is None:
+                _, start, end = parse_target(str(target))
+                hosts = [int_to_ip(i) for i in range(start, end + 1)]
+            for host in hosts:
+                scanned[host] = ports.get(str(target))
+            if target == fail:
+                continue
+            scan = dict()
+            for host in hosts:
+                found = [port for port in open_ports.get(host, ())
+                         if ports.get(str(target)) is None or str(port) in ports[str(target)].split(",")]
+                tcp = {port: {"state": "open", "product": f"svc{port}" if stype == "port" else ""} for port in found}
+                if tcp:
+                    scan[host] = {"tcp": tcp}
+            yield target, {"scan": scan}
+            if on_done is not None:
+                on_done(target)
+        calls.append((stype, scanned))
+    return pool
+
+
+def test_two_phase_scans_versions_on_discovered_ports(tmp_db, monkeypatch):
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", True)
+    monkeypatch.setattr(settings.netscan, "backend", "nmap")
+    monkeypatch.setattr(settings.database, "enable_fingerprint", False)
+    open_ports = {"10.0.0.1": [22, 80], "10.0.0.2": [22, 80], "10.0.0.3": [443], "10.0.1.1": [8080]}
+    calls = list()
+    monkeypatch.setattr(netscan, "_ScanPool", _stub_pool(open_ports, calls, fail="10.0.2.0/30"))
+    done = list()
+    result = dict()
+    for data in netscan.PortScanIter(["10.0.0.0/30", "10.0.1.0/30", "10.0.2.0/30"], on_done=done.append):
+        result.update(data)
+
+    assert [stype for stype, _ in calls] == ["discovery", "port"]
+    # 发现阶段扫描所有主机，版本识别阶段只扫描有开放端口的主机及其开放端口
+    assert calls[0][1] == {f"10.0.{i}.{j}": None for i in range(3) for j in range(4)}
+    assert calls[1][1] == {"10.0.0.1": "22,80", "10.0.0.2": "22,80", "10.0.0.3": "443", "10.0.1.1": "8080"}
+    assert {host: sorted(info["ports"]) for host, info in result.items()} == open_ports
+    assert all(port["product"] == f"svc{number}" for info in result.values() for number, port in info["ports"].items())
+    # 发现阶段失败的目标不记录为完成
+    assert sorted(done) == ["10.0.0.0/30", "10.0.1.0/30"]
+    assert list(tmp_db.glob("*.txt")) == list()
+
+
+@pytest.mark.parametrize("two_phase", [False, True])
+def test_targets_files_removed(tmp_db, fake_nmap, monkeypatch, two_phase):
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", two_phase)
+    monkeypatch.setattr(settings.database, "enable_fingerprint", False)
+    files = analysis.create_targets_file(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    try:
+        hosts = [host for data in netscan.PortScanIter(files) for host in data]
+    finally:
+        analysis.remove_targets_files(files)
+    assert sorted(hosts) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    # 两阶段扫描时_service_groups写入的目标文件也要删除
+    assert sorted(path.name for path in tmp_db.glob("*.txt")) == list()
+
+
+def test_remove_targets_files_keeps_other_files(tmp_db, tmp_path_factory):
+    user_file = tmp_path_factory.mktemp("user").joinpath("targets.txt")
+    user_file.write_text("10.0.0.1\n")
+    planned = analysis.plan_targets(["10.0.0.0/16"], {"10.0.0.0/16": ["10.0.1.1", "10.0.9.1"]}, minmask=20, unit=256)
+    assert any(pathlib.Path(target).exists() for target in planned)
+    analysis.remove_targets_files(planned + [str(user_file), "10.0.0.0/24"])
+    assert not any(pathlib.Path(target).exists() for target in planned)
+    assert user_file.exists()
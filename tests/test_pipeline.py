@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from airin import analysis
+from airin import aiorequest
+from airin import netscan
+from airin import request
+from airin import Database
+from airin.config import settings
+from airin.pipeline import Pipeline
+
+
+def test_failed_hosts_not_marked_scanned(tmp_db, fake_nmap, monkeypatch):
+    monkeypatch.setattr(analysis, "TARGETS_FILE_SIZE", 1)
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", False)
+    monkeypatch.setattr(settings.database, "enable_cache", True)
+    monkeypatch.setenv("FAKE_NMAP_UP", "10.0.0.1,10.0.0.2")
+    monkeypatch.setenv("FAKE_NMAP_FAIL", "10.0.0.2")
+    db = Database()
+    db.start_job(dict())
+    pipeline = Pipeline(analysis.HostStore(dict()), db, req=False)
+    pipeline.run(["10.0.0.0/30"])
+    assert pipeline.scanned == ["10.0.0.1"]
+    assert [ips for task_id, ips in db.get_tasks("port", done=True)] == [["10.0.0.1"]]
+    assert db.get_fresh_hosts(netscan.port_scan_key()) == {"10.0.0.1"}
+    db.close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_http_uses_request_engine(tmp_db, fake_nmap, monkeypatch, engine):
+    monkeypatch.setattr(settings.netscan, "enable_two_phase", False)
+    monkeypatch.setattr(settings.request, "engine", engine)
+    monkeypatch.setattr(settings.request, "enable_proxy", False)
+    monkeypatch.setattr(settings.request, "parse_process_count", 1)
+    monkeypatch.setenv("FAKE_NMAP_UP", "10.0.0.1,10.0.0.2")
+    monkeypatch.setenv("FAKE_NMAP_OPEN", "80")
+    parsers = list()
+
+    def get_resp_info(resp, parser=None):
+        parsers.append(parser)
+        return "thread", 200, False
+
+    def bulk_request(targets, progress=True):
+        assert not progress
+        return [dict(cidr=itm["cidr"], ip=itm["ip"], port=itm["port"], title="asyncio", status=200, truncated=False)
+                for itm in targets]
+    monkeypatch.setattr(request, "get_resp", lambda url, session: object())
+    monkeypatch.setattr(request, "get_resp_info", get_resp_info)
+    monkeypatch.setattr(aiorequest, "bulk_request", bulk_request)
+    db = Database()
+    db.start_job(dict())
+    pipeline = Pipeline(analysis.HostStore({"10.0.0.0/30": dict()}), db, req=True)
+    store = pipeline.run(["10.0.0.0/30"])
+    db.close()
+    assert sorted((row["ip"], row["title"]) for row in store.rows()) == [("10.0.0.1", engine), ("10.0.0.2", engine)]
+    if engine == "thread":
+        # 与request.bulk_request相同，开启parse_process_count时在进程池中解析标题
+        assert len(parsers) == 2 and all(isinstance(itm, ProcessPoolExecutor) for itm in parsers)
+    else:
+        assert parsers == list()
@@ -0,0 +1,115 @@
+import time
+import socket
+import struct
+import threading
+from collections import Counter
+
+import pytest
+
+from airin import netscan
+from airin import request
+from airin.config import settings
+from airin.ratelimit import Scheduler
+
+WINDOW = 0.2  # 服务器按该时长统计连接数
+THRESHOLD = 20  # 每个统计时长内超过该数量的连接被重置，即100个/秒
+
+
+class _Limits(object):
+    enable = True
+    global_rate = 2000
+    cidr_rate = 0
+    min_rate = 20
+    aimd_interval = WINDOW
+    aimd_min_samples = 10
+    aimd_error_ratio = 0.1
+    aimd_decrease = 0.5
+    aimd_increase = 0.01
+    report_interval = 60
+
+
+@pytest.fixture
+def dropping_server():
+    """
+    每个WINDOW内只正常响应前THRESHOLD个连接，其余连接直接重置，返回(url, {窗口编号: [接受数, 重置数]})
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    counts = dict()
+    stopped = threading.Event()
+
+    def serve():
+        windows = Counter()
+        while not stopped.is_set():
+            try:
+                conn, addr = server.accept()
+            except OSError:
+                return None
+            window = int(time.monotonic() / WINDOW)
+            windows[window] += 1
+            result = counts.setdefault(window, [0, 0])
+            try:
+                if windows[window] > THRESHOLD:
+                    result[1] += 1
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                else:
+                    result[0] += 1
+                    conn.recv(4096)
+                    conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 15\r\nConnection: close\r\n\r\n"
+                                 b"<title>t</title>")
+            except OSError:
+                pass
+            conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/", counts
+    stopped.set()
+    server.close()
+
+
+def _hammer(url: str, seconds: float, threads: int = 8) -> None:
+    deadline = time.monotonic() + seconds
+
+    def worker():
+        session = request.get_session()
+        while time.monotonic() < deadline:
+            request.get_resp(url, session)
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for itm in workers:
+        itm.start()
+    for itm in workers:
+        itm.join()
+
+
+def _drop_ratio(counts: dict, since: int) -> float:
+    accepted = sum(ok for window, (ok, dropped) in counts.items() if window >= since)
+    dropped = sum(dropped for window, (ok, dropped) in counts.items() if window >= since)
+    return dropped / max(1, accepted + dropped)
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_backoff_against_dropping_server(dropping_server, monkeypatch, enabled):
+    url, counts = dropping_server
+    limits = type("Limits", (_Limits,), {"enable": enabled})
+    scheduler = Scheduler(limits)
+    monkeypatch.setattr(request, "scheduler", scheduler)
+    start = int(time.monotonic() / WINDOW)
+    _hammer(url, 3)
+    # 跳过第一秒，此时AIMD还没有收敛
+    ratio = _drop_ratio(counts, start + int(1 / WINDOW))
+    if enabled:
+        assert ratio < 0.3
+        assert scheduler.metrics()["limit"] < 500
+    else:
+        assert ratio > 0.5
+
+
+def test_nmap_max_rate_opt_in(monkeypatch):
+    monkeypatch.setattr(settings.ratelimit, "enable", True)
+    monkeypatch.setattr(netscan.scheduler, "enabled", True)
+    monkeypatch.setattr(settings.ratelimit, "enable_nmap_rate", False)
+    assert "--max-rate" not in netscan._nmap_arguments("10.0.0.0/24", "alive")
+    monkeypatch.setattr(settings.ratelimit, "enable_nmap_rate", True)
+    assert "--max-rate" in netscan._nmap_arguments("10.0.0.0/24", "alive")
@@ -0,0 +1,136 @@
+import time
+import types
+import threading
+from queue import Queue
+
+import pytest
+import urllib3
+
+from airin import pipeline
+from airin import request
+from airin.config import settings
+from conftest import ROOT, send_body
+
+PAGES = ROOT.joinpath("benchmarks", "pages")
+
+
+def _run(func, *args, timeout: float = 20):
+    """
+    在线程中运行，超时视为卡死
+    """
+    result = dict()
+    thread = threading.Thread(target=lambda: result.setdefault("value", func(*args)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{func.__name__} hung"
+    return result.get("value")
+
+
+@pytest.mark.parametrize("extractor", ["fast", "bs4"])
+def test_meta_without_content(monkeypatch, extractor):
+    monkeypatch.setattr(settings.request, "title_extractor", extractor)
+    markup = '<meta name="description"><meta name="keywords" content="kw">'
+    assert request.get_html_title(markup) == "kw"
+    assert request.get_html_title('<meta name="description">') == repr("")
+
+
+@pytest.mark.parametrize("markup", [
+    "<div title='<title>fake</title>'></div><title>real</title>",
+    '<div title="<!--"></div><title>real</title><!-- -->',
+    "<div data-x=<title>fake</title>><title>real</title>",
+])
+def test_fast_title_ignores_tags_in_attributes(monkeypatch, markup):
+    monkeypatch.setattr(settings.request, "title_extractor", "bs4")
+    expected = request.get_html_title(markup)
+    monkeypatch.setattr(settings.request, "title_extractor", "fast")
+    assert request.get_html_title(markup) == expected
+    assert request._fast_html_title(markup) in (None, expected)
+
+
+@pytest.mark.parametrize("page", sorted(PAGES.glob("*.htm*")), ids=lambda path: path.name)
+def test_fast_title_matches_bs4_on_saved_pages(monkeypatch, page):
+    markup = request.decode_content(page.read_bytes())
+    monkeypatch.setattr(settings.request, "title_extractor", "bs4")
+    expected = request.get_html_title(markup)
+    monkeypatch.setattr(settings.request, "title_extractor", "fast")
+    assert request.get_html_title(markup) == expected
+
+
+def test_bulk_request_survives_parse_error(http_server, monkeypatch):
+    base, routes = http_server
+    routes["/"] = lambda handler: send_body(handler, b"<title>x</title>")
+
+    def broken(content):
+        raise KeyError("content")
+    monkeypatch.setattr(request, "parse_content", broken)
+    targets = [{"url": f"{base}/", "cidr": "127.0.0.0/24", "ip": "127.0.0.1", "port": 80}] * 4
+    results = _run(request.run_request, targets)
+    assert len(results) == 4
+    assert all(itm["status"] == 200 for itm in results)
+
+
+def test_http_worker_posts_done_on_error(monkeypatch):
+    def broken(url, session):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(request, "get_resp", broken)
+    worker = types.SimpleNamespace(stages={"http": pipeline._Stage("http", 1)}, http_queue=Queue(),
+                                   events=Queue(), session=None)
+    worker.http_queue.put({"url": "http://127.0.0.1:1/", "cidr": "", "ip": "127.0.0.1", "port": 1})
+    worker.http_queue.put(pipeline._STOP)
+    _run(pipeline.Pipeline._http_worker, worker)
+    events = [worker.events.get() for i in range(worker.events.qsize())]
+    assert [event for event, data in events] == ["http", "http_done"]
+    assert events[0][1]["status"] is None
+
+
+def _drip(handler, chunked: bool = False):
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/html")
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    else:
+        handler.send_header("Content-Length", "100000")
+    handler.end_headers()
+    try:
+        handler.wfile.write(b"<html><head><title>slow" if not chunked else b"17\r\n<html><head><title>slow\r\n")
+        handler.wfile.flush()
+        for i in range(600):
+            time.sleep(0.05)
+            handler.wfile.write(b"x" if not chunked else b"1\r\nx\r\n")
+            handler.wfile.flush()
+    except OSError:
+        pass  # 客户端提前断开
+
+
+def test_huge_body_truncated(http_server, monkeypatch):
+    base, routes = http_server
+    routes["/"] = lambda handler: send_body(handler, b"<html>" + b"a" * (8 << 20))
+    monkeypatch.setattr(settings.request, "max_body_size", 65536)
+    start = time.time()
+    resp = request.get_resp(f"{base}/", request.get_session())
+    assert time.time() - start < 5
+    assert resp.status_code == 200 and resp.truncated is True
+    assert len(resp.content) == 65536
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_slow_drip_body_stops_at_deadline(http_server, monkeypatch, chunked):
+    base, routes = http_server
+    routes["/"] = lambda handler: _drip(handler, chunked)
+    monkeypatch.setattr(settings.request, "max_read_second", 1)
+    start = time.time()
+    resp = request.get_resp(f"{base}/", request.get_session())
+    assert time.time() - start < 3
+    assert resp.truncated is True
+    assert resp.content.startswith(b"<html><head><title>slow")
+    title, status, truncated = request.get_resp_info(resp)
+    assert title.startswith("slow") and status == 200 and truncated is True
+
+
+def test_read_error_marks_truncated(monkeypatch):
+    class Raw(object):
+        def read1(self, amt, decode_content=True):
+            raise urllib3.exceptions.ProtocolError("Connection broken")
+
+    resp = types.SimpleNamespace(raw=Raw(), close=lambda: None)
+    assert request.read_content(resp) == (b"", True)